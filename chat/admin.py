@@ -1,5 +1,8 @@
 from django.contrib import admin
+from django.db.models.expressions import RawSQL
+from .archive import restore_conversation
 from .models import Conversation, Message
+from .search import matching_message_ids
 
 
 class MessageInline(admin.TabularInline):
@@ -10,15 +13,18 @@ class MessageInline(admin.TabularInline):
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'title', 'created_at', 'updated_at', 'message_count']
-    list_filter = ['created_at', 'updated_at']
+    list_display = ['id', 'user', 'title', 'created_at', 'updated_at', 'message_count', 'is_archived']
+    list_filter = ['created_at', 'updated_at', 'is_archived']
     search_fields = ['user__username', 'user__email', 'title']
     inlines = [MessageInline]
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'message_count', 'last_message_at', 'is_archived')
     
-    def message_count(self, obj):
-        return obj.messages.count()
-    message_count.short_description = 'Messages'
+    def get_object(self, request, object_id, from_field=None):
+        conversation = super().get_object(request, object_id, from_field)
+        # The message inline needs the archived messages back in the table
+        if conversation is not None:
+            restore_conversation(conversation)
+        return conversation
 
 
 @admin.register(Message)
@@ -28,6 +34,17 @@ class MessageAdmin(admin.ModelAdmin):
     search_fields = ['content', 'conversation__user__username']
     readonly_fields = ('created_at',)
     
+    def get_search_results(self, request, queryset, search_term):
+        # Content goes through the full-text index; the LIKE scan over every message
+        # is only kept for the username field
+        match = matching_message_ids(search_term)
+        if match is None:
+            return super().get_search_results(request, queryset, search_term)
+        
+        by_content = queryset.filter(pk__in=RawSQL(*match))
+        by_user = queryset.filter(conversation__user__username__icontains=search_term)
+        return by_content | by_user, False
+    
     def content_preview(self, obj):
         return obj.content[:100] + ('...' if len(obj.content) > 100 else '')
     content_preview.short_description = 'Content Preview'
\ No newline at end of file
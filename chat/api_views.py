@@ -1,10 +1,24 @@
+from django.db.models import Prefetch
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import Throttled
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.utils.urls import replace_query_param
+from .archive import restore_conversation
 from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
-from .services import AIService
+from .pagination import KeysetPagination
+from .ratelimit import RateLimitExceeded, check_rate_limit, record_token_usage
+from .search import search_conversations, search_messages
+from .serializers import (
+    ConversationListSerializer,
+    ConversationSearchResultSerializer,
+    ConversationSerializer,
+    MessageSearchResultSerializer,
+    MessageSerializer,
+)
+from .services import AIService, record_exchange
+from .tasks import update_conversation_summary
 
 
 class ConversationViewSet(viewsets.ModelViewSet):
@@ -13,11 +27,39 @@ class ConversationViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Conversation.objects.filter(user=self.request.user)
+        queryset = Conversation.objects.filter(user=self.request.user)
+        
+        if self.action == 'retrieve':
+            return queryset.prefetch_related(
+                Prefetch('messages', queryset=Message.objects.order_by('created_at', 'id'))
+            )
+        
+        # The list reads only denormalized Conversation columns, messages are never loaded
+        return queryset
+    
+    def get_object(self):
+        conversation = super().get_object()
+        # Opening an archived conversation brings its messages back (chat/archive.py)
+        if self.action != 'destroy' and restore_conversation(conversation):
+            # Read again so the prefetched messages include the restored ones
+            conversation = super().get_object()
+        return conversation
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ConversationListSerializer
+        return ConversationSerializer
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
     
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
+    def messages(self, request, pk=None):
+        """Messages of the conversation, newest first, keyset-paginated"""
+        conversation = self.get_object()
+        page = self.paginate_queryset(conversation.messages.all())
+        return self.get_paginated_response(MessageSerializer(page, many=True).data)
+    
     @action(detail=True, methods=['post'])
     def send_message(self, request, pk=None):
         """Send a message to the conversation"""
@@ -27,24 +69,25 @@ class ConversationViewSet(viewsets.ModelViewSet):
         if not message_content:
             return Response({'error': 'Message cannot be empty'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Save user message
-        user_message = Message.objects.create(
-            conversation=conversation,
-            content=message_content,
-            is_from_user=True
-        )
+        try:
+            check_rate_limit(request.user)
+        except RateLimitExceeded as e:
+            # DRF turns Throttled into a 429 with Retry-After
+            raise Throttled(wait=e.retry_after, detail=f"Rate limit exceeded ({e.reason}).")
         
         # Generate AI response
         ai_service = AIService()
-        conversation_history = conversation.messages.order_by('created_at')
-        ai_response = ai_service.generate_response(message_content, conversation_history)
-        
-        # Save AI response
-        ai_message = Message.objects.create(
-            conversation=conversation,
-            content=ai_response,
-            is_from_user=False
+        conversation_history = conversation.recent_history()
+        ai_response = ai_service.generate_response(
+            message_content, conversation_history, summary=conversation.summary
+        )
+        
+        # Save both messages in one short transaction, after the upstream call
+        conversation, user_message, ai_message = record_exchange(
+            request.user, conversation, message_content, ai_response
         )
+        record_token_usage(request.user, ai_service.prompt_tokens, ai_message)
+        update_conversation_summary.enqueue(conversation.id)
         
         return Response({
             'user_message': MessageSerializer(user_message).data,
@@ -53,9 +96,55 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
 
 class MessageViewSet(viewsets.ReadOnlyModelViewSet):
-    """API ViewSet for messages"""
+    """API ViewSet for messages (newest first, keyset-paginated)"""
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
-        return Message.objects.filter(conversation__user=self.request.user)
\ No newline at end of file
+        # Served by the (user, created_at, id) index: each page is a range scan, no sort
+        return Message.objects.filter(user=self.request.user)
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Full-text search over the user's messages and conversation titles.
+    
+    GET /api/search/?q=<text>[&page=<n>][&page_size=<n>] returns ranked
+    message hits, paginated, plus the best matching conversations on page 1.
+    """
+    permission_classes = [IsAuthenticated]
+    page_size = 20
+    max_page_size = 100
+    max_conversations = 10
+    
+    def _int_param(self, name, default, maximum):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            return default
+        return max(1, min(value, maximum))
+    
+    def list(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Search query (q) is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        page = self._int_param('page', 1, 10_000)
+        page_size = self._int_param('page_size', self.page_size, self.max_page_size)
+        
+        # One extra hit tells us whether there is a next page without a COUNT
+        messages = search_messages(request.user, query, limit=page_size + 1, offset=(page - 1) * page_size)
+        next_link = None
+        if len(messages) > page_size:
+            messages = messages[:page_size]
+            next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1)
+        
+        conversations = search_conversations(request.user, query, self.max_conversations) if page == 1 else []
+        
+        return Response({
+            'query': query,
+            'next': next_link,
+            'conversations': ConversationSearchResultSerializer(conversations, many=True).data,
+            'results': MessageSearchResultSerializer(messages, many=True).data,
+        })
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'chat'
\ No newline at end of file
+    name = 'chat'
+    
+    def ready(self):
+        from genai_project.db import apply_sqlite_pragmas
+        from .metrics import install_query_recorder
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='genai_project.db.apply_sqlite_pragmas')
+        connection_created.connect(install_query_recorder, dispatch_uid='chat.metrics.install_query_recorder')
@@ -0,0 +1,183 @@
+"""
+Archival of inactive conversations' messages into compressed blobs.
+
+archive_conversations() moves every message of a conversation into one
+ConversationArchive row (a JSON list, compressed with zlib or, when the
+zstandard package is installed, zstd) and marks the conversation
+is_archived, so chat_message and its indexes only hold live history. The
+denormalized counters and previews stay on Conversation, so conversation
+lists are unaffected; archived messages are left out of search.
+
+restore_conversation() puts the messages back with their original ids and
+timestamps. The views call it whenever a conversation is opened, so apart
+from the first load being a little slower, archival is invisible to users.
+Restores are stamped in restored_at, and a restored conversation is only
+archived again once that is older than the inactivity cutoff too.
+"""
+import json
+import logging
+import zlib
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+from .metrics import REGISTRY, Counter
+from .models import Conversation, ConversationArchive, Message, bulk_create_with_timestamps
+
+logger = logging.getLogger(__name__)
+
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+CODECS = (ZLIB, ZSTD)
+
+archive_operations = REGISTRY.register(Counter(
+    'chat_archive_conversations', "Conversations moved into or out of the archive", ['operation'],
+))
+
+
+def get_codec(codec=None):
+    """The codec to archive with: codec if given, else CHAT_ARCHIVE_CODEC"""
+    codec = codec or getattr(settings, 'CHAT_ARCHIVE_CODEC', ZLIB)
+    if codec not in CODECS:
+        raise ImproperlyConfigured(f"Unknown archive codec '{codec}'; use one of {', '.join(CODECS)}")
+    if codec == ZSTD and zstandard is None:
+        raise ImproperlyConfigured("The zstd archive codec needs the zstandard package")
+    return codec
+
+
+def compress(data, codec):
+    level = getattr(settings, 'CHAT_ARCHIVE_COMPRESSION_LEVEL', None)
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=level or 10).compress(data)
+    return zlib.compress(data, level or 6)
+
+
+def decompress(data, codec):
+    data = bytes(data)  # BinaryField values are memoryviews on some backends
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ImproperlyConfigured("This conversation was archived with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def archived_messages(archive):
+    """(id, is_from_user, content, created_at, token_count) of an archive's messages, oldest first"""
+    for pk, is_from_user, content, created_at, token_count in json.loads(decompress(archive.data, archive.codec)):
+        yield pk, is_from_user, content, parse_datetime(created_at), token_count
+
+
+def _encode(messages):
+    return json.dumps(
+        [[pk, is_from_user, content, created_at.isoformat(), token_count]
+         for pk, is_from_user, content, created_at, token_count in messages],
+        separators=(',', ':'),
+    ).encode('utf-8')
+
+
+def archive_conversations(conversation_ids, inactive_before, codec=None):
+    """
+    Archive the messages of the given conversations, in one transaction.
+    
+    Conversations updated or restored since inactive_before, already archived
+    or without messages are skipped. Returns (conversations, messages, raw bytes, stored
+    bytes) archived.
+    """
+    codec = get_codec(codec)
+    with transaction.atomic():
+        # Re-checked under the row locks (PostgreSQL): a message may have arrived since selection
+        ids = list(Conversation.objects.select_for_update().filter(
+            pk__in=conversation_ids, is_archived=False, updated_at__lt=inactive_before,
+        ).exclude(restored_at__gte=inactive_before).values_list('pk', flat=True))
+        if not ids:
+            return 0, 0, 0, 0
+        
+        rows = Message.objects.filter(conversation_id__in=ids).order_by(
+            'conversation_id', 'created_at', 'pk'
+        ).values_list('conversation_id', 'pk', 'is_from_user', 'content', 'created_at', 'token_count')
+        archives = []
+        message_count = raw_size = stored_size = max_pk = 0
+        for conversation_id, group in groupby(rows, key=itemgetter(0)):
+            messages = [row[1:] for row in group]
+            data = _encode(messages)
+            blob = compress(data, codec)
+            archives.append(ConversationArchive(
+                conversation_id=conversation_id,
+                codec=codec,
+                data=blob,
+                message_count=len(messages),
+                raw_size=len(data),
+            ))
+            message_count += len(messages)
+            raw_size += len(data)
+            stored_size += len(blob)
+            max_pk = max(max_pk, max(message[0] for message in messages))
+        if not archives:
+            return 0, 0, 0, 0
+        
+        ConversationArchive.objects.bulk_create(archives)
+        # The plain QuerySet.delete(): MessageQuerySet.delete() would reset the counters that
+        # keep archived conversations listed as before. Bounded by max_pk so nothing unread goes.
+        models.QuerySet.delete(Message.objects.filter(conversation_id__in=ids, pk__lte=max_pk))
+        # update() leaves updated_at alone and the sidebar doesn't show is_archived: cached sidebars stay valid
+        Conversation.objects.filter(pk__in=[archive.conversation_id for archive in archives]).update(is_archived=True)
+    
+    archive_operations.inc(len(archives), operation='archived')
+    return len(archives), message_count, raw_size, stored_size
+
+
+def restore_conversation(conversation):
+    """
+    Move an archived conversation's messages back into chat_message; returns how many.
+    
+    conversation.is_archived is trusted to skip live conversations without a
+    query, so pass an instance read from the database, not a cached one.
+    """
+    if not conversation.is_archived:
+        return 0
+    
+    with transaction.atomic():
+        # Claiming the flag first makes a concurrent restore wait here, then find nothing to do
+        # restored_at rather than updated_at: reading a conversation doesn't reorder the sidebar
+        restored_at = timezone.now()
+        claimed = Conversation.objects.filter(pk=conversation.pk, is_archived=True).update(
+            is_archived=False, restored_at=restored_at,
+        )
+        conversation.is_archived = False
+        conversation.restored_at = restored_at
+        if not claimed:
+            return 0
+        archive = ConversationArchive.objects.filter(pk=conversation.pk).first()
+        if archive is None:
+            return 0
+        rows = [
+            (Message(
+                pk=pk,
+                conversation_id=conversation.pk,
+                user_id=conversation.user_id,
+                content=content,
+                is_from_user=is_from_user,
+                token_count=token_count,
+            ), created_at)
+            for pk, is_from_user, content, created_at, token_count in archived_messages(archive)
+        ]
+        # Skips Message.save() and its per-message counter UPDATE
+        bulk_create_with_timestamps(Message, rows, ['created_at'])
+        archive.delete()
+        # Counters were kept at archive time, but messages written or deleted since then
+        # (mid-archival inserts) are only accounted for once everything is back
+        Conversation.objects.filter(pk=conversation.pk).refresh_message_stats()
+    
+    archive_operations.inc(operation='restored')
+    logger.info(f"Restored {len(rows)} archived messages of conversation {conversation.pk}")
+    return len(rows)
@@ -0,0 +1,93 @@
+"""
+Helpers shared by the chat benchmark management commands.
+
+Benchmarks always run against a throwaway test database created from the
+migrations, never against the configured database.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from .metrics import percentile
+from .models import Conversation, Message
+
+
+@contextmanager
+def benchmark_database(verbosity=0, test_name=None):
+    """
+    Create a fresh test database for the duration of the block.
+    
+    test_name overrides the TEST NAME setting, e.g. to put a SQLite benchmark
+    on disk instead of in memory.
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if test_name:
+        test_settings['NAME'] = test_name
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+        test_settings['NAME'] = old_test_name
+
+
+def seed_chat_data(users, conversations_per_user, messages_per_conversation, batch_size=5000):
+    """Bulk-insert users with conversations and alternating user/AI messages; returns the users"""
+    User = get_user_model()
+    User.objects.bulk_create(
+        [
+            User(username=f'bench{i}', email=f'bench{i}@example.com', password='!')
+            for i in range(users)
+        ],
+        batch_size=batch_size,
+    )
+    seeded_users = list(User.objects.filter(username__startswith='bench').order_by('pk'))
+    
+    Conversation.objects.bulk_create(
+        [
+            Conversation(user=user, title=f'Benchmark conversation {i}')
+            for user in seeded_users
+            for i in range(conversations_per_user)
+        ],
+        batch_size=batch_size,
+    )
+    
+    batch = []
+    for conversation_id, user_id in Conversation.objects.order_by('pk').values_list('pk', 'user_id').iterator():
+        for i in range(messages_per_conversation):
+            content = f'Benchmark message {i} ' + 'lorem ipsum ' * (i % 20)
+            batch.append(Message(
+                conversation_id=conversation_id,
+                user_id=user_id,
+                content=content,
+                is_from_user=i % 2 == 0,
+                token_count=len(content) // 4,
+            ))
+        if len(batch) >= batch_size:
+            Message.objects.bulk_create(batch, batch_size=batch_size)
+            batch = []
+    if batch:
+        Message.objects.bulk_create(batch, batch_size=batch_size)
+    
+    # bulk_create skips Message.save(), so fill the denormalized counters in one pass
+    Conversation.objects.refresh_message_stats()
+    return seeded_users
+
+
+def time_call(func, repeat):
+    """Run func repeat times; return timing summary in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'median': statistics.median(timings),
+        'p95': percentile(timings, 95),
+        'max': max(timings),
+    }
@@ -0,0 +1,90 @@
+"""
+Opt-in cache of Euron API responses.
+
+Entries are keyed on a hash of the model and the full ``messages`` payload, so
+only byte-identical requests (same system prompt, context and message) share a
+response. Storage, TTL and LRU eviction come from the Django cache alias named
+by AI_RESPONSE_CACHE_ALIAS (a bounded LocMemCache by default). Hits and
+misses are exported on /metrics as chat_ai_response_cache_lookups.
+"""
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import REGISTRY, Counter
+
+logger = logging.getLogger(__name__)
+
+cache_lookups = REGISTRY.register(Counter(
+    'chat_ai_response_cache_lookups', "AI response cache lookups by result", ['result'],
+))
+
+
+def make_request_key(model, messages):
+    """Stable hash of a chat completion request"""
+    payload = json.dumps({'model': model, 'messages': messages}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _is_cacheable(response_data):
+    """Only successful completions with content are cached, never errors"""
+    try:
+        return bool(response_data['choices'][0]['message']['content'].strip())
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return False
+
+
+class ResponseCache:
+    """Cache layer in front of AIService._make_api_request"""
+    
+    @property
+    def enabled(self):
+        return getattr(settings, 'AI_RESPONSE_CACHE_ENABLED', False)
+    
+    @property
+    def backend(self):
+        return caches[getattr(settings, 'AI_RESPONSE_CACHE_ALIAS', 'ai_responses')]
+    
+    @property
+    def max_entry_bytes(self):
+        return getattr(settings, 'AI_RESPONSE_CACHE_MAX_ENTRY_BYTES', 64 * 1024)
+    
+    def _key(self, model, messages):
+        return f'ai-response:{make_request_key(model, messages)}'
+    
+    def _encode(self, response_data):
+        """Serialized entry, or None if it is not cacheable or over the size cap"""
+        if not _is_cacheable(response_data):
+            return None
+        encoded = json.dumps(response_data, separators=(',', ':'))
+        if len(encoded.encode('utf-8')) > self.max_entry_bytes:
+            logger.debug("Skipping AI response cache entry larger than AI_RESPONSE_CACHE_MAX_ENTRY_BYTES")
+            return None
+        return encoded
+    
+    def get(self, model, messages):
+        """Return the cached response for this request, or None"""
+        encoded = self.backend.get(self._key(model, messages))
+        cache_lookups.inc(result='hit' if encoded is not None else 'miss')
+        return json.loads(encoded) if encoded is not None else None
+    
+    def set(self, model, messages, response_data):
+        encoded = self._encode(response_data)
+        if encoded is not None:
+            self.backend.set(self._key(model, messages), encoded)
+    
+    async def aget(self, model, messages):
+        encoded = await self.backend.aget(self._key(model, messages))
+        cache_lookups.inc(result='hit' if encoded is not None else 'miss')
+        return json.loads(encoded) if encoded is not None else None
+    
+    async def aset(self, model, messages, response_data):
+        encoded = self._encode(response_data)
+        if encoded is not None:
+            await self.backend.aset(self._key(model, messages), encoded)
+
+
+response_cache = ResponseCache()
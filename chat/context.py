@@ -0,0 +1,103 @@
+"""
+Token-budget-aware prompt construction.
+
+Instead of a fixed number of recent messages, ContextBuilder packs the newest
+turns of a conversation into a token budget, truncating any single message
+that is too large. Token counts are estimated locally and cached on
+Message.token_count so they are computed once per message, not once per turn.
+"""
+import math
+
+from django.conf import settings
+
+# Roughly 4 characters per token for English text with GPT-style tokenizers
+CHARS_PER_TOKEN = 4
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+TRUNCATION_MARKER = "\n\n[... message truncated ...]"
+
+
+def estimate_tokens(text):
+    """Cheap local estimate of the number of tokens in text"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens, marking that it was truncated"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep_chars = max(0, max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER))
+    return text[:keep_chars].rstrip() + TRUNCATION_MARKER
+
+
+class ContextBuilder:
+    """Build chat completion messages that fit within a token budget"""
+    
+    def __init__(self, token_budget=None, max_message_tokens=None, max_messages=None):
+        self.token_budget = token_budget or getattr(settings, 'CHAT_CONTEXT_TOKEN_BUDGET', 3000)
+        self.max_message_tokens = max_message_tokens or getattr(settings, 'CHAT_CONTEXT_MAX_MESSAGE_TOKENS', 800)
+        # Upper bound on rows scanned per turn, however short they are
+        self.max_messages = max_messages or getattr(settings, 'CHAT_CONTEXT_MAX_MESSAGES', 50)
+        # Estimated size of the messages returned by the last build()
+        self.prompt_tokens = 0
+    
+    def _recent_messages(self, conversation_history):
+        """Newest-first history rows, with any missing token counts filled in"""
+        recent = list(
+            conversation_history
+            .only('id', 'conversation_id', 'content', 'is_from_user', 'token_count')
+            .order_by('-created_at', '-id')[:self.max_messages]
+        )
+        
+        missing = [msg for msg in recent if msg.token_count is None]
+        if missing:
+            # Rows saved before token counts were tracked: estimate once and store
+            for msg in missing:
+                msg.token_count = estimate_tokens(msg.content)
+            type(missing[0]).objects.bulk_update(missing, ['token_count'])
+        return recent
+    
+    def build(self, system_prompt, message, conversation_history=None, summary=''):
+        """
+        Return [system, (summary), *history, user] messages whose estimated size
+        fits the budget. The system prompt, summary of earlier turns and current
+        message are always included; the newest history turns fill whatever
+        budget remains. Their estimated size is left in self.prompt_tokens.
+        """
+        remaining = self.token_budget
+        remaining -= estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        remaining -= estimate_tokens(message) + MESSAGE_OVERHEAD_TOKENS
+        
+        preamble = [{"role": "system", "content": system_prompt}]
+        if summary:
+            summary_content = f"Summary of the earlier conversation:\n{summary}"
+            remaining -= estimate_tokens(summary_content) + MESSAGE_OVERHEAD_TOKENS
+            preamble.append({"role": "system", "content": summary_content})
+        
+        history = []
+        if conversation_history is not None and remaining > 0:
+            for msg in self._recent_messages(conversation_history):
+                content = msg.content
+                tokens = msg.token_count
+                if tokens > self.max_message_tokens:
+                    content = truncate_to_tokens(content, self.max_message_tokens)
+                    tokens = self.max_message_tokens
+                
+                cost = tokens + MESSAGE_OVERHEAD_TOKENS
+                if cost > remaining:
+                    break
+                remaining -= cost
+                role = "user" if msg.is_from_user else "assistant"
+                history.append({"role": role, "content": content})
+            history.reverse()  # Put them in chronological order
+        
+        self.prompt_tokens = self.token_budget - remaining
+        return [
+            *preamble,
+            *history,
+            {"role": "user", "content": message},
+        ]
@@ -0,0 +1,26 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+
+
+def async_login_required(view_func):
+    """
+    login_required for async views.
+    
+    Django 4.2's auth decorators only wrap sync views, and resolving
+    request.user touches the session and database, so it is done in a thread.
+    """
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def async_csrf_exempt(view_func):
+    """csrf_exempt for async views (Django 4.2's csrf_exempt wraps views in a sync function)"""
+    view_func.csrf_exempt = True
+    return view_func
@@ -0,0 +1,206 @@
+"""
+Streaming JSON Lines export and batched import of chat history.
+
+An export is one JSON object per line: a header, then every conversation
+followed by its messages in order.
+
+    {"type": "export", "version": 1, "exported_at": "..."}
+    {"type": "conversation", "id": 7, "user": "a@example.com", "title": "...", "created_at": "...", "updated_at": "..."}
+    {"type": "message", "id": 31, "conversation": 7, "is_from_user": true, "content": "...", "created_at": "..."}
+
+export_lines() uses constant memory however long the history is: one query
+streams the conversations and one the messages, both through chunked
+iterator() cursors, merged on the conversation id; archived conversations'
+messages are read from their archive (chat/archive.py). import_lines() reads the
+format back with bulk_create in batches; ids are reassigned, timestamps kept.
+Rolling summaries are left out: they are derived from the messages and track
+them by id, so imported conversations build theirs afresh on the next send.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .archive import archived_messages
+from .context import estimate_tokens
+from .models import Conversation, ConversationArchive, Message, bulk_create_with_timestamps
+from .sidebar import invalidate_sidebar
+
+EXPORT_VERSION = 1
+
+
+def _line(record):
+    return json.dumps(record) + '\n'
+
+
+def _message_line(conversation_pk, pk, is_from_user, content, created_at):
+    return _line({
+        'type': 'message',
+        'id': pk,
+        'conversation': conversation_pk,
+        'is_from_user': is_from_user,
+        'content': content,
+        'created_at': created_at.isoformat(),
+    })
+
+
+def export_lines(user=None, chunk_size=2000):
+    """Yield the JSONL export of user's conversations, or of every user's with user=None"""
+    conversations = Conversation.objects.order_by('pk')
+    messages = Message.objects.order_by('conversation_id', 'created_at', 'pk')
+    if user is not None:
+        conversations = conversations.filter(user=user)
+        # IN rather than a join: the (conversation, created_at, id) index then yields
+        # messages already in order, instead of the database sorting the whole history
+        messages = messages.filter(conversation__in=conversations.values('pk'))
+    
+    yield _line({'type': 'export', 'version': EXPORT_VERSION, 'exported_at': timezone.now().isoformat()})
+    
+    conversation_rows = conversations.values_list(
+        'pk', 'user__email', 'title', 'created_at', 'updated_at', 'is_archived'
+    ).iterator(chunk_size=chunk_size)
+    message_rows = messages.values_list(
+        'conversation_id', 'pk', 'is_from_user', 'content', 'created_at'
+    ).iterator(chunk_size=chunk_size)
+    
+    message = next(message_rows, None)
+    for pk, email, title, created_at, updated_at, is_archived in conversation_rows:
+        yield _line({
+            'type': 'conversation',
+            'id': pk,
+            'user': email,
+            'title': title,
+            'created_at': created_at.isoformat(),
+            'updated_at': updated_at.isoformat(),
+        })
+        if is_archived:
+            archive = ConversationArchive.objects.filter(pk=pk).first()
+            for message_pk, is_from_user, content, message_created_at, _ in (
+                archived_messages(archive) if archive else ()
+            ):
+                yield _message_line(pk, message_pk, is_from_user, content, message_created_at)
+        # Messages of conversations deleted between the two queries are skipped
+        while message is not None and message[0] <= pk:
+            conversation_id, message_pk, is_from_user, content, message_created_at = message
+            if conversation_id == pk:
+                yield _message_line(pk, message_pk, is_from_user, content, message_created_at)
+            message = next(message_rows, None)
+
+
+class InvalidExportError(ValueError):
+    """An import line that cannot be read; the message names the line number"""
+
+
+class _Importer:
+    """Buffers imported rows and writes them with bulk_create once a batch is full"""
+    
+    def __init__(self, user, batch_size):
+        self.user = user
+        self.batch_size = batch_size
+        self.users = {}
+        self.conversations = {}  # Exported id -> Conversation, for the messages that follow
+        self.pending_conversations = []
+        self.pending_messages = []
+        self.imported_ids = []
+        self.owner_ids = set()
+        self.message_count = 0
+    
+    def _owner(self, email, number):
+        if self.user is not None:
+            return self.user
+        if email not in self.users:
+            User = get_user_model()
+            try:
+                self.users[email] = User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise InvalidExportError(f"Line {number}: no user with email {email!r}")
+        return self.users[email]
+    
+    def add(self, record, number):
+        kind = record.get('type')
+        if kind == 'conversation':
+            conversation = Conversation(
+                user=self._owner(record.get('user'), number),
+                title=record.get('title', ''),
+            )
+            # Only the newest conversation's messages are still to come
+            self.conversations = {record.get('id'): conversation}
+            self.pending_conversations.append((
+                conversation,
+                _parse_datetime(record, 'created_at', number),
+                _parse_datetime(record, 'updated_at', number),
+            ))
+        elif kind == 'message':
+            conversation = self.conversations.get(record.get('conversation'))
+            if conversation is None:
+                raise InvalidExportError(f"Line {number}: message before its conversation")
+            content = record.get('content', '')
+            message = Message(
+                conversation=conversation,
+                user=conversation.user,
+                content=content,
+                is_from_user=bool(record.get('is_from_user')),
+                token_count=estimate_tokens(content),
+            )
+            self.pending_messages.append((message, _parse_datetime(record, 'created_at', number)))
+        elif kind == 'export':
+            if record.get('version', EXPORT_VERSION) > EXPORT_VERSION:
+                raise InvalidExportError(f"Line {number}: unsupported export version {record.get('version')}")
+            return
+        else:
+            raise InvalidExportError(f"Line {number}: unknown record type {kind!r}")
+        
+        if len(self.pending_conversations) >= self.batch_size or len(self.pending_messages) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        if self.pending_conversations:
+            bulk_create_with_timestamps(Conversation, self.pending_conversations, ['created_at', 'updated_at'])
+            self.imported_ids.extend(row[0].pk for row in self.pending_conversations)
+            self.owner_ids.update(row[0].user_id for row in self.pending_conversations)
+            self.pending_conversations = []
+        if self.pending_messages:
+            # Skips Message.save() and its per-message counter UPDATE; see finish()
+            bulk_create_with_timestamps(Message, self.pending_messages, ['created_at'])
+            self.message_count += len(self.pending_messages)
+            self.pending_messages = []
+    
+    def finish(self):
+        self.flush()
+        # Fill the denormalized counters and previews once per batch of conversations
+        for start in range(0, len(self.imported_ids), self.batch_size):
+            Conversation.objects.filter(pk__in=self.imported_ids[start:start + self.batch_size]).refresh_message_stats()
+        invalidate_sidebar(*self.owner_ids)
+        return len(self.imported_ids), self.message_count
+
+
+def _parse_datetime(record, field, number):
+    value = parse_datetime(record.get(field) or '')
+    if value is None:
+        raise InvalidExportError(f"Line {number}: missing or invalid {field}")
+    return value
+
+
+def import_lines(lines, user=None, batch_size=1000):
+    """
+    Import JSONL export lines; returns (conversations, messages) imported.
+    
+    Conversations go to user, or with user=None to the user whose email the
+    export records for each one. Runs in one transaction, so a bad line
+    imports nothing.
+    """
+    importer = _Importer(user, batch_size)
+    with transaction.atomic():
+        for number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise InvalidExportError(f"Line {number}: invalid JSON ({e})")
+            importer.add(record, number)
+        return importer.finish()
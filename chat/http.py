@@ -0,0 +1,149 @@
+"""
+Process-wide pooled HTTP clients for the Euron API.
+
+Every AIService instance shares one requests.Session (and one httpx.AsyncClient
+per event loop for AsyncAIService), so connections to the upstream are kept
+alive and reused instead of paying a TCP+TLS handshake on every call.
+"""
+import asyncio
+import logging
+import random
+import threading
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx is optional
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses whose Retry-After header says how long to wait before retrying
+RETRY_AFTER_STATUSES = (429, 503)
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_timeout():
+    """(connect, read) timeout tuple for upstream requests"""
+    return (
+        _setting('EURON_HTTP_CONNECT_TIMEOUT', 5),
+        _setting('EURON_HTTP_READ_TIMEOUT', 30),
+    )
+
+
+def get_max_retries():
+    return _setting('EURON_HTTP_MAX_RETRIES', 2)
+
+
+def get_backoff_max():
+    """Longest wait before a retry, whether it comes from the backoff or a Retry-After header"""
+    return _setting('EURON_HTTP_BACKOFF_MAX', 30)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None if missing or invalid"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_retry_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before the given (1-based) retry attempt: the upstream's
+    Retry-After header if it sent a valid one, else exponential backoff with
+    jitter. Either way capped at EURON_HTTP_BACKOFF_MAX.
+    """
+    delay = parse_retry_after(retry_after)
+    if delay is None:
+        backoff = _setting('EURON_HTTP_BACKOFF_FACTOR', 0.5) * (2 ** (attempt - 1))
+        delay = backoff + random.uniform(0, _setting('EURON_HTTP_BACKOFF_JITTER', 0.25))
+    return min(delay, get_backoff_max())
+
+
+def _build_session():
+    retry = Retry(
+        total=get_max_retries(),
+        connect=get_max_retries(),
+        read=0,  # A read timeout means the completion was slow, not lost; don't resend it
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['POST']),
+        backoff_factor=_setting('EURON_HTTP_BACKOFF_FACTOR', 0.5),
+        backoff_max=get_backoff_max(),
+        backoff_jitter=_setting('EURON_HTTP_BACKOFF_JITTER', 0.25),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=_setting('EURON_HTTP_POOL_CONNECTIONS', 4),
+        pool_maxsize=_setting('EURON_HTTP_POOL_SIZE', 20),
+        max_retries=retry,
+        pool_block=False,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_http_session():
+    """Return the shared requests.Session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_async_http_client():
+    """
+    Return the shared httpx.AsyncClient for the running event loop.
+    
+    httpx clients are bound to the loop they were first used on, so one is
+    kept per loop (a single loop for the lifetime of an ASGI worker).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        connect_timeout, read_timeout = get_timeout()
+        pool_size = _setting('EURON_HTTP_POOL_SIZE', 20)
+        # The limits go on the transport: httpx ignores the client's once a transport is given
+        transport = httpx.AsyncHTTPTransport(
+            retries=get_max_retries(),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=_setting('EURON_HTTP_KEEPALIVE_EXPIRY', 60),
+            ),
+        )
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=transport,
+        )
+        _async_clients[loop] = client
+    return client
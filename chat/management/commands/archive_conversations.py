@@ -0,0 +1,98 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.archive import archive_conversations, get_codec, restore_conversation
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the messages of conversations inactive for --inactive-days into compressed archive rows, "
+        "a chunk of conversations per transaction with a pause in between. Progress lines show the "
+        "--after-id to resume from. --restore moves archived messages back instead."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-days', type=int, default=getattr(settings, 'CHAT_ARCHIVE_INACTIVE_DAYS', 180),
+                            help="Archive conversations not updated for this many days")
+        parser.add_argument('--batch-size', type=int, default=100, help="Conversations archived per transaction")
+        parser.add_argument('--sleep', type=float, default=0.5,
+                            help="Seconds to pause between chunks, leaving the database to live traffic")
+        parser.add_argument('--codec', help="zlib or zstd (default: CHAT_ARCHIVE_CODEC)")
+        parser.add_argument('--after-id', type=int, default=0, help="Resume after this conversation id")
+        parser.add_argument('--limit', type=int, help="Stop after this many conversations")
+        parser.add_argument('--restore', action='store_true', help="Restore every archived conversation")
+    
+    def _chunks(self, queryset, options):
+        """Lists of candidate ids in id order, batch_size at a time, keyset-paginated"""
+        last_pk = options['after_id']
+        remaining = options['limit']
+        while remaining is None or remaining > 0:
+            size = options['batch_size'] if remaining is None else min(options['batch_size'], remaining)
+            ids = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:size])
+            if not ids:
+                return
+            yield ids
+            last_pk = ids[-1]
+            if remaining is not None:
+                remaining -= len(ids)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+    
+    def handle(self, *args, **options):
+        if options['restore']:
+            return self._restore(options)
+        try:
+            codec = get_codec(options['codec'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        
+        cutoff = timezone.now() - timedelta(days=options['inactive_days'])
+        # Recently restored conversations were just read; archiving them again would only churn
+        candidates = Conversation.objects.filter(
+            is_archived=False, updated_at__lt=cutoff, message_count__gt=0,
+        ).exclude(restored_at__gte=cutoff)
+        start = time.monotonic()
+        conversations = messages = raw_size = stored_size = 0
+        for ids in self._chunks(candidates, options):
+            archived = archive_conversations(ids, cutoff, codec)
+            conversations += archived[0]
+            messages += archived[1]
+            raw_size += archived[2]
+            stored_size += archived[3]
+            if options['verbosity'] > 0:
+                self.stdout.write(
+                    f"  ... {conversations} conversations, {messages} messages archived "
+                    f"(resume with --after-id {ids[-1]})"
+                )
+        
+        elapsed = time.monotonic() - start
+        ratio = raw_size / stored_size if stored_size else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {messages} messages of {conversations} conversations in {elapsed:.1f}s "
+            f"({messages / elapsed if elapsed else 0:.0f} messages/s): {raw_size / 1e6:.1f} MB stored as "
+            f"{stored_size / 1e6:.1f} MB with {codec} ({ratio:.1f}x)"
+        ))
+    
+    def _restore(self, options):
+        start = time.monotonic()
+        conversations = messages = 0
+        for ids in self._chunks(Conversation.objects.filter(is_archived=True), options):
+            for conversation in Conversation.objects.filter(pk__in=ids):
+                messages += restore_conversation(conversation)
+                conversations += 1
+            if options['verbosity'] > 0:
+                self.stdout.write(
+                    f"  ... {conversations} conversations, {messages} messages restored "
+                    f"(resume with --after-id {ids[-1]})"
+                )
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {messages} messages of {conversations} conversations in {elapsed:.1f}s"
+        ))
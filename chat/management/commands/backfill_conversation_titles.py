@@ -0,0 +1,174 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Concat, Length, Substr
+
+from chat.archive import archived_messages
+from chat.models import Conversation, ConversationArchive, Message
+from chat.services import AIService
+from chat.sidebar import invalidate_sidebar
+
+
+class Throttle:
+    """Spaces calls from any number of threads evenly at rate per second"""
+    
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        time.sleep(slot - now)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate titles for conversations that have none (or only the truncated first message, "
+        "with --include-truncated), calling the AI concurrently and writing titles back in batches. "
+        "Archived conversations are titled from their archive without restoring them. A title set "
+        "while the command runs is never overwritten. Progress lines show the --after-id to resume from."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Titles written per transaction")
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'EURON_MAX_CONCURRENT_REQUESTS', 8),
+                            help="Concurrent title requests (default: the upstream bulkhead size)")
+        parser.add_argument('--rate', type=float, default=20, help="Max title requests per second (0 for no limit)")
+        parser.add_argument('--after-id', type=int, default=0, help="Resume after this conversation id")
+        parser.add_argument('--limit', type=int, help="Stop after this many conversations")
+        parser.add_argument('--include-truncated', action='store_true',
+                            help="Also retitle conversations whose title is the truncated first message")
+    
+    def _candidates(self, options):
+        """
+        Conversations to title, in id order, as (pk, user_id, title, first user
+        message, is_archived). Archived ones are only filtered on their title:
+        their messages are not in chat_message, so see _with_archived_first_messages.
+        """
+        first_message = Message.objects.filter(
+            conversation=OuterRef('pk'), is_from_user=True
+        ).order_by('created_at', 'id').values('content')[:1]
+        queryset = Conversation.objects.annotate(
+            first_message=Subquery(first_message)
+        ).filter(pk__gt=options['after_id'])
+        
+        needs_title = Q(title='')
+        if options['include_truncated']:
+            # Same as AIService._fallback_title, computed in SQL
+            queryset = queryset.annotate(first_length=Length('first_message')).annotate(
+                fallback_title=Case(
+                    When(first_length__gt=30, then=Concat(Substr('first_message', 1, 30), Value('...'))),
+                    default=F('first_message'),
+                    output_field=models.TextField(),
+                )
+            )
+            needs_title |= Q(title=F('fallback_title'))
+        archived = Q(is_archived=True) if options['include_truncated'] else Q(is_archived=True, title='')
+        
+        queryset = queryset.filter(Q(first_message__isnull=False) & needs_title | archived).order_by('pk').values_list(
+            'pk', 'user_id', 'title', 'first_message', 'is_archived'
+        )
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        return queryset
+    
+    def _with_archived_first_messages(self, service, batch):
+        """
+        The batch's rows as (pk, user_id, title, first_message), with archived
+        conversations' first messages read from their archives and those that
+        turn out not to need a title dropped.
+        """
+        archived = [pk for pk, _, _, _, is_archived in batch if is_archived]
+        first_messages = {}
+        for archive in ConversationArchive.objects.filter(pk__in=archived):
+            first_messages[archive.pk] = next(
+                (content for _, is_from_user, content, _, _ in archived_messages(archive) if is_from_user), None
+            )
+        
+        rows = []
+        for pk, user_id, title, first_message, is_archived in batch:
+            if is_archived:
+                first_message = first_messages.get(pk) or first_message
+                if not first_message or (title and title != service._fallback_title(first_message)):
+                    continue
+            rows.append((pk, user_id, title, first_message))
+        return rows
+    
+    def handle(self, *args, **options):
+        service = AIService()
+        if not service.api_key:
+            raise CommandError("EURON_API_KEY is not configured; titles would only be truncated messages")
+        batch_size = options['batch_size']
+        throttle = Throttle(options['rate'])
+        
+        def generate(first_message):
+            throttle.wait()
+            return service.generate_conversation_title(first_message, raise_errors=True)
+        
+        start = time.monotonic()
+        processed = titled = failed = 0
+        last_pk = options['after_id']
+        rows = self._candidates(options).iterator(chunk_size=batch_size)
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='backfill-titles') as pool:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                candidates = self._with_archived_first_messages(service, batch)
+                
+                futures = [
+                    (pk, user_id, title, pool.submit(generate, first_message))
+                    for pk, user_id, title, first_message in candidates
+                ]
+                updates = []
+                last_error = None
+                for pk, user_id, title, future in futures:
+                    try:
+                        updates.append((pk, user_id, title, future.result()))
+                    except Exception as e:
+                        # Left untitled, so the next run picks it up again
+                        failed += 1
+                        last_error = e
+                
+                if candidates and not updates:
+                    raise CommandError(
+                        f"Every title in the batch failed ({last_error}); resume with --after-id {last_pk}"
+                    )
+                # One UPDATE per row, only if the title is still the one read above, so a title
+                # set meanwhile (e.g. by the title task) stays; neither updated_at nor the counters change
+                titled_users = set()
+                with transaction.atomic():
+                    for pk, user_id, title, new_title in updates:
+                        if Conversation.objects.filter(pk=pk, title=title).update(title=new_title):
+                            titled_users.add(user_id)
+                            titled += 1
+                invalidate_sidebar(*titled_users)
+                
+                processed += len(candidates)
+                last_pk = batch[-1][0]
+                if options['verbosity'] > 0:
+                    elapsed = time.monotonic() - start
+                    self.stdout.write(
+                        f"  ... {processed} conversations, {titled} titled, {failed} failed, "
+                        f"{processed / elapsed:.1f}/s (resume with --after-id {last_pk})"
+                    )
+        
+        elapsed = time.monotonic() - start
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Titled {titled} of {processed} conversations in {elapsed:.1f}s ({rate:.1f}/s), {failed} failed"
+        ))
+        if failed:
+            self.stdout.write(self.style.WARNING("Run the command again to retry the failed conversations"))
@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+
+from chat.benchmarks import benchmark_database, seed_chat_data, time_call
+from chat.models import Conversation, Message
+
+
+# Single-column FK indexes the chat tables had before the composite indexes
+BASELINE_INDEXES = [
+    (Conversation, models.Index(fields=['user'], name='bench_conv_user_idx')),
+    (Message, models.Index(fields=['conversation'], name='bench_msg_conv_idx')),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with chat data and report query plans and timings of the "
+        "hot chat queries with the composite indexes and with the old single-column indexes"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--conversations', type=int, default=50, help="Conversations per user")
+        parser.add_argument('--messages', type=int, default=100, help="Messages per conversation")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed runs per query")
+    
+    def _queries(self, user, conversation):
+        return {
+            'history (conversation, newest 50)': lambda: (
+                Message.objects.filter(conversation=conversation).order_by('-created_at', '-id')[:50]
+            ),
+            'detail (conversation, chronological)': lambda: (
+                Message.objects.filter(conversation=conversation).order_by('created_at', 'id')
+            ),
+            'sidebar (user, -updated_at)': lambda: (
+                Conversation.objects.filter(user=user).order_by('-updated_at')[:10]
+            ),
+            'message api (user)': lambda: (
+                Message.objects.filter(user=user).order_by('-created_at', '-id')[:50]
+            ),
+        }
+    
+    def _run(self, label, queries, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label} =="))
+        results = {}
+        for name, make_queryset in queries.items():
+            plan = make_queryset().explain()
+            timing = time_call(lambda: list(make_queryset()), repeat)
+            results[name] = timing
+            self.stdout.write(self.style.SQL_KEYWORD(name))
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+            self.stdout.write(
+                f"    median {timing['median']:.3f} ms  p95 {timing['p95']:.3f} ms  max {timing['max']:.3f} ms"
+            )
+        return results
+    
+    def _swap_indexes(self, drop, create):
+        with connection.schema_editor() as editor:
+            for model, index in create:
+                editor.add_index(model, index)
+            for model, index in drop:
+                editor.remove_index(model, index)
+    
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write(
+                f"Seeding {options['users']} users x {options['conversations']} conversations x "
+                f"{options['messages']} messages on {connection.vendor}..."
+            )
+            users = seed_chat_data(options['users'], options['conversations'], options['messages'])
+            user = users[len(users) // 2]
+            conversation = Conversation.objects.filter(user=user).order_by('pk').first()
+            queries = self._queries(user, conversation)
+            
+            composite = [
+                (model, index) for model in (Conversation, Message) for index in model._meta.indexes
+            ]
+            
+            after = self._run("with composite indexes", queries, options['repeat'])
+            
+            self._swap_indexes(drop=composite, create=BASELINE_INDEXES)
+            try:
+                before = self._run("with single-column FK indexes (before)", queries, options['repeat'])
+            finally:
+                self._swap_indexes(drop=BASELINE_INDEXES, create=composite)
+            
+            self.stdout.write(self.style.MIGRATE_HEADING("\n== summary (median ms) =="))
+            for name in queries:
+                speedup = before[name]['median'] / after[name]['median'] if after[name]['median'] else 0
+                self.stdout.write(
+                    f"{name:<40} before {before[name]['median']:>9.3f}  "
+                    f"after {after[name]['median']:>9.3f}  x{speedup:.1f}"
+                )
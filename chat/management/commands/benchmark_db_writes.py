@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from chat.benchmarks import benchmark_database, seed_chat_data
+from chat.context import ContextBuilder
+from chat.metrics import percentile
+from chat.models import Conversation
+from chat.services import record_exchange
+
+
+# SQLite defaults before the tuned profile: rollback journal, fsync on every commit
+SQLITE_BASELINE_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent chat writers against a throwaway database and report write throughput. "
+        "On SQLite the default journal settings are compared with the tuned SQLITE_PRAGMAS profile."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent writers")
+        parser.add_argument('--exchanges', type=int, default=100, help="Exchanges written per thread")
+    
+    def _worker(self, user, conversation, exchanges, latencies, errors, barrier):
+        builder = ContextBuilder()
+        barrier.wait()
+        try:
+            for i in range(exchanges):
+                start = time.perf_counter()
+                try:
+                    # Same shape as a send: read the recent history, then persist the exchange
+                    builder.build('', f'Message {i}', conversation.messages.all())
+                    record_exchange(user, conversation, f'Message {i}', f'Reply {i} ' + 'lorem ipsum ' * 20)
+                except OperationalError as e:
+                    errors.append(str(e))
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.close()
+    
+    def _run(self, label, users, threads, exchanges):
+        # Reconnect so the pragmas of this round apply to every connection
+        connection.close()
+        conversations = [Conversation.objects.create(user=users[i % len(users)]) for i in range(threads)]
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                label = f"{label} (journal_mode={cursor.fetchone()[0]})"
+        
+        latencies, errors = [], []
+        barrier = threading.Barrier(threads + 1)
+        workers = [
+            threading.Thread(
+                target=self._worker,
+                args=(conversation.user, conversation, exchanges, latencies, errors, barrier),
+            )
+            for conversation in conversations
+        ]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label} =="))
+        self.stdout.write(
+            f"    {len(latencies)} exchanges in {elapsed:.2f} s: {len(latencies) / elapsed:.1f} exchanges/s"
+        )
+        self.stdout.write(
+            f"    p50 {percentile(latencies, 50):.1f} ms  p95 {percentile(latencies, 95):.1f} ms  "
+            f"p99 {percentile(latencies, 99):.1f} ms  errors {len(errors)}"
+        )
+        if errors:
+            self.stdout.write(self.style.WARNING(f"    first error: {errors[0]}"))
+        return len(latencies) / elapsed
+    
+    def handle(self, *args, **options):
+        threads = options['threads']
+        exchanges = options['exchanges']
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # WAL needs a file; the default SQLite test database lives in memory
+            test_name = os.path.join(tmpdir, 'benchmark.sqlite3') if connection.vendor == 'sqlite' else None
+            with benchmark_database(verbosity=options['verbosity'] - 1, test_name=test_name):
+                users = seed_chat_data(users=threads, conversations_per_user=1, messages_per_conversation=10)
+                
+                if connection.vendor != 'sqlite':
+                    self._run(f"{connection.vendor} (CONN_MAX_AGE={connection.settings_dict['CONN_MAX_AGE']})",
+                              users, threads, exchanges)
+                    return
+                
+                baseline_pragmas = {**getattr(settings, 'SQLITE_PRAGMAS', {}), **SQLITE_BASELINE_PRAGMAS}
+                with override_settings(SQLITE_PRAGMAS=baseline_pragmas):
+                    baseline = self._run("baseline", users, threads, exchanges)
+                tuned = self._run("tuned SQLITE_PRAGMAS", users, threads, exchanges)
+                connection.close()
+        
+        self.stdout.write(self.style.SUCCESS(f"\nTuned profile: {tuned / baseline:.2f}x baseline write throughput"))
@@ -0,0 +1,40 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.exports import export_lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Write conversations and messages as JSON Lines (chat/exports.py), for one user or everyone. "
+        "Rows are streamed from chunked queries, so memory use does not grow with the history."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Email of the user to export (default: all users)")
+        parser.add_argument('--output', '-o', help="File to write (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per database round trip")
+    
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            User = get_user_model()
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['user']!r}")
+        
+        lines = export_lines(user, chunk_size=options['chunk_size'])
+        if not options['output']:
+            sys.stdout.writelines(lines)
+            return
+        
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        # Progress goes to stderr so stdout exports stay clean
+        self.stderr.write(self.style.SUCCESS(f"Wrote {count - 1} records to {options['output']}"))
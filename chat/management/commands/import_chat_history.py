@@ -0,0 +1,40 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.exports import InvalidExportError, import_lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a JSON Lines chat export (see export_chat_history) with batched bulk inserts. "
+        "Conversation and message timestamps are kept; ids are reassigned."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Export file to import")
+        parser.add_argument('--user', help="Email of the user who gets every conversation "
+                                           "(default: the user recorded for each conversation)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk INSERT")
+    
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            User = get_user_model()
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['user']!r}")
+        
+        start = time.monotonic()
+        try:
+            with open(options['path'], encoding='utf-8') as lines:
+                conversations, messages = import_lines(lines, user=user, batch_size=options['batch_size'])
+        except (OSError, InvalidExportError) as e:
+            raise CommandError(str(e))
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {conversations} conversations and {messages} messages in {elapsed:.1f}s"
+        ))
@@ -0,0 +1,173 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from chat.benchmarks import benchmark_database
+from chat.metrics import percentile
+from chat.stub_api import StubEuronServer
+from chat.tasks import get_task_runner
+
+PASSWORD = 'loadtest-password'
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive concurrent simulated users through login, new conversation and N messages against "
+        "a throwaway database and a local stub Euron API; report latency percentiles, throughput "
+        "and SQL query counts per step. Runs fully offline."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Concurrent simulated users")
+        parser.add_argument('--messages', type=int, default=5, help="Messages sent per user")
+        parser.add_argument('--stream', action='store_true', help="Send through the SSE endpoint")
+        parser.add_argument('--latency-ms', type=float, default=200, help="Median stub latency")
+        parser.add_argument('--latency-sigma', type=float, default=0.5,
+                            help="Log-normal spread of the stub latency (0 for constant)")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of stub requests that fail")
+        parser.add_argument('--error-status', type=int, default=500)
+        parser.add_argument('--response-words', type=int, default=150, help="Words per stub reply")
+        parser.add_argument('--seed', type=int, default=None)
+    
+    def _timed(self, results, step, func):
+        """Run one request, recording latency, outcome and query count under step"""
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            try:
+                ok = func()
+            except Exception as e:
+                results[step]['errors'].append(f"{type(e).__name__}: {e}")
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+        results[step]['latencies'].append(elapsed)
+        results[step]['queries'].append(len(queries))
+        if ok is False and not results[step]['errors']:
+            results[step]['errors'].append("unsuccessful response")
+        results[step]['failures'] += ok is False
+        return ok
+    
+    def _simulate_user(self, user, messages, stream, results, barrier):
+        client = Client()
+        barrier.wait()
+        try:
+            def login():
+                response = client.post(reverse('accounts:login'), {'username': user.email, 'password': PASSWORD})
+                return response.status_code == 302
+            
+            if not self._timed(results, 'login', login):
+                return
+            
+            conversation = {}
+            
+            def new_conversation():
+                response = client.post(reverse('chat:new_conversation'), '{}', content_type='application/json')
+                conversation['id'] = response.json().get('conversation_id')
+                return response.status_code == 200 and conversation['id'] is not None
+            
+            if not self._timed(results, 'new_conversation', new_conversation):
+                return
+            
+            for i in range(messages):
+                payload = json.dumps({
+                    'conversation_id': conversation['id'],
+                    'message': f"Question {i} from {user.username}",
+                })
+                
+                def send():
+                    if stream:
+                        response = client.post(reverse('chat:stream_message'), payload, content_type='application/json')
+                        body = b''.join(response.streaming_content)
+                        return response.status_code == 200 and b'event: done' in body
+                    response = client.post(reverse('chat:send_message'), payload, content_type='application/json')
+                    return response.status_code == 200 and response.json().get('success', False)
+                
+                self._timed(results, 'stream_message' if stream else 'send_message', send)
+        finally:
+            connection.close()
+    
+    def _report(self, results, elapsed, stub):
+        total = sum(len(step['latencies']) for step in results.values())
+        self.stdout.write(self.style.MIGRATE_HEADING("\n== Load test results =="))
+        self.stdout.write(f"    {total} requests in {elapsed:.2f} s: {total / elapsed:.1f} requests/s")
+        for name, step in results.items():
+            if not step['latencies']:
+                continue
+            latencies, queries = step['latencies'], step['queries']
+            self.stdout.write(self.style.SQL_KEYWORD(name))
+            self.stdout.write(
+                f"    {len(latencies)} requests, {step['failures']} failed  "
+                f"p50 {percentile(latencies, 50):.1f} ms  p95 {percentile(latencies, 95):.1f} ms  "
+                f"p99 {percentile(latencies, 99):.1f} ms  max {max(latencies):.1f} ms"
+            )
+            self.stdout.write(
+                f"    queries per request: avg {sum(queries) / len(queries):.1f}  max {max(queries)}"
+            )
+            if step['errors']:
+                self.stdout.write(self.style.WARNING(f"    first error: {step['errors'][0]}"))
+        self.stdout.write(f"Stub API: {stub.requests} requests, {stub.errors} failed")
+    
+    def handle(self, *args, **options):
+        stub = StubEuronServer(
+            latency_ms=options['latency_ms'],
+            latency_sigma=options['latency_sigma'],
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            response_words=options['response_words'],
+            seed=options['seed'],
+        )
+        with tempfile.TemporaryDirectory() as tmpdir, stub:
+            # Concurrent writers need an on-disk SQLite database, not the shared in-memory one
+            test_name = os.path.join(tmpdir, 'loadtest.sqlite3') if connection.vendor == 'sqlite' else None
+            overrides = override_settings(
+                EURON_API_URL=stub.url,
+                ALLOWED_HOSTS=['testserver'],
+                AI_RESPONSE_CACHE_ENABLED=False,
+                # Simulated users send far faster than the per-user limits allow
+                CHAT_RATE_LIMIT_ENABLED=False,
+                PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+            )
+            with benchmark_database(verbosity=options['verbosity'] - 1, test_name=test_name), overrides:
+                User = get_user_model()
+                password = make_password(PASSWORD)
+                User.objects.bulk_create([
+                    User(username=f'load{i}', email=f'load{i}@example.com', password=password)
+                    for i in range(options['users'])
+                ])
+                users = list(User.objects.filter(username__startswith='load').order_by('pk'))
+                
+                send_step = 'stream_message' if options['stream'] else 'send_message'
+                results = {
+                    step: {'latencies': [], 'queries': [], 'errors': [], 'failures': 0}
+                    for step in ('login', 'new_conversation', send_step)
+                }
+                barrier = threading.Barrier(len(users) + 1)
+                workers = [
+                    threading.Thread(
+                        target=self._simulate_user,
+                        args=(user, options['messages'], options['stream'], results, barrier),
+                    )
+                    for user in users
+                ]
+                for worker in workers:
+                    worker.start()
+                barrier.wait()
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                
+                # Let background titles and summaries finish before the database goes away
+                get_task_runner().shutdown(wait=True)
+                connection.close()
+        
+        self._report(results, elapsed, stub)
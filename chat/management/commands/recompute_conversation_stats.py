@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.models import Conversation
+from chat.sidebar import invalidate_sidebar
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized message_count / last_message_* fields of conversations from their messages "
+        "(archived conversations keep theirs until restored)"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Conversations updated per UPDATE")
+        parser.add_argument('--user', type=int, help="Only recompute conversations of this user id")
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Conversation.objects.order_by('pk')
+        if options['user']:
+            queryset = queryset.filter(user_id=options['user'])
+        
+        start = time.monotonic()
+        updated = 0
+        last_pk = 0
+        while True:
+            # Walk the primary key in batches so each UPDATE stays short
+            batch = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'user_id')[:batch_size])
+            if not batch:
+                break
+            updated += Conversation.objects.filter(pk__in=[pk for pk, _ in batch]).refresh_message_stats()
+            # The sidebars show these counters
+            invalidate_sidebar(*{user_id for _, user_id in batch})
+            last_pk = batch[-1][0]
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  ... {updated} conversations")
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(f"Recomputed message stats for {updated} conversations in {elapsed:.1f}s"))
@@ -0,0 +1,262 @@
+"""
+Request timing breakdowns and Prometheus-format metrics.
+
+RequestMetricsMiddleware (chat.middleware) opens a RequestTimings for each
+request in a context variable. Database time is added by record_query, an
+execute wrapper installed on every connection; upstream time by
+upstream_timer around the Euron calls in chat.services; render time by the
+middleware around TemplateResponse rendering.
+
+Metrics live in this process only: with several worker processes each one
+exposes its own counts, so scrape every worker (or run one per container).
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds; upstream completions take far longer than page views
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def percentile(values, pct):
+    """pct-th percentile (0-100) of values, nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Metric:
+    """Base for labelled metrics; label values are passed as keyword arguments"""
+    type = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+    
+    def _key(self, labels):
+        return tuple((name, str(labels.get(name, ''))) for name in self.labelnames)
+    
+    def samples(self):
+        """(suffix, labels, value) tuples for the exposition format"""
+        raise NotImplementedError
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def samples(self):
+        with self._lock:
+            return [('_total', key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+    
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+    
+    def samples(self):
+        with self._lock:
+            return [('', key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+    
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(('_bucket', key + (('le', _format_value(bound)),), count))
+                samples.append(('_sum', key, total))
+                samples.append(('_count', key, counts[-1]))
+        return samples
+
+
+class Registry:
+    """Named collection of metrics rendered together on the metrics endpoint"""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+http_request_duration = REGISTRY.register(Histogram(
+    'chat_http_request_duration_seconds', "Time to produce the response, by URL name",
+    ['view', 'method', 'status'],
+))
+http_request_db_duration = REGISTRY.register(Histogram(
+    'chat_http_request_db_seconds', "Database time per request", ['view'],
+))
+http_request_db_queries = REGISTRY.register(Histogram(
+    'chat_http_request_db_queries', "Database queries per request", ['view'], buckets=QUERY_COUNT_BUCKETS,
+))
+http_request_upstream_duration = REGISTRY.register(Histogram(
+    'chat_http_request_upstream_seconds', "Upstream AI API time per request", ['view'],
+))
+http_request_render_duration = REGISTRY.register(Histogram(
+    'chat_http_request_render_seconds', "Template rendering time per request", ['view'],
+))
+upstream_request_duration = REGISTRY.register(Histogram(
+    'chat_upstream_request_duration_seconds', "Euron API call duration, including retries",
+    ['model', 'operation', 'outcome'],
+))
+
+
+class RequestTimings:
+    """Per-request accumulator for the Server-Timing breakdown (all durations in seconds)"""
+    
+    def __init__(self):
+        self.db = 0.0
+        self.db_queries = 0
+        self.upstream = 0.0
+        self.upstream_calls = 0
+        self.render = 0.0
+    
+    def server_timing(self, total):
+        """Server-Timing header value; durations in milliseconds"""
+        return ', '.join([
+            f'db;dur={self.db * 1000:.1f};desc="{self.db_queries} queries"',
+            f'upstream;dur={self.upstream * 1000:.1f};desc="{self.upstream_calls} calls"',
+            f'render;dur={self.render * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+_current_timings = ContextVar('chat_request_timings', default=None)
+
+
+def current_timings():
+    """RequestTimings of the request being handled in this context, or None"""
+    return _current_timings.get()
+
+
+def start_request():
+    """Begin collecting timings for the current request; returns (timings, token for end_request)"""
+    timings = RequestTimings()
+    return timings, _current_timings.set(timings)
+
+
+def end_request(token):
+    _current_timings.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding query time to the current request, if any"""
+    timings = _current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.db_queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver: time every query run on the connection"""
+    # The wrapper object outlives reconnects, so only add the recorder once
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def upstream_timer(model, operation='completion'):
+    """Time an upstream AI call for the metrics and the current request's breakdown"""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        elapsed = time.perf_counter() - start
+        upstream_request_duration.observe(elapsed, model=model, operation=operation, outcome=outcome)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.upstream += elapsed
+            timings.upstream_calls += 1
+
+
+def observe_request(view, method, status, total, timings):
+    http_request_duration.observe(total, view=view, method=method, status=status)
+    http_request_db_duration.observe(timings.db, view=view)
+    http_request_db_queries.observe(timings.db_queries, view=view)
+    http_request_upstream_duration.observe(timings.upstream, view=view)
+    http_request_render_duration.observe(timings.render, view=view)
@@ -0,0 +1,64 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Record a per-request breakdown of database, upstream AI and template
+    rendering time, expose it as a Server-Timing header and aggregate it
+    into the histograms in chat.metrics.
+    
+    Place it first in MIDDLEWARE so the total covers the other middleware.
+    Streamed response bodies are produced after the headers are sent, so
+    their work is not part of the breakdown.
+    """
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'SERVER_TIMING_ENABLED', settings.DEBUG)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+    
+    async def __acall__(self, request):
+        timings, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+    
+    def process_template_response(self, request, response):
+        # Render here rather than in the handler so the time can be attributed;
+        # the handler skips rendering an already rendered response
+        timings = metrics.current_timings()
+        start = time.perf_counter()
+        response.render()
+        if timings is not None:
+            timings.render += time.perf_counter() - start
+        return response
+    
+    def _finish(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.observe_request(view, request.method, response.status_code, total, timings)
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_token_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='summary',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_through_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
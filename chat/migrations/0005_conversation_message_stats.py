@@ -0,0 +1,55 @@
+# Generated by Django 4.2.16 on 2026-10-18 02:29
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Concat, Length, Substr
+from django.db.models.lookups import GreaterThan
+
+
+def populate_message_stats(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    
+    messages = Message.objects.filter(conversation=OuterRef('pk')).order_by()
+    latest = messages.order_by('-created_at', '-id')
+    preview = Case(
+        When(GreaterThan(Length('content'), 100), then=Concat(Substr('content', 1, 100), Value('...'))),
+        default=F('content'),
+        output_field=models.CharField(),
+    )
+    
+    conversation_ids = list(Conversation.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(conversation_ids), 1000):
+        Conversation.objects.filter(pk__in=conversation_ids[start:start + 1000]).update(
+            message_count=Coalesce(
+                Subquery(messages.values('conversation').annotate(count=Count('pk')).values('count')), 0
+            ),
+            last_message_at=Subquery(latest.values('created_at')[:1]),
+            last_message_preview=Coalesce(Subquery(latest.annotate(preview=preview).values('preview')[:1]), Value('')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chat_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, editable=False, max_length=103),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_message_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from chat.search import install_search_index, uninstall_search_index
+
+
+def create_search_index(apps, schema_editor):
+    install_search_index(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_conversation_message_stats'),
+    ]
+
+    operations = [
+        # FTS5 tables + triggers on SQLite, GIN tsvector indexes on PostgreSQL
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 02:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from chat.search import install_search_index
+
+
+def reinstall_search_index(apps, schema_editor):
+    # Adding is_archived rebuilds chat_conversation on SQLite, dropping its FTS triggers
+    install_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_full_text_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_index),
+        migrations.CreateModel(
+            name='ConversationArchive',
+            fields=[
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='chat.conversation')),
+                ('codec', models.CharField(max_length=10)),
+                ('data', models.BinaryField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('raw_size', models.PositiveIntegerField(help_text='Uncompressed size in bytes')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='is_archived',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+from chat.search import install_search_index
+
+
+def populate_message_user(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    owner = Conversation.objects.filter(pk=OuterRef('conversation_id')).values('user_id')[:1]
+    conversation_ids = list(Conversation.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(conversation_ids), 1000):
+        Message.objects.filter(conversation_id__in=conversation_ids[start:start + 1000]).update(
+            user_id=Subquery(owner)
+        )
+
+
+def reinstall_search_index(apps, schema_editor):
+    # Making user NOT NULL rebuilds chat_message on SQLite, dropping its FTS triggers
+    install_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0007_conversation_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_index),
+        migrations.AddField(
+            model_name='message',
+            name='user',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(populate_message_user, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='user',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='chat_msg_user_created_idx'),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_message_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='restored_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
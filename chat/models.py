@@ -1,42 +1,229 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Concat, Length, Substr
+from django.db.models.lookups import GreaterThan
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from .context import estimate_tokens
+from .sidebar import invalidate_sidebar
 
 User = get_user_model()
 
+PREVIEW_LENGTH = 100
+
+
+def message_preview(content):
+    """Truncated message content shown in conversation lists"""
+    return content[:PREVIEW_LENGTH] + ('...' if len(content) > PREVIEW_LENGTH else '')
+
+
+def message_preview_expression(field='content'):
+    """SQL equivalent of message_preview"""
+    return Case(
+        When(GreaterThan(Length(field), PREVIEW_LENGTH), then=Concat(Substr(field, 1, PREVIEW_LENGTH), Value('...'))),
+        default=F(field),
+        output_field=models.CharField(),
+    )
+
+
+def bulk_create_with_timestamps(model, rows, timestamp_fields):
+    """
+    Insert (instance, *timestamps) rows keeping the given timestamp values.
+    
+    auto_now / auto_now_add replace the values on insert, so they are put
+    back with one bulk UPDATE afterwards.
+    """
+    instances = [row[0] for row in rows]
+    if connection.features.can_return_rows_from_bulk_insert or all(instance.pk for instance in instances):
+        model.objects.bulk_create(instances)
+    else:
+        # Backends that can't return ids from a multi-row INSERT
+        for instance in instances:
+            models.Model.save(instance)
+    for instance, *timestamps in rows:
+        for field, value in zip(timestamp_fields, timestamps):
+            setattr(instance, field, value)
+    model.objects.bulk_update(instances, timestamp_fields)
+
+
+class ConversationQuerySet(models.QuerySet):
+    
+    def refresh_message_stats(self):
+        """
+        Recompute the denormalized message fields from the Message table in one UPDATE.
+        
+        Archived conversations are left alone: their messages are in ConversationArchive,
+        not the Message table, and restore_conversation() refreshes them once back.
+        """
+        messages = Message.objects.filter(conversation=OuterRef('pk')).order_by()
+        latest = messages.order_by('-created_at', '-id')
+        return self.filter(is_archived=False).update(
+            message_count=Coalesce(
+                Subquery(messages.values('conversation').annotate(count=Count('pk')).values('count')), 0
+            ),
+            last_message_at=Subquery(latest.values('created_at')[:1]),
+            last_message_preview=Coalesce(
+                Subquery(latest.annotate(preview=message_preview_expression()).values('preview')[:1]), Value('')
+            ),
+        )
+    
+    def delete(self):
+        # Single conversations go through Conversation.delete(); this covers bulk deletes (admin actions)
+        user_ids = set(self.values_list('user_id', flat=True))
+        result = super().delete()
+        invalidate_sidebar(*user_ids)
+        return result
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+
 
 class Conversation(models.Model):
     """Model to store chat conversations"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+    # Indexed through Meta.indexes (user, -updated_at) instead of a separate FK index
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations', db_index=False)
     title = models.CharField(max_length=200, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Rolling summary of the turns up to and including message summary_through_id,
+    # sent in place of those raw turns (see chat.tasks.update_conversation_summary)
+    summary = models.TextField(blank=True, editable=False)
+    summary_through_id = models.BigIntegerField(null=True, blank=True, editable=False)
+    # Denormalized from Message, maintained on write so lists never touch the Message table
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH + 3, blank=True, editable=False)
+    # Messages moved to ConversationArchive; restored when the conversation is opened (see chat/archive.py)
+    is_archived = models.BooleanField(default=False, editable=False)
+    # Last restore; archiving skips conversations restored within the inactivity window
+    restored_at = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    objects = ConversationQuerySet.as_manager()
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Sidebar / conversation list: filter by user, newest activity first
+            models.Index(fields=['user', '-updated_at'], name='chat_conv_user_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Conversation {self.id} - {self.user.username}"
     
     def save(self, *args, **kwargs):
-        # Only try to set title if the conversation already exists (has a primary key)
-        if not self.title and self.pk and self.messages.exists():
-            # Set title to first user message (truncated)
-            first_message = self.messages.filter(is_from_user=True).first()
-            if first_message:
-                self.title = first_message.content[:50] + ('...' if len(first_message.content) > 50 else '')
         super().save(*args, **kwargs)
+        invalidate_sidebar(self.user_id)
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_sidebar(self.user_id)
+        return result
+    
+    def recent_history(self):
+        """Messages that have not been folded into the rolling summary yet"""
+        history = self.messages.all()
+        if self.summary_through_id:
+            history = history.filter(id__gt=self.summary_through_id)
+        return history
+
+
+class MessageQuerySet(models.QuerySet):
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        # Message.save() is skipped, so fill the denormalized user here
+        objs = list(objs)
+        for message in objs:
+            if message.user_id is None:
+                message.user_id = message.conversation.user_id
+        return super().bulk_create(objs, *args, **kwargs)
+    
+    def delete(self):
+        # Deleting conversations cascades without coming through here, so this only
+        # runs for explicit message deletes (admin actions, cleanups)
+        owners = set(self.values_list('conversation_id', 'conversation__user_id'))
+        with transaction.atomic(using=self.db):
+            result = super().delete()
+            Conversation.objects.filter(pk__in={pk for pk, _ in owners}).refresh_message_stats()
+            invalidate_sidebar(*{user_id for _, user_id in owners})
+        return result
+    
+    delete.alters_data = True
+    delete.queryset_only = True
 
 
 class Message(models.Model):
     """Model to store individual messages in conversations"""
-    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    # Indexed through Meta.indexes (conversation, created_at, id) instead of a separate FK index
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages', db_index=False)
+    # Denormalized from conversation.user so the user's message feed (MessageViewSet) has its own index
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False, editable=False)
     content = models.TextField()
     is_from_user = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Cached token estimate used when packing conversation context
+    token_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    
+    objects = MessageQuerySet.as_manager()
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # History, detail view and keyset pagination: filter by conversation, order by (created_at, id)
+            models.Index(fields=['conversation', 'created_at', 'id'], name='chat_msg_conv_created_idx'),
+            # All of a user's messages, newest first (keyset-paginated API feed)
+            models.Index(fields=['user', 'created_at', 'id'], name='chat_msg_user_created_idx'),
+        ]
     
     def __str__(self):
         sender = "User" if self.is_from_user else "AI"
-        return f"{sender}: {self.content[:50]}..."
\ No newline at end of file
+        return f"{sender}: {self.content[:50]}..."
+    
+    def save(self, *args, **kwargs):
+        if self.token_count is None:
+            self.token_count = estimate_tokens(self.content)
+        if self.user_id is None:
+            self.user_id = self.conversation.user_id
+        
+        if not self._state.adding:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                # An edit of the latest message changes the conversation's preview
+                latest = Message.objects.filter(conversation_id=self.conversation_id).order_by('-created_at', '-id')
+                if latest.values_list('pk', flat=True).first() == self.pk:
+                    Conversation.objects.filter(pk=self.conversation_id).refresh_message_stats()
+                invalidate_sidebar(self.conversation.user_id)
+            return
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Bump the conversation's counters and activity time in the same transaction
+            Conversation.objects.filter(pk=self.conversation_id).update(
+                message_count=F('message_count') + 1,
+                last_message_at=self.created_at,
+                last_message_preview=message_preview(self.content),
+                updated_at=timezone.now(),
+            )
+            invalidate_sidebar(self.conversation.user_id)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Conversation.objects.filter(pk=self.conversation_id).refresh_message_stats()
+            invalidate_sidebar(self.conversation.user_id)
+        return result
+
+
+class ConversationArchive(models.Model):
+    """Compressed messages of an inactive conversation (see chat/archive.py)"""
+    conversation = models.OneToOneField(
+        Conversation, on_delete=models.CASCADE, primary_key=True, related_name='archive'
+    )
+    codec = models.CharField(max_length=10)
+    # JSON list of the messages, compressed with codec
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    raw_size = models.PositiveIntegerField(help_text="Uncompressed size in bytes")
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id} ({self.message_count} messages)"
@@ -0,0 +1,159 @@
+"""
+Per-user request rate limits and daily token quotas for upstream AI calls.
+
+check_rate_limit() runs before AIService is invoked on every send path and
+raises RateLimitExceeded when the user is out of requests (token bucket) or
+out of tokens for the day; the views answer with 429 and Retry-After.
+record_token_usage() charges each exchange afterwards, the prompt as sent
+upstream plus the reply, so one request may overshoot the quota by its own
+size.
+
+Limits come from CHAT_RATE_LIMIT_TIERS, keyed by group name: a user gets the
+first listed tier whose group they belong to, else 'default'. All state lives
+in the CHAT_RATE_LIMIT_CACHE_ALIAS cache, a few O(1) reads and writes per
+request. Bucket updates are serialised within a process only; with several
+processes sharing a cache (e.g. Redis), simultaneous requests from one user
+can occasionally both take the last token.
+"""
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .metrics import REGISTRY, Counter
+
+DEFAULT_TIER = 'default'
+DEFAULT_TIERS = {
+    DEFAULT_TIER: {'requests_per_minute': 10, 'burst': 5, 'daily_tokens': 100000},
+}
+
+rate_limited_requests = REGISTRY.register(Counter(
+    'chat_rate_limited_requests', "Send requests rejected before reaching upstream", ['tier', 'reason'],
+))
+charged_tokens = REGISTRY.register(Counter(
+    'chat_rate_limit_tokens', "Estimated tokens charged against daily quotas", ['tier'],
+))
+
+_bucket_lock = threading.Lock()
+
+
+class RateLimitExceeded(Exception):
+    """The user may not make another upstream call for retry_after seconds"""
+    
+    def __init__(self, reason, retry_after, tier):
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.tier = tier
+        super().__init__(f"Rate limit exceeded ({reason}); retry in {self.retry_after} s")
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_RATE_LIMIT_ENABLED', True)
+
+
+def _cache():
+    return caches[getattr(settings, 'CHAT_RATE_LIMIT_CACHE_ALIAS', 'default')]
+
+
+def _tiers():
+    return getattr(settings, 'CHAT_RATE_LIMIT_TIERS', DEFAULT_TIERS)
+
+
+def get_user_tier(user):
+    """Name of the tier that applies to user; the group lookup is cached per user"""
+    group_tiers = [name for name in _tiers() if name != DEFAULT_TIER]
+    if not group_tiers:
+        return DEFAULT_TIER
+    
+    key = f'ratelimit:tier:{user.pk}'
+    tier = _cache().get(key)
+    if tier is None:
+        groups = set(user.groups.filter(name__in=group_tiers).values_list('name', flat=True))
+        tier = next((name for name in group_tiers if name in groups), DEFAULT_TIER)
+        _cache().set(key, tier, getattr(settings, 'CHAT_RATE_LIMIT_TIER_CACHE_TTL', 300))
+    return tier
+
+
+def _tier_limits(tier):
+    tiers = _tiers()
+    return tiers.get(tier) or tiers.get(DEFAULT_TIER) or DEFAULT_TIERS[DEFAULT_TIER]
+
+
+def _quota_key(user):
+    return f'ratelimit:tokens:{user.pk}:{timezone.now():%Y%m%d}'
+
+
+def _seconds_until_midnight():
+    """Daily quotas reset at midnight UTC"""
+    now = timezone.now()
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+def _take_token(user, limits):
+    """
+    Take one request from the user's token bucket.
+    
+    The bucket holds up to burst requests and refills at requests_per_minute;
+    it is stored as (tokens, timestamp) and topped up lazily on each call.
+    Returns 0 on success, else the seconds until a request is available.
+    """
+    rate = limits['requests_per_minute'] / 60
+    burst = limits.get('burst') or 1
+    backend = _cache()
+    key = f'ratelimit:bucket:{user.pk}'
+    with _bucket_lock:
+        now = time.time()
+        tokens, updated = backend.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        # Expires once it would have refilled completely anyway
+        backend.set(key, (tokens - 1, now), math.ceil(burst / rate) + 1)
+    return 0
+
+
+def check_rate_limit(user):
+    """Raise RateLimitExceeded unless user may make an upstream call now"""
+    if not is_enabled():
+        return
+    tier = get_user_tier(user)
+    limits = _tier_limits(tier)
+    
+    daily_tokens = limits.get('daily_tokens')
+    if daily_tokens and (_cache().get(_quota_key(user)) or 0) >= daily_tokens:
+        rate_limited_requests.inc(tier=tier, reason='daily_tokens')
+        raise RateLimitExceeded('daily_tokens', _seconds_until_midnight(), tier)
+    
+    if limits.get('requests_per_minute'):
+        retry_after = _take_token(user, limits)
+        if retry_after:
+            rate_limited_requests.inc(tier=tier, reason='requests')
+            raise RateLimitExceeded('requests', retry_after, tier)
+
+
+def record_token_usage(user, prompt_tokens, *replies):
+    """
+    Charge one upstream call against user's daily quota: prompt_tokens, the
+    estimated size of the prompt sent (history and summary included), plus
+    the token_count of the saved replies.
+    """
+    if not is_enabled():
+        return
+    tokens = prompt_tokens + sum(reply.token_count or 0 for reply in replies)
+    if not tokens:
+        return
+    backend = _cache()
+    key = _quota_key(user)
+    # add() then incr() keeps the counter atomic on backends that support it
+    backend.add(key, 0, math.ceil(_seconds_until_midnight()) + 60)
+    try:
+        backend.incr(key, tokens)
+    except ValueError:
+        # Expired between add() and incr(): the day just rolled over
+        backend.set(key, tokens, math.ceil(_seconds_until_midnight()) + 60)
+    charged_tokens.inc(tokens, tier=get_user_tier(user))
@@ -0,0 +1,233 @@
+"""
+Circuit breaker and concurrency bulkhead for upstream AI calls.
+
+upstream_guard() wraps every Euron request in chat.services. While the
+breaker is open, or all bulkhead slots are taken, it raises
+UpstreamUnavailable immediately; AIService then answers with its fallback
+response instead of tying up a worker for the full upstream timeout.
+
+The breaker opens after EURON_CIRCUIT_FAILURE_THRESHOLD consecutive failures
+(errors, timeouts, 5xx/429 responses), rejects calls for
+EURON_CIRCUIT_RECOVERY_TIMEOUT seconds, then lets up to
+EURON_CIRCUIT_HALF_OPEN_MAX_CALLS probe requests through: a successful probe
+closes it again, a failed one reopens it.
+
+Each route (chat.routing) has its own breaker; the bulkhead is shared. State
+is per process and exported through chat.metrics.
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import REGISTRY, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+circuit_state = REGISTRY.register(Gauge(
+    'chat_upstream_circuit_state', "Upstream circuit breaker state (0 closed, 1 half-open, 2 open)", ['name'],
+))
+circuit_transitions = REGISTRY.register(Counter(
+    'chat_upstream_circuit_transitions', "Upstream circuit breaker state changes", ['name', 'state'],
+))
+upstream_rejections = REGISTRY.register(Counter(
+    'chat_upstream_rejections', "Upstream calls rejected without being sent", ['name', 'reason'],
+))
+upstream_in_flight = REGISTRY.register(Gauge(
+    'chat_upstream_in_flight', "Upstream calls currently holding a bulkhead slot", ['name'],
+))
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was rejected locally (circuit open or bulkhead full)"""
+    reason = 'unavailable'
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    reason = 'circuit_open'
+
+
+class BulkheadFullError(UpstreamUnavailable):
+    reason = 'bulkhead_full'
+
+
+def is_upstream_failure(exc):
+    """Whether exc means the upstream is unhealthy; client errors (4xx other than 429) do not count"""
+    status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status is None:
+        return True
+    return status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """Thread-safe consecutive-failure circuit breaker"""
+    
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        circuit_state.set(STATE_VALUES[CLOSED], name=name)
+    
+    @property
+    def state(self):
+        with self._lock:
+            self._check_recovery()
+            return self._state
+    
+    def _transition(self, state):
+        # Called with the lock held
+        if state == self._state:
+            return
+        logger.warning(f"Circuit breaker '{self.name}' {self._state} -> {state}")
+        self._state = state
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state == CLOSED:
+            self._failures = 0
+        circuit_state.set(STATE_VALUES[state], name=self.name)
+        circuit_transitions.inc(name=self.name, state=state)
+    
+    def _check_recovery(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._transition(HALF_OPEN)
+    
+    def allow_request(self):
+        """Reserve permission for one call; every allowed call must be followed by record_success/failure"""
+        with self._lock:
+            self._check_recovery()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED)
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._transition(OPEN)
+    
+    def release(self):
+        """Give back a half-open probe slot for a call that ended without a verdict"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+
+class Bulkhead:
+    """Caps concurrent upstream calls so a slow upstream cannot occupy every worker"""
+    
+    def __init__(self, name, max_concurrent=8, max_wait=1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+    
+    def acquire(self, wait=None):
+        """Take a slot, waiting up to wait seconds (default max_wait); returns False if none freed up"""
+        wait = self.max_wait if wait is None else wait
+        acquired = self._semaphore.acquire(timeout=wait) if wait > 0 else self._semaphore.acquire(blocking=False)
+        if acquired:
+            upstream_in_flight.inc(name=self.name)
+        return acquired
+    
+    def release(self):
+        upstream_in_flight.dec(name=self.name)
+        self._semaphore.release()
+
+
+_breakers = {}
+_bulkhead = None
+_lock = threading.Lock()
+
+
+def get_circuit_breaker(name='euron'):
+    """Process-wide breaker for one upstream route (see chat.routing)"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(
+                    name,
+                    failure_threshold=getattr(settings, 'EURON_CIRCUIT_FAILURE_THRESHOLD', 5),
+                    recovery_timeout=getattr(settings, 'EURON_CIRCUIT_RECOVERY_TIMEOUT', 30),
+                    half_open_max_calls=getattr(settings, 'EURON_CIRCUIT_HALF_OPEN_MAX_CALLS', 1),
+                )
+    return breaker
+
+
+def get_bulkhead():
+    """Process-wide concurrency limit for the Euron API"""
+    global _bulkhead
+    if _bulkhead is None:
+        with _lock:
+            if _bulkhead is None:
+                _bulkhead = Bulkhead(
+                    'euron',
+                    max_concurrent=getattr(settings, 'EURON_MAX_CONCURRENT_REQUESTS', 8),
+                    max_wait=getattr(settings, 'EURON_BULKHEAD_MAX_WAIT', 1.0),
+                )
+    return _bulkhead
+
+
+@contextmanager
+def upstream_guard(wait=None, name='euron'):
+    """
+    Run the block as one upstream call under the name route's breaker and
+    the shared bulkhead.
+    
+    Raises CircuitOpenError or BulkheadFullError without running the block
+    when the call is not allowed. Async callers pass wait=0 so a full
+    bulkhead never blocks the event loop.
+    """
+    breaker = get_circuit_breaker(name)
+    bulkhead = get_bulkhead()
+    
+    if not breaker.allow_request():
+        upstream_rejections.inc(name=breaker.name, reason=CircuitOpenError.reason)
+        raise CircuitOpenError(f"Circuit breaker '{breaker.name}' is open")
+    if not bulkhead.acquire(wait):
+        breaker.release()
+        upstream_rejections.inc(name=bulkhead.name, reason=BulkheadFullError.reason)
+        raise BulkheadFullError(f"All {bulkhead.max_concurrent} upstream slots are busy")
+    
+    try:
+        yield
+    except (GeneratorExit, asyncio.CancelledError):
+        # A stream abandoned by its consumer, or a cancelled call (e.g. a hedged
+        # request that lost), says nothing about upstream health
+        breaker.release()
+        raise
+    except Exception as e:
+        if is_upstream_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        bulkhead.release()
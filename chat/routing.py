@@ -0,0 +1,307 @@
+"""
+Routing of upstream AI calls by task type.
+
+Each task (CHAT, TITLE, SUMMARY) has an ordered list of routes in
+AI_TASK_ROUTES; a route in AI_ROUTES is a model on an endpoint (url defaults
+to EURON_API_URL). For every call the router ranks the task's routes:
+healthy ones first, then by rolling (EWMA) latency, configured order
+breaking ties, so routes without samples yet get tried and measured. A
+route is unhealthy while its circuit breaker is open, or while its rolling
+error rate is above AI_ROUTE_MAX_ERROR_RATE and it failed within the last
+AI_ROUTE_RECOVERY_TIMEOUT seconds. A call that fails upstream moves on to
+the next route.
+
+With AI_HEDGE_ENABLED, a call still running after its route's p95 latency
+gets a second, hedged request on the next route (the same route if the
+task has only one) and the first answer wins. Hedging waits for
+AI_HEDGE_MIN_SAMPLES latencies per route and does not apply to streams.
+A losing blocking request cannot be aborted; it finishes in the background
+and still counts towards the route's statistics.
+
+Every route has its own circuit breaker, named after it; all routes share
+the bulkhead (chat.resilience). Statistics are per process.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .metrics import REGISTRY, Counter, Gauge, percentile
+from .resilience import OPEN, UpstreamUnavailable, get_circuit_breaker, is_upstream_failure
+
+logger = logging.getLogger(__name__)
+
+CHAT = 'chat'
+TITLE = 'title'
+SUMMARY = 'summary'
+
+DEFAULT_ROUTES = {'euron': {'model': 'gpt-4.1-nano'}}
+DEFAULT_TASK_ROUTES = {CHAT: ['euron'], TITLE: ['euron'], SUMMARY: ['euron']}
+
+route_latency = REGISTRY.register(Gauge(
+    'chat_route_latency_seconds', "Rolling average upstream latency per route", ['route'],
+))
+route_error_rate = REGISTRY.register(Gauge(
+    'chat_route_error_rate', "Rolling upstream error rate per route", ['route'],
+))
+hedged_requests = REGISTRY.register(Counter(
+    'chat_hedged_requests', "Upstream calls that sent a hedged request, by which request answered first",
+    ['task', 'winner'],
+))
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Route:
+    """A model served by an endpoint"""
+    
+    def __init__(self, name, model, url=None):
+        self.name = name
+        self.model = model
+        self._url = url
+    
+    @property
+    def url(self):
+        # Read at call time so EURON_API_URL overrides (e.g. the load test's stub) apply
+        return self._url or _setting('EURON_API_URL', "https://api.euron.one/api/v1/euri/chat/completions")
+    
+    def __repr__(self):
+        return f'<Route {self.name}: {self.model}>'
+
+
+class RouteStats:
+    """Rolling latency and error estimates for one route"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.error_rate = 0.0
+        self.last_failure = None
+        self._samples = deque(maxlen=_setting('AI_ROUTE_LATENCY_WINDOW', 200))
+        self._lock = threading.Lock()
+    
+    def observe(self, latency=None, error=False):
+        """Record one call: its latency in seconds if it succeeded, else error=True"""
+        alpha = _setting('AI_ROUTE_EWMA_ALPHA', 0.2)
+        with self._lock:
+            self.error_rate += alpha * ((1.0 if error else 0.0) - self.error_rate)
+            if error:
+                self.last_failure = time.monotonic()
+            elif latency is not None:
+                self.latency = latency if self.latency is None else self.latency + alpha * (latency - self.latency)
+                self._samples.append(latency)
+                route_latency.set(self.latency, route=self.name)
+            route_error_rate.set(self.error_rate, route=self.name)
+    
+    @property
+    def healthy(self):
+        if self.error_rate <= _setting('AI_ROUTE_MAX_ERROR_RATE', 0.5) or self.last_failure is None:
+            return True
+        # Give a failing route another chance once it has been quiet for a while
+        return time.monotonic() - self.last_failure >= _setting('AI_ROUTE_RECOVERY_TIMEOUT', 30)
+    
+    def p95(self):
+        """95th percentile of recent latencies, or None until there are enough samples"""
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < _setting('AI_HEDGE_MIN_SAMPLES', 20):
+            return None
+        return percentile(samples, 95)
+
+
+def _fails_over(exc):
+    """Whether another route might succeed where this one raised exc"""
+    return isinstance(exc, UpstreamUnavailable) or is_upstream_failure(exc)
+
+
+class Router:
+    """Ranks a task's routes and runs calls on them with failover and optional hedging"""
+    
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._executor = None
+    
+    def stats(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(name, RouteStats(name))
+        return stats
+    
+    def routes(self, task):
+        """The task's routes in configured order"""
+        configured = _setting('AI_ROUTES', DEFAULT_ROUTES)
+        names = _setting('AI_TASK_ROUTES', DEFAULT_TASK_ROUTES).get(task)
+        if not names:
+            raise ImproperlyConfigured(f"AI_TASK_ROUTES has no routes for task '{task}'")
+        try:
+            return [Route(name, **configured[name]) for name in names]
+        except KeyError as e:
+            raise ImproperlyConfigured(f"AI_TASK_ROUTES refers to unknown route {e}")
+    
+    def primary(self, task):
+        """The task's first configured route; its model keys the response cache"""
+        return self.routes(task)[0]
+    
+    def ranked(self, task):
+        """The task's routes, best first"""
+        def rank(indexed):
+            position, route = indexed
+            stats = self.stats(route.name)
+            unhealthy = not stats.healthy or get_circuit_breaker(route.name).state == OPEN
+            return (unhealthy, stats.latency or 0.0, position)
+        
+        return [route for _, route in sorted(enumerate(self.routes(task)), key=rank)]
+    
+    def observe(self, route, latency=None, error=False):
+        self.stats(route.name).observe(latency, error)
+    
+    def _hedge_delay(self, route):
+        if not _setting('AI_HEDGE_ENABLED', False):
+            return None
+        p95 = self.stats(route.name).p95()
+        if p95 is None:
+            return None
+        return max(p95, _setting('AI_HEDGE_MIN_DELAY', 0.1))
+    
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=_setting('AI_HEDGE_WORKERS', 16), thread_name_prefix='chat-hedge',
+                    )
+        return self._executor
+    
+    # Blocking callers
+    
+    def _timed(self, route, request):
+        start = time.perf_counter()
+        try:
+            result = request(route)
+        except Exception as e:
+            # Local rejections (circuit open, bulkhead full) say nothing about the route's latency
+            if not isinstance(e, UpstreamUnavailable):
+                self.observe(route, error=is_upstream_failure(e))
+            raise
+        self.observe(route, time.perf_counter() - start)
+        return result
+    
+    def _call_route(self, task, route, hedge_route, request):
+        delay = self._hedge_delay(route)
+        if delay is None:
+            return self._timed(route, request)
+        
+        # Both requests run on the pool so whichever answers first can be returned;
+        # copy_context keeps the request's timings (chat.metrics) visible to them
+        executor = self._get_executor()
+        primary = executor.submit(copy_context().run, self._timed, route, request)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        
+        hedge = executor.submit(copy_context().run, self._timed, hedge_route, request)
+        pending = {primary: 'primary', hedge: 'hedge'}
+        error = None
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                hedged_requests.inc(task=task, winner=winner)
+                return future.result()
+        raise error
+    
+    def call(self, task, request):
+        """
+        Return request(route) from the best route for task.
+        
+        request must raise on failure; upstream failures and local
+        rejections fail over to the next route, anything else propagates.
+        """
+        routes = self.ranked(task)
+        last_error = None
+        for position, route in enumerate(routes):
+            hedge_route = routes[position + 1] if position + 1 < len(routes) else route
+            try:
+                return self._call_route(task, route, hedge_route, request)
+            except Exception as e:
+                if not _fails_over(e):
+                    raise
+                if position + 1 < len(routes):
+                    logger.warning(f"Route '{route.name}' failed for {task}, trying the next one: {e}")
+                last_error = e
+        raise last_error
+    
+    # Asyncio callers
+    
+    async def _atimed(self, route, request):
+        start = time.perf_counter()
+        try:
+            result = await request(route)
+        except Exception as e:
+            if not isinstance(e, UpstreamUnavailable):
+                self.observe(route, error=is_upstream_failure(e))
+            raise
+        self.observe(route, time.perf_counter() - start)
+        return result
+    
+    async def _acall_route(self, task, route, hedge_route, request):
+        delay = self._hedge_delay(route)
+        if delay is None:
+            return await self._atimed(route, request)
+        
+        primary = asyncio.ensure_future(self._atimed(route, request))
+        pending = {primary: 'primary'}
+        try:
+            done, _ = await asyncio.wait([primary], timeout=delay)
+            if done:
+                pending.clear()
+                return primary.result()
+            
+            pending[asyncio.ensure_future(self._atimed(hedge_route, request))] = 'hedge'
+            error = None
+            while pending:
+                done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    winner = pending.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    hedged_requests.inc(task=task, winner=winner)
+                    return future.result()
+            raise error
+        finally:
+            # Unlike blocking requests, the losing request is cancelled
+            for future in pending:
+                future.cancel()
+    
+    async def acall(self, task, request):
+        """Async variant of call(); request(route) returns an awaitable"""
+        routes = self.ranked(task)
+        last_error = None
+        for position, route in enumerate(routes):
+            hedge_route = routes[position + 1] if position + 1 < len(routes) else route
+            try:
+                return await self._acall_route(task, route, hedge_route, request)
+            except Exception as e:
+                if not _fails_over(e):
+                    raise
+                if position + 1 < len(routes):
+                    logger.warning(f"Route '{route.name}' failed for {task}, trying the next one: {e}")
+                last_error = e
+        raise last_error
+
+
+router = Router()
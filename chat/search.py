@@ -0,0 +1,244 @@
+"""
+Full-text search over a user's messages and conversation titles.
+
+SQLite uses external-content FTS5 tables (chat_message_fts,
+chat_conversation_fts) kept in sync with their source tables by triggers.
+PostgreSQL uses GIN indexes on to_tsvector('english', ...) expressions.
+Both are created by migration 0006_full_text_search; other backends fall
+back to an unindexed icontains scan.
+
+On SQLite, any migration that rebuilds chat_message or chat_conversation
+(most AlterField/AddField operations) drops the triggers with the old table,
+so such migrations must call install_search_index() again afterwards.
+"""
+import html
+import re
+
+from django.db import connection
+
+from .models import Conversation, Message, message_preview
+
+# Highlight markers placed by the database (private-use characters that never occur
+# in chat text), swapped for <mark> tags after escaping
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+
+SNIPPET_WORDS = 16
+
+SQLITE_SEARCH_SQL = [
+    # Messages
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5(
+        content, content='chat_message', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+    # Conversation titles
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_conversation_fts USING fts5(
+        title, content='chat_conversation', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chat_conversation_fts_insert AFTER INSERT ON chat_conversation BEGIN
+        INSERT INTO chat_conversation_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_conversation_fts_delete AFTER DELETE ON chat_conversation BEGIN
+        INSERT INTO chat_conversation_fts(chat_conversation_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_conversation_fts_update AFTER UPDATE OF title ON chat_conversation BEGIN
+        INSERT INTO chat_conversation_fts(chat_conversation_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO chat_conversation_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    "INSERT INTO chat_conversation_fts(chat_conversation_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_SEARCH_SQL = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TABLE IF EXISTS chat_message_fts",
+    "DROP TRIGGER IF EXISTS chat_conversation_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_conversation_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_conversation_fts_update",
+    "DROP TABLE IF EXISTS chat_conversation_fts",
+]
+
+POSTGRESQL_SEARCH_SQL = [
+    "CREATE INDEX IF NOT EXISTS chat_msg_content_fts_idx ON chat_message USING GIN (to_tsvector('english', content))",
+    "CREATE INDEX IF NOT EXISTS chat_conv_title_fts_idx ON chat_conversation USING GIN (to_tsvector('english', title))",
+]
+
+POSTGRESQL_DROP_SEARCH_SQL = [
+    "DROP INDEX IF EXISTS chat_msg_content_fts_idx",
+    "DROP INDEX IF EXISTS chat_conv_title_fts_idx",
+]
+
+
+def install_search_index(schema_editor):
+    """Create (or re-create) the full-text index for the connection's backend"""
+    statements = {
+        'sqlite': SQLITE_SEARCH_SQL,
+        'postgresql': POSTGRESQL_SEARCH_SQL,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+def uninstall_search_index(schema_editor):
+    statements = {
+        'sqlite': SQLITE_DROP_SEARCH_SQL,
+        'postgresql': POSTGRESQL_DROP_SEARCH_SQL,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+def search_terms(query):
+    """Words of a free-text query, lowercased; punctuation and FTS operators are dropped"""
+    return re.findall(r'\w+', query.lower())
+
+
+def fts5_match_query(terms):
+    """FTS5 MATCH expression: every term must appear, the last one as a prefix (search-as-you-type)"""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn the database's match markers into <mark> tags"""
+    return html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def _ranked(sql, params):
+    """Run a ranking query returning (id, snippet, rank) rows; return {id: (snippet, rank)} in rank order"""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {pk: (highlight(snippet), rank) for pk, snippet, rank in cursor.fetchall()}
+
+
+def _annotate(queryset, ranked):
+    """Load the ranked objects and attach .snippet and .rank, keeping the rank order"""
+    objects = queryset.in_bulk(list(ranked))
+    results = []
+    for pk, (snippet, rank) in ranked.items():
+        if pk in objects:
+            obj = objects[pk]
+            obj.snippet, obj.rank = snippet, rank
+            results.append(obj)
+    return results
+
+
+def search_messages(user, query, limit=20, offset=0):
+    """
+    Best-matching messages in the user's conversations, best first. Each
+    message gets .snippet (HTML, matches wrapped in <mark>) and .rank
+    (higher is better); .conversation is preloaded.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    
+    if connection.vendor == 'sqlite':
+        ranked = _ranked(
+            f"""
+            SELECT m.id, snippet(chat_message_fts, 0, %s, %s, '...', {SNIPPET_WORDS}), -bm25(chat_message_fts)
+            FROM chat_message_fts
+            JOIN chat_message m ON m.id = chat_message_fts.rowid
+            JOIN chat_conversation c ON c.id = m.conversation_id
+            WHERE chat_message_fts MATCH %s AND c.user_id = %s
+            ORDER BY bm25(chat_message_fts), m.id DESC
+            LIMIT %s OFFSET %s
+            """,
+            [MARK_START, MARK_END, fts5_match_query(terms), user.pk, limit, offset],
+        )
+    elif connection.vendor == 'postgresql':
+        ranked = _ranked(
+            """
+            SELECT m.id, ts_headline('english', m.content, q, %s), ts_rank_cd(to_tsvector('english', m.content), q)
+            FROM chat_message m
+            JOIN chat_conversation c ON c.id = m.conversation_id,
+                 websearch_to_tsquery('english', %s) q
+            WHERE to_tsvector('english', m.content) @@ q AND c.user_id = %s
+            ORDER BY 3 DESC, m.id DESC
+            LIMIT %s OFFSET %s
+            """,
+            [
+                f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=5',
+                ' '.join(terms), user.pk, limit, offset,
+            ],
+        )
+    else:
+        # No full-text index on this backend: unranked scan, newest first
+        messages = Message.objects.filter(user=user)
+        for term in terms:
+            messages = messages.filter(content__icontains=term)
+        rows = messages.order_by('-created_at', '-id').values_list('pk', 'content')[offset:offset + limit]
+        ranked = {pk: (html.escape(message_preview(content)), 0.0) for pk, content in rows}
+    
+    return _annotate(Message.objects.select_related('conversation'), ranked)
+
+
+def search_conversations(user, query, limit=10):
+    """Best-matching conversation titles of the user, best first, with .snippet (highlighted title) and .rank"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    
+    if connection.vendor == 'sqlite':
+        ranked = _ranked(
+            """
+            SELECT c.id, highlight(chat_conversation_fts, 0, %s, %s), -bm25(chat_conversation_fts)
+            FROM chat_conversation_fts
+            JOIN chat_conversation c ON c.id = chat_conversation_fts.rowid
+            WHERE chat_conversation_fts MATCH %s AND c.user_id = %s
+            ORDER BY bm25(chat_conversation_fts), c.updated_at DESC
+            LIMIT %s
+            """,
+            [MARK_START, MARK_END, fts5_match_query(terms), user.pk, limit],
+        )
+    elif connection.vendor == 'postgresql':
+        ranked = _ranked(
+            """
+            SELECT c.id, ts_headline('english', c.title, q, %s), ts_rank_cd(to_tsvector('english', c.title), q)
+            FROM chat_conversation c, websearch_to_tsquery('english', %s) q
+            WHERE to_tsvector('english', c.title) @@ q AND c.user_id = %s
+            ORDER BY 3 DESC, c.updated_at DESC
+            LIMIT %s
+            """,
+            [f'StartSel={MARK_START}, StopSel={MARK_END}, HighlightAll=true', ' '.join(terms), user.pk, limit],
+        )
+    else:
+        conversations = Conversation.objects.filter(user=user)
+        for term in terms:
+            conversations = conversations.filter(title__icontains=term)
+        ranked = {
+            pk: (html.escape(title), 0.0)
+            for pk, title in conversations.order_by('-updated_at').values_list('pk', 'title')[:limit]
+        }
+    
+    return _annotate(Conversation.objects.all(), ranked)
+
+
+def matching_message_ids(query):
+    """
+    (sql, params) selecting the ids of all messages matching query, for
+    filtering querysets such as the admin search, or None without an index.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return None
+    if connection.vendor == 'sqlite':
+        return "SELECT rowid FROM chat_message_fts WHERE chat_message_fts MATCH %s", [fts5_match_query(terms)]
+    if connection.vendor == 'postgresql':
+        return (
+            "SELECT id FROM chat_message WHERE to_tsvector('english', content) @@ websearch_to_tsquery('english', %s)",
+            [' '.join(terms)],
+        )
+    return None
@@ -10,9 +10,42 @@ class MessageSerializer(serializers.ModelSerializer):
 
 class ConversationSerializer(serializers.ModelSerializer):
     messages = MessageSerializer(many=True, read_only=True)
-    message_count = serializers.IntegerField(source='messages.count', read_only=True)
     
     class Meta:
         model = Conversation
         fields = ['id', 'title', 'created_at', 'updated_at', 'messages', 'message_count']
-        read_only_fields = ['created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['created_at', 'updated_at', 'message_count']
+
+
+class ConversationListSerializer(serializers.ModelSerializer):
+    """Lightweight conversation representation for list views (no messages)"""
+    
+    class Meta:
+        model = Conversation
+        fields = [
+            'id', 'title', 'created_at', 'updated_at', 'message_count', 'last_message_at', 'last_message_preview',
+        ]
+        read_only_fields = fields
+
+
+class MessageSearchResultSerializer(serializers.ModelSerializer):
+    """Message search hit: snippet is HTML-escaped text with matches wrapped in <mark>"""
+    conversation_title = serializers.CharField(source='conversation.title', read_only=True)
+    snippet = serializers.CharField(read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'conversation', 'conversation_title', 'is_from_user', 'created_at', 'snippet', 'rank']
+        read_only_fields = fields
+
+
+class ConversationSearchResultSerializer(serializers.ModelSerializer):
+    """Conversation title hit: snippet is the HTML-escaped title with matches wrapped in <mark>"""
+    snippet = serializers.CharField(read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = Conversation
+        fields = ['id', 'title', 'updated_at', 'snippet', 'rank']
+        read_only_fields = fields
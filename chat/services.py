@@ -1,88 +1,235 @@
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+import asyncio
 import logging
 import json
+import time
+
+from .cache import make_request_key, response_cache
+from .context import ContextBuilder, estimate_tokens, truncate_to_tokens
+from .models import Conversation, Message, message_preview
+from .metrics import upstream_timer
+from .resilience import UpstreamUnavailable, is_upstream_failure, upstream_guard
+from .routing import CHAT, SUMMARY, TITLE, router
+from .sidebar import invalidate_sidebar
+from .singleflight import is_enabled as singleflight_enabled, singleflight
+from .http import (
+    RETRY_AFTER_STATUSES, RETRY_STATUSES, get_async_http_client, get_http_session, get_max_retries, get_retry_delay,
+    get_timeout, httpx,
+)
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "You are a helpful AI assistant. Be conversational, informative, and friendly."
+
 
 class AIService:
     """Service class for handling AI interactions with Euron API"""
     
     def __init__(self):
         self.api_key = getattr(settings, 'EURON_API_KEY', None)
-        self.api_url = "https://api.euron.one/api/v1/euri/chat/completions"
-        self.model = "gpt-4.1-nano"  # Default model
+        # Models and endpoints are picked per call by chat.routing (AI_ROUTES / AI_TASK_ROUTES)
+        self.router = router
+        # Estimated tokens of the last prompt built, charged to the user's quota (chat.ratelimit)
+        self.prompt_tokens = 0
         
         if not self.api_key:
             logger.warning("EURON_API_KEY not found in settings")
     
-    def _make_api_request(self, messages):
-        """Make a request to the Euron API"""
+    def _make_api_request(self, messages, use_cache=True, task=CHAT):
+        """
+        Make a request to the Euron API, served from the response cache when enabled
+        
+        The router picks the model and endpoint for task, failing over to the
+        task's other routes (and hedging slow calls) as configured.
+        """
+        if not self.api_key:
+            raise Exception("API key not configured")
+        
+        # Any route's answer will do, so cache and coalesce on the task's primary model
+        model = self.router.primary(task).model
+        use_cache = use_cache and response_cache.enabled
+        if use_cache:
+            cached = response_cache.get(model, messages)
+            if cached is not None:
+                return cached
+        
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        def send(route):
+            payload = {
+                "messages": messages,
+                "model": route.model
+            }
+            try:
+                # Shared pooled session: keep-alive connections plus retries with backoff on 429/5xx
+                with upstream_guard(name=route.name), upstream_timer(route.model):
+                    response = get_http_session().post(
+                        route.url,
+                        headers=headers,
+                        json=payload,
+                        timeout=get_timeout()
+                    )
+                    response.raise_for_status()
+                    return response.json()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Euron API request failed ({route.name}): {e}")
+                raise
+        
+        def fetch():
+            response_data = self.router.call(task, send)
+            if use_cache:
+                response_cache.set(model, messages, response_data)
+            return response_data
+        
+        if not singleflight_enabled():
+            return fetch()
+        # Identical requests already in flight share one upstream call
+        return singleflight.do(make_request_key(model, messages), fetch)
+    
+    def _build_messages(self, message, conversation_history=None, summary=''):
+        """
+        Build the chat completion messages for a user message and its history.
+        
+        conversation_history should not include the message being answered;
+        the newest turns that fit the context token budget are sent, preceded
+        by the conversation's rolling summary of older turns.
+        """
+        builder = ContextBuilder()
+        messages = builder.build(SYSTEM_PROMPT, message, conversation_history, summary=summary)
+        self.prompt_tokens = builder.prompt_tokens
+        return messages
+    
+    def _make_streaming_request(self, messages):
+        """
+        Make a streaming request to the Euron API and yield content deltas
+        as they arrive (OpenAI-compatible server-sent events)
+        """
         if not self.api_key:
             raise Exception("API key not configured")
         
         headers = {
             "Content-Type": "application/json",
+            "Accept": "text/event-stream",
             "Authorization": f"Bearer {self.api_key}"
         }
         
+        # Streams take the best chat route as it stands; they are not hedged or failed over
+        route = self.router.ranked(CHAT)[0]
         payload = {
             "messages": messages,
-            "model": self.model
+            "model": route.model,
+            "stream": True
         }
         
+        start = time.perf_counter()
         try:
-            response = requests.post(
-                self.api_url,
+            with upstream_guard(name=route.name), upstream_timer(route.model, 'stream'), get_http_session().post(
+                route.url,
                 headers=headers,
                 json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json()
+                timeout=get_timeout(),
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        logger.warning(f"Skipping malformed stream chunk: {data[:100]}")
+                        continue
+                    choices = chunk.get('choices') or []
+                    if not choices:
+                        continue
+                    delta = choices[0].get('delta') or {}
+                    content = delta.get('content')
+                    if content:
+                        yield content
+            # Only completed streams count: one the client abandoned (GeneratorExit) says nothing.
+            # Total time, like the non-streamed calls the route's latency and hedge delay come from.
+            self.router.observe(route, time.perf_counter() - start)
         except requests.exceptions.RequestException as e:
-            logger.error(f"Euron API request failed: {e}")
+            logger.error(f"Euron API streaming request failed ({route.name}): {e}")
+            self.router.observe(route, error=is_upstream_failure(e))
             raise
     
-    def generate_response(self, message, conversation_history=None):
+    def stream_response(self, message, conversation_history=None, summary=''):
+        """
+        Generate an AI response as a stream of text deltas.
+        
+        Errors are reported as a final delta, so the caller always ends up
+        with a complete reply to persist.
+        """
+        if not self.api_key:
+            yield self._fallback_response(message)
+            return
+        
+        received = False
+        try:
+            messages = self._build_messages(message, conversation_history, summary)
+            for delta in self._make_streaming_request(messages):
+                received = True
+                yield delta
+            
+            if not received:
+                logger.error("Euron API stream ended without content")
+                yield "I'm sorry, I received an unexpected response format from the AI service."
+        
+        except UpstreamUnavailable as e:
+            logger.warning(f"Euron API call rejected: {e}")
+            yield self._fallback_response(message)
+        
+        except Exception as e:
+            logger.error(f"Euron API streaming failed: {e}")
+            prefix = "\n\n" if received else ""
+            yield f"{prefix}I'm sorry, I'm having trouble responding right now. Error: {str(e)}"
+    
+    def generate_response(self, message, conversation_history=None, use_cache=True, summary=''):
         """
         Generate AI response using Euron API or fallback
+        
+        Pass use_cache=False to always go upstream, even when the response
+        cache is enabled.
         """
         if not self.api_key:
             return self._fallback_response(message)
             
         try:
-            # Prepare conversation context
-            messages = [
-                {"role": "system", "content": "You are a helpful AI assistant. Be conversational, informative, and friendly."}
-            ]
-            
-            # Add conversation history if provided (last 10 messages for context)
-            if conversation_history:
-                recent_messages = list(conversation_history.order_by('-created_at')[:10])
-                recent_messages.reverse()  # Put them in chronological order
-                for msg in recent_messages:
-                    role = "user" if msg.is_from_user else "assistant"
-                    messages.append({"role": role, "content": msg.content})
-            
-            # Add current message
-            messages.append({"role": "user", "content": message})
+            messages = self._build_messages(message, conversation_history, summary)
             
             # Generate response using Euron API
-            response_data = self._make_api_request(messages)
-            
-            # Extract response from API response
-            if 'choices' in response_data and len(response_data['choices']) > 0:
-                return response_data['choices'][0]['message']['content'].strip()
-            else:
-                logger.error(f"Unexpected API response format: {response_data}")
-                return "I'm sorry, I received an unexpected response format from the AI service."
+            response_data = self._make_api_request(messages, use_cache=use_cache)
+            return self._extract_reply(response_data)
+        
+        except UpstreamUnavailable as e:
+            # Circuit open or too many calls in flight: answer now rather than queue behind a slow upstream
+            logger.warning(f"Euron API call rejected: {e}")
+            return self._fallback_response(message)
             
         except Exception as e:
             logger.error(f"Euron API generation failed: {e}")
             return f"I'm sorry, I'm having trouble responding right now. Error: {str(e)}"
     
+    def _extract_reply(self, response_data):
+        """Extract the reply text from an API response"""
+        if 'choices' in response_data and len(response_data['choices']) > 0:
+            return response_data['choices'][0]['message']['content'].strip()
+        
+        logger.error(f"Unexpected API response format: {response_data}")
+        return "I'm sorry, I received an unexpected response format from the AI service."
+    
     def _fallback_response(self, message):
         """Simple fallback responses when Euron API is not available"""
         responses = {
@@ -99,29 +246,242 @@ class AIService:
         
         return f"I received your message: '{message}'. I'm a demo AI assistant. To enable full AI capabilities, please configure your Euron API key in the settings."
     
-    def generate_conversation_title(self, first_message):
+    def summarize_conversation(self, previous_summary, messages):
         """
-        Generate a title for the conversation based on the first message
+        Fold messages into previous_summary and return the updated summary,
+        or None if no summary could be generated.
         """
         if not self.api_key:
-            return first_message[:30] + ('...' if len(first_message) > 30 else '')
-            
+            return None
+        
+        max_tokens = getattr(settings, 'CHAT_SUMMARY_MAX_TOKENS', 400)
+        max_message_tokens = getattr(settings, 'CHAT_CONTEXT_MAX_MESSAGE_TOKENS', 800)
+        transcript = "\n".join(
+            f"{'User' if msg.is_from_user else 'Assistant'}: {truncate_to_tokens(msg.content, max_message_tokens)}"
+            for msg in messages
+        )
+        prompt = [
+            {"role": "system", "content": (
+                "You maintain a running summary of a conversation between a user and an AI assistant. "
+                "Update the existing summary with the new turns, keeping facts, decisions, names and open "
+                "questions the assistant will need later. "
+                f"Reply with the summary only, at most {max_tokens * 3 // 4} words."
+            )},
+            {"role": "user", "content": (
+                f"Existing summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+            )},
+        ]
+        
         try:
-            messages = [
-                {"role": "system", "content": "Generate a short, descriptive title (max 5 words) for a conversation that starts with the following message:"},
-                {"role": "user", "content": first_message}
-            ]
-            
-            response_data = self._make_api_request(messages)
-            
+            response_data = self._make_api_request(prompt, use_cache=False, task=SUMMARY)
             if 'choices' in response_data and len(response_data['choices']) > 0:
-                title = response_data['choices'][0]['message']['content'].strip().replace('"', '')
-                return title[:50]  # Ensure it's not too long
+                return truncate_to_tokens(response_data['choices'][0]['message']['content'].strip(), max_tokens)
+            logger.error(f"Unexpected API response format: {response_data}")
+        except Exception as e:
+            logger.error(f"Conversation summary failed: {e}")
+        return None
+    
+    def _title_messages(self, first_message):
+        """Build the chat completion messages for title generation"""
+        return [
+            {"role": "system", "content": "Generate a short, descriptive title (max 5 words) for a conversation that starts with the following message:"},
+            {"role": "user", "content": first_message}
+        ]
+    
+    def _extract_title(self, response_data, first_message):
+        """Extract a title from an API response, falling back to the truncated message"""
+        if 'choices' in response_data and len(response_data['choices']) > 0:
+            title = response_data['choices'][0]['message']['content'].strip().replace('"', '')
+            return title[:50]  # Ensure it's not too long
+        
+        return self._fallback_title(first_message)
+    
+    def _fallback_title(self, first_message):
+        """Truncated first message used when no title can be generated"""
+        return first_message[:30] + ('...' if len(first_message) > 30 else '')
+    
+    def generate_conversation_title(self, first_message, raise_errors=False):
+        """
+        Generate a title for the conversation based on the first message
+        
+        With raise_errors=True upstream errors propagate instead of falling
+        back to the truncated message, so a backfill can retry them later.
+        """
+        if not self.api_key:
+            return self._fallback_title(first_message)
             
-            # Fallback to truncated message
-            return first_message[:30] + ('...' if len(first_message) > 30 else '')
+        try:
+            response_data = self._make_api_request(self._title_messages(first_message), task=TITLE)
+            return self._extract_title(response_data, first_message)
             
         except Exception as e:
+            if raise_errors:
+                raise
             logger.error(f"Title generation failed: {e}")
             # Fallback to truncated message
-            return first_message[:30] + ('...' if len(first_message) > 30 else '')
\ No newline at end of file
+            return self._fallback_title(first_message)
+
+
+class AsyncAIService(AIService):
+    """
+    Asyncio variant of AIService for async views.
+    
+    Upstream calls are awaited on an async HTTP client (httpx) so an in-flight
+    completion does not hold a worker thread. Without httpx installed the
+    blocking client runs in a worker thread instead.
+    """
+    
+    async def _make_api_request(self, messages, use_cache=True, task=CHAT):
+        """Make a request to the Euron API without blocking the event loop"""
+        if not self.api_key:
+            raise Exception("API key not configured")
+        
+        if httpx is None:
+            return await sync_to_async(super()._make_api_request, thread_sensitive=False)(messages, use_cache, task)
+        
+        model = self.router.primary(task).model
+        use_cache = use_cache and response_cache.enabled
+        if use_cache:
+            cached = await response_cache.aget(model, messages)
+            if cached is not None:
+                return cached
+        
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        async def send(route):
+            payload = {
+                "messages": messages,
+                "model": route.model
+            }
+            try:
+                client = get_async_http_client()
+                max_retries = get_max_retries()
+                # wait=0: a full bulkhead rejects immediately instead of blocking the event loop
+                with upstream_guard(wait=0, name=route.name), upstream_timer(route.model):
+                    for attempt in range(max_retries + 1):
+                        response = await client.post(route.url, headers=headers, json=payload)
+                        if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                            break
+                        # Same policy as the sync session: jittered backoff on 429/5xx, or the
+                        # upstream's Retry-After on 429/503, capped at the same maximum
+                        retry_after = None
+                        if response.status_code in RETRY_AFTER_STATUSES:
+                            retry_after = response.headers.get('Retry-After')
+                        await asyncio.sleep(get_retry_delay(attempt + 1, retry_after))
+                    response.raise_for_status()
+                    return response.json()
+            except httpx.HTTPError as e:
+                logger.error(f"Euron API request failed ({route.name}): {e}")
+                raise
+        
+        async def fetch():
+            response_data = await self.router.acall(task, send)
+            if use_cache:
+                await response_cache.aset(model, messages, response_data)
+            return response_data
+        
+        if not singleflight_enabled():
+            return await fetch()
+        return await singleflight.ado(make_request_key(model, messages), fetch)
+    
+    async def generate_response(self, message, conversation_history=None, use_cache=True, summary=''):
+        """
+        Generate AI response using Euron API or fallback
+        """
+        if not self.api_key:
+            return self._fallback_response(message)
+        
+        try:
+            # History is read through the (synchronous) ORM
+            messages = await sync_to_async(self._build_messages)(message, conversation_history, summary)
+            response_data = await self._make_api_request(messages, use_cache=use_cache)
+            return self._extract_reply(response_data)
+        
+        except UpstreamUnavailable as e:
+            logger.warning(f"Euron API call rejected: {e}")
+            return self._fallback_response(message)
+        
+        except Exception as e:
+            logger.error(f"Euron API generation failed: {e}")
+            return f"I'm sorry, I'm having trouble responding right now. Error: {str(e)}"
+    
+    async def generate_conversation_title(self, first_message):
+        """
+        Generate a title for the conversation based on the first message
+        """
+        if not self.api_key:
+            return self._fallback_title(first_message)
+        
+        try:
+            response_data = await self._make_api_request(self._title_messages(first_message), task=TITLE)
+            return self._extract_title(response_data, first_message)
+        
+        except Exception as e:
+            logger.error(f"Title generation failed: {e}")
+            return self._fallback_title(first_message)
+
+
+def record_exchange(user, conversation, user_content, ai_content, title=''):
+    """
+    Persist one user message and its AI reply in a single short transaction.
+    
+    Call this after the upstream response is available, never around it: the
+    transaction only covers the writes. With conversation=None a new
+    conversation is created for user. Returns (conversation, user_message,
+    ai_message).
+    
+    Queries: one INSERT for both messages plus one INSERT (new conversation)
+    or UPDATE (existing conversation) for the counters, timestamps and title.
+    """
+    user_message = Message(
+        user=user, content=user_content, is_from_user=True, token_count=estimate_tokens(user_content)
+    )
+    ai_message = Message(user=user, content=ai_content, is_from_user=False, token_count=estimate_tokens(ai_content))
+    now = timezone.now()
+    
+    created = conversation is None
+    with transaction.atomic():
+        if created:
+            conversation = Conversation.objects.create(
+                user=user,
+                title=title,
+                message_count=2,
+                last_message_at=now,
+                last_message_preview=message_preview(ai_content),
+            )
+        else:
+            update = {
+                'message_count': F('message_count') + 2,
+                'last_message_at': now,
+                'last_message_preview': message_preview(ai_content),
+                'updated_at': now,
+            }
+            if title:
+                # Only fill an empty title
+                update['title'] = Case(When(title='', then=Value(title)), default=F('title'))
+            Conversation.objects.filter(pk=conversation.pk).update(**update)
+            invalidate_sidebar(conversation.user_id)
+        
+        user_message.conversation = conversation
+        ai_message.conversation = conversation
+        # Both skip Message.save(), which would bump the counters updated above a second time
+        if connection.features.can_return_rows_from_bulk_insert:
+            Message.objects.bulk_create([user_message, ai_message])
+        else:
+            # Backends that can't return ids from a multi-row INSERT
+            for message in (user_message, ai_message):
+                models.Model.save(message)
+    
+    if not created:
+        # Reflect the UPDATE on the in-memory instance for the caller
+        conversation.message_count += 2
+        conversation.last_message_at = now
+        conversation.last_message_preview = message_preview(ai_content)
+        conversation.updated_at = now
+        if title and not conversation.title:
+            conversation.title = title
+    
+    return conversation, user_message, ai_message
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+Per-user cache of the chat sidebar (the user's most recent conversations).
+
+Cached sidebars are keyed by a per-user version number. invalidate_sidebar()
+bumps the version whenever one of the user's conversations or messages
+changes, which orphans every cached entry of that user at once; until then
+page views read the sidebar from the cache without any SQL. Writes go
+through Conversation/Message save() and delete(), record_exchange() and the
+bulk paths that call invalidate_sidebar() themselves. Only SIDEBAR_FIELDS
+are cached, as dicts: writes to other columns (summaries, is_archived)
+don't invalidate the sidebar, so anything else about a listed conversation
+has to be read from the database.
+
+Entries also expire after CHAT_SIDEBAR_CACHE_TIMEOUT. With several processes,
+use a cache all of them share (e.g. Redis) for CHAT_SIDEBAR_CACHE_ALIAS, or a
+write in one process leaves the others showing a stale sidebar until then.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+SIDEBAR_SIZE = 10
+# What the sidebar displays; cached entries hold nothing else
+SIDEBAR_FIELDS = ('id', 'title', 'created_at', 'updated_at', 'message_count', 'last_message_at', 'last_message_preview')
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_SIDEBAR_CACHE_ENABLED', True)
+
+
+def _cache():
+    return caches[getattr(settings, 'CHAT_SIDEBAR_CACHE_ALIAS', 'default')]
+
+
+def _version_key(user_id):
+    return f'sidebar:version:{user_id}'
+
+
+def _new_version():
+    # Clock-based, so a version evicted from the cache never comes back as an older number
+    return time.time_ns()
+
+
+def sidebar_version(user_id):
+    """Current sidebar version of the user; also usable as a {% cache %} fragment key"""
+    backend = _cache()
+    key = _version_key(user_id)
+    version = backend.get(key)
+    if version is None:
+        version = _new_version()
+        if not backend.add(key, version, None):
+            version = backend.get(key, version)
+    return version
+
+
+def _bump(user_ids):
+    backend = _cache()
+    for user_id in user_ids:
+        key = _version_key(user_id)
+        try:
+            backend.incr(key)
+        except ValueError:
+            backend.set(key, _new_version(), None)
+
+
+def invalidate_sidebar(*user_ids):
+    """Drop the cached sidebars of the given users once the current transaction commits"""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids or not is_enabled():
+        return
+    # After commit: bumping earlier would let a concurrent request cache the old rows under the new version
+    transaction.on_commit(lambda: _bump(user_ids))
+
+
+def get_sidebar(user, queryset):
+    """
+    The user's sidebar conversations as a list of SIDEBAR_FIELDS dicts.
+    
+    queryset selects them and is only evaluated on a cache miss.
+    """
+    queryset = queryset.values(*SIDEBAR_FIELDS)
+    if not is_enabled():
+        return list(queryset)
+    backend = _cache()
+    key = f'sidebar:{user.pk}:{sidebar_version(user.pk)}'
+    conversations = backend.get(key)
+    if conversations is None:
+        conversations = list(queryset)
+        backend.set(key, conversations, getattr(settings, 'CHAT_SIDEBAR_CACHE_TIMEOUT', 300))
+    return conversations
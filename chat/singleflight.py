@@ -0,0 +1,223 @@
+"""
+Single-flight coalescing of identical concurrent upstream requests.
+
+When several requests with the same model and messages (make_request_key)
+are in flight at once, only the first one (the leader) calls the upstream;
+the others (followers) wait for its result and get their own copy of it.
+A leader's exception is re-raised in its followers.
+
+Within a process, threads coalesce on an Event and coroutines on a Future
+per event loop. With AI_SINGLEFLIGHT_SHARED enabled, process leaders also
+coordinate through a lock in the AI_SINGLEFLIGHT_CACHE_ALIAS cache, so
+followers in other processes (sharing e.g. a Redis cache) poll for the
+leader's result instead of calling upstream themselves.
+"""
+import asyncio
+import copy
+import json
+import logging
+import threading
+import time
+import uuid
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import REGISTRY, Counter
+
+logger = logging.getLogger(__name__)
+
+singleflight_requests = REGISTRY.register(Counter(
+    'chat_singleflight_requests', "Upstream requests by single-flight role (only leaders reach upstream)", ['role'],
+))
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_enabled():
+    return _setting('AI_SINGLEFLIGHT_ENABLED', True)
+
+
+def _wait_timeout():
+    """Seconds a follower waits for its leader before calling upstream itself"""
+    return _setting('AI_SINGLEFLIGHT_WAIT_TIMEOUT', 60)
+
+
+class _LeaderCancelled(Exception):
+    """Handed to async followers when their leader was cancelled before finishing"""
+
+
+class _Call:
+    """An in-flight leader call that followers in this process wait on"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SharedLock:
+    """Cross-process leader election and result hand-off through the Django cache"""
+    
+    @property
+    def backend(self):
+        return caches[_setting('AI_SINGLEFLIGHT_CACHE_ALIAS', 'default')]
+    
+    def _lock_key(self, key):
+        return f'singleflight:lock:{key}'
+    
+    def _result_key(self, key, token):
+        return f'singleflight:result:{key}:{token}'
+    
+    def call(self, key, func):
+        backend = self.backend
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        if backend.add(lock_key, token, timeout=_setting('AI_SINGLEFLIGHT_LOCK_TIMEOUT', 60)):
+            try:
+                result = func()
+                backend.set(
+                    self._result_key(key, token), json.dumps(result), _setting('AI_SINGLEFLIGHT_RESULT_TTL', 10)
+                )
+                return result
+            finally:
+                backend.delete(lock_key)
+        
+        # Another process leads this request: poll for the result it publishes under its token
+        singleflight_requests.inc(role='shared_follower')
+        deadline = time.monotonic() + _wait_timeout()
+        poll_interval = _setting('AI_SINGLEFLIGHT_POLL_INTERVAL', 0.05)
+        leader_token = backend.get(lock_key)
+        while leader_token is not None and time.monotonic() < deadline:
+            encoded = backend.get(self._result_key(key, leader_token))
+            if encoded is not None:
+                return json.loads(encoded)
+            if backend.get(lock_key) != leader_token:
+                # Released: either the result is there now or the leader failed
+                encoded = backend.get(self._result_key(key, leader_token))
+                if encoded is not None:
+                    return json.loads(encoded)
+                break
+            time.sleep(poll_interval)
+        return func()
+    
+    async def acall(self, key, coro_func):
+        backend = self.backend
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        if await backend.aadd(lock_key, token, timeout=_setting('AI_SINGLEFLIGHT_LOCK_TIMEOUT', 60)):
+            try:
+                result = await coro_func()
+                await backend.aset(
+                    self._result_key(key, token), json.dumps(result), _setting('AI_SINGLEFLIGHT_RESULT_TTL', 10)
+                )
+                return result
+            finally:
+                await backend.adelete(lock_key)
+        
+        singleflight_requests.inc(role='shared_follower')
+        deadline = time.monotonic() + _wait_timeout()
+        poll_interval = _setting('AI_SINGLEFLIGHT_POLL_INTERVAL', 0.05)
+        leader_token = await backend.aget(lock_key)
+        while leader_token is not None and time.monotonic() < deadline:
+            encoded = await backend.aget(self._result_key(key, leader_token))
+            if encoded is not None:
+                return json.loads(encoded)
+            if await backend.aget(lock_key) != leader_token:
+                encoded = await backend.aget(self._result_key(key, leader_token))
+                if encoded is not None:
+                    return json.loads(encoded)
+                break
+            await asyncio.sleep(poll_interval)
+        return await coro_func()
+
+
+class SingleFlight:
+    """Process-wide coalescing group for blocking and asyncio callers"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # Futures belong to one event loop, so coroutines coalesce per loop
+        self._async_calls = weakref.WeakKeyDictionary()
+        self.shared_lock = SharedLock()
+    
+    def _lead(self, key, func):
+        if _setting('AI_SINGLEFLIGHT_SHARED', False):
+            return self.shared_lock.call(key, func)
+        return func()
+    
+    def do(self, key, func):
+        """Return func() for the leader of key; followers get a copy of the leader's result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        
+        if not leader:
+            singleflight_requests.inc(role='follower')
+            if not call.done.wait(_wait_timeout()):
+                logger.warning("Single-flight leader timed out; calling upstream directly")
+                return func()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        
+        singleflight_requests.inc(role='leader')
+        try:
+            call.result = self._lead(key, func)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    async def ado(self, key, coro_func):
+        """Async variant of do(); coro_func is called (and awaited) by the leader only"""
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            singleflight_requests.inc(role='follower')
+            try:
+                # shield: a cancelled follower must not cancel the leader's result
+                result = await asyncio.wait_for(asyncio.shield(future), _wait_timeout())
+            except asyncio.TimeoutError:
+                logger.warning("Single-flight leader timed out; calling upstream directly")
+                return await coro_func()
+            except _LeaderCancelled:
+                return await coro_func()
+            return copy.deepcopy(result)
+        
+        singleflight_requests.inc(role='leader')
+        future = calls[key] = loop.create_future()
+        try:
+            if _setting('AI_SINGLEFLIGHT_SHARED', False):
+                result = await self.shared_lock.acall(key, coro_func)
+            else:
+                result = await coro_func()
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve it so a future nobody awaited does not log "exception was never retrieved"
+            future.exception()
+            raise
+        except BaseException:
+            # Leader cancelled: followers fall back to their own call
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            calls.pop(key, None)
+
+
+singleflight = SingleFlight()
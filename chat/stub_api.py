@@ -0,0 +1,188 @@
+"""
+Local stand-in for the Euron /chat/completions endpoint, for offline load tests.
+
+Speaks the JSON shape AIService expects (choices[0].message.content, usage)
+and the server-sent event stream used by stream_response. Latency follows a
+log-normal distribution around latency_ms; error_rate of the requests fail
+with error_status.
+
+Used by the loadtest_chat management command, or standalone:
+
+    python -m chat.stub_api --port 8765 --latency-ms 300
+    EURON_API_URL=http://127.0.0.1:8765/chat/completions python manage.py runserver
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOREM = (
+    "the quick brown fox jumps over the lazy dog while a helpful assistant explains "
+    "each step of the answer with examples and short notes"
+).split()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request (e.g. a cancelled hedged request)
+            self.close_connection = True
+    
+    def do_POST(self):
+        stub = self.server.stub
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'Invalid JSON'})
+            return
+        
+        time.sleep(stub.sample_latency())
+        if stub.should_fail():
+            stub.record(error=True)
+            self._send_json(stub.error_status, {'error': {'message': 'Stub upstream error'}})
+            return
+        stub.record(error=False)
+        
+        messages = payload.get('messages') or [{}]
+        words = stub.reply_words(messages[-1].get('content', ''))
+        if payload.get('stream'):
+            self._stream(words)
+            return
+        
+        self._send_json(200, {
+            'id': f'stub-{time.monotonic_ns()}',
+            'object': 'chat.completion',
+            'model': payload.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ' '.join(words)},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': sum(len(m.get('content', '')) // 4 for m in messages),
+                'completion_tokens': len(words),
+            },
+        })
+    
+    def _stream(self, words):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for i in range(0, len(words), 8):
+            chunk = {'choices': [{'index': 0, 'delta': {'content': ' '.join(words[i:i + 8]) + ' '}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class StubEuronServer:
+    """Threaded stub server; start() binds a free port unless one is given"""
+    
+    def __init__(self, latency_ms=200, latency_sigma=0.5, error_rate=0.0, error_status=500,
+                 response_words=150, host='127.0.0.1', port=0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.response_words = response_words
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+    
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/chat/completions"
+    
+    def sample_latency(self):
+        """Seconds to wait before answering; log-normal with median latency_ms"""
+        if self.latency_ms <= 0:
+            return 0
+        with self._lock:
+            factor = math.exp(self._random.gauss(0, self.latency_sigma)) if self.latency_sigma else 1
+        return self.latency_ms * factor / 1000
+    
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+    
+    def reply_words(self, prompt):
+        words = [f"Stub reply to: {prompt[:40]}"]
+        words.extend(LOREM[i % len(LOREM)] for i in range(max(0, self.response_words - 1)))
+        return words
+    
+    def record(self, error):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+    
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-euron', daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stub of the Euron chat completions API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--response-words', type=int, default=150)
+    args = parser.parse_args()
+    
+    server = StubEuronServer(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+        error_status=args.error_status, response_words=args.response_words, host=args.host, port=args.port,
+    ).start()
+    print(f"Stub Euron API listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Lightweight background tasks for work that should not hold up a response.
+
+Functions decorated with @task gain an ``enqueue(*args, **kwargs)`` method that
+hands the call to the backend selected by CHAT_TASK_BACKEND:
+
+- ``'thread'`` (default): a bounded in-process queue drained by a small pool of
+  worker threads, shut down gracefully at interpreter exit.
+- ``'celery'``: the task is sent to a Celery broker (celery/redis are listed in
+  requirements.txt); run workers with ``celery -A genai_project worker``.
+- ``'eager'``: run inline, for tests and debugging.
+
+Task arguments must be plain picklable/JSON values (ids, strings), not model
+instances, so the same call works with every backend.
+"""
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BackgroundTaskRunner:
+    """Bounded queue drained by a fixed pool of daemon worker threads"""
+    
+    def __init__(self, max_workers=4, max_queue_size=1000):
+        self.max_workers = max_workers
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+    
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads or self._shutdown:
+                return
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._worker, name=f'chat-tasks-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+    
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                func, args, kwargs = item
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    logger.exception(f"Background task {func.__name__} failed")
+                finally:
+                    # Worker threads hold their own DB connections; don't let them go stale
+                    close_old_connections()
+            finally:
+                self._queue.task_done()
+    
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs); returns False if the runner is full or shut down"""
+        if self._shutdown:
+            logger.warning(f"Task runner is shut down, dropping {func.__name__}")
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            logger.warning(f"Task queue full, dropping {func.__name__}")
+            return False
+        return True
+    
+    def shutdown(self, wait=True, timeout=10):
+        """Stop accepting tasks and let workers finish what is already queued"""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = list(self._threads)
+        for _ in threads:
+            # Blocks if the queue is full; workers keep draining it meanwhile
+            self._queue.put(_STOP)
+        if wait:
+            for thread in threads:
+                thread.join(timeout)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_task_runner():
+    """Return the process-wide BackgroundTaskRunner"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = BackgroundTaskRunner(
+                    max_workers=getattr(settings, 'CHAT_TASK_WORKERS', 4),
+                    max_queue_size=getattr(settings, 'CHAT_TASK_QUEUE_SIZE', 1000),
+                )
+                atexit.register(_runner.shutdown)
+    return _runner
+
+
+def _celery_task(func):
+    """Register func with Celery if it is installed"""
+    try:
+        from celery import shared_task
+    except ImportError:
+        return None
+    return shared_task(name=f'{func.__module__}.{func.__name__}')(func)
+
+
+def task(func):
+    """Decorator adding ``func.enqueue(*args, **kwargs)`` to run func in the background"""
+    celery_task = _celery_task(func)
+    
+    def enqueue(*args, **kwargs):
+        backend = getattr(settings, 'CHAT_TASK_BACKEND', 'thread')
+        if backend == 'eager':
+            func(*args, **kwargs)
+            return True
+        if backend == 'celery':
+            if celery_task is None:
+                raise RuntimeError("CHAT_TASK_BACKEND is 'celery' but celery is not installed")
+            from genai_project.celery import app  # noqa: F401 - binds shared tasks to the project app
+            celery_task.delay(*args, **kwargs)
+            return True
+        return get_task_runner().submit(func, *args, **kwargs)
+    
+    func.enqueue = enqueue
+    return func
+
+
+@task
+def generate_conversation_title(conversation_id, first_message):
+    """Generate and store a title for a conversation that doesn't have one yet"""
+    from .models import Conversation
+    from .services import AIService
+    from .sidebar import invalidate_sidebar
+    
+    title = AIService().generate_conversation_title(first_message)
+    # Only fill an empty title, and don't bump updated_at for it
+    if Conversation.objects.filter(pk=conversation_id, title='').update(title=title):
+        invalidate_sidebar(Conversation.objects.filter(pk=conversation_id).values_list('user_id', flat=True).first())
+
+
+@task
+def update_conversation_summary(conversation_id):
+    """
+    Fold turns that have scrolled out of the recent window into the
+    conversation's rolling summary.
+    
+    Only messages newer than summary_through_id are read, so the work per run
+    is bounded by the batch size rather than the conversation length.
+    """
+    from .models import Conversation
+    from .services import AIService
+    
+    keep_recent = getattr(settings, 'CHAT_SUMMARY_KEEP_RECENT', 10)
+    min_batch = getattr(settings, 'CHAT_SUMMARY_MIN_BATCH', 10)
+    max_batch = getattr(settings, 'CHAT_SUMMARY_MAX_BATCH', 40)
+    
+    conversation = Conversation.objects.only('id', 'summary', 'summary_through_id').get(pk=conversation_id)
+    history = conversation.recent_history()
+    
+    # The newest keep_recent messages stay verbatim; everything older is foldable
+    window = list(history.order_by('-id').values_list('id', flat=True)[:keep_recent])
+    if len(window) < keep_recent:
+        return
+    to_fold = list(
+        history.filter(id__lt=window[-1])
+        .only('id', 'conversation_id', 'content', 'is_from_user')
+        .order_by('id')[:max_batch]
+    )
+    if len(to_fold) < min_batch:
+        return
+    
+    summary = AIService().summarize_conversation(conversation.summary, to_fold)
+    if summary is None:
+        return
+    
+    # Don't clobber a concurrent run that already moved the summary forward
+    Conversation.objects.filter(
+        pk=conversation.pk, summary_through_id=conversation.summary_through_id
+    ).update(summary=summary, summary_through_id=to_fold[-1].id)
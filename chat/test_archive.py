@@ -0,0 +1,165 @@
+"""
+Archival of inactive conversations and their restore (chat.archive).
+"""
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive
+from .archive import ZLIB, ZSTD, archive_conversations, restore_conversation
+from .models import Conversation, ConversationArchive, Message
+from .search import search_messages
+
+COUNTER_FIELDS = ('updated_at', 'message_count', 'last_message_at', 'last_message_preview', 'is_archived')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ArchiveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='archivist', email='archivist@example.com', password='password')
+        cls.conversation = Conversation.objects.create(user=cls.user, title='Old conversation')
+        start = timezone.now() - timedelta(days=365)
+        for i in range(6):
+            message = Message.objects.create(
+                conversation=cls.conversation, content=f'zebra fact number {i}', is_from_user=i % 2 == 0,
+            )
+            Message.objects.filter(pk=message.pk).update(created_at=start + timedelta(minutes=i))
+        Conversation.objects.filter(pk=cls.conversation.pk).update(updated_at=start + timedelta(minutes=6))
+        Conversation.objects.filter(pk=cls.conversation.pk).refresh_message_stats()
+        cls.recent = Conversation.objects.create(user=cls.user, title='Recent conversation')
+        Message.objects.create(conversation=cls.recent, content='zebra news', is_from_user=True)
+    
+    def messages(self):
+        return list(Message.objects.filter(conversation=self.conversation).order_by('pk').values_list(
+            'pk', 'user_id', 'content', 'is_from_user', 'created_at', 'token_count',
+        ))
+    
+    def counters(self):
+        return Conversation.objects.filter(pk=self.conversation.pk).values(*COUNTER_FIELDS).get()
+    
+    def archive_old(self, codec=None):
+        cutoff = timezone.now() - timedelta(days=30)
+        with self.captureOnCommitCallbacks(execute=True):
+            return archive_conversations([self.conversation.pk, self.recent.pk], cutoff, codec)
+    
+    def search(self):
+        return {message.conversation_id for message in search_messages(self.user, 'zebra')}
+    
+    def assertRoundTrip(self, codec):
+        messages = self.messages()
+        counters = self.counters()
+        self.assertEqual(self.search(), {self.conversation.pk, self.recent.pk})
+        
+        conversations, count, raw_size, stored_size = self.archive_old(codec)
+        self.assertEqual((conversations, count), (1, 6))
+        self.assertLess(stored_size, raw_size)
+        self.assertEqual(ConversationArchive.objects.get(pk=self.conversation.pk).codec, codec)
+        self.assertEqual(self.messages(), [])
+        # Lists keep showing the conversation as before
+        self.assertEqual(self.counters(), dict(counters, is_archived=True))
+        self.assertEqual(self.search(), {self.recent.pk})
+        self.assertFalse(Conversation.objects.get(pk=self.recent.pk).is_archived)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(restore_conversation(Conversation.objects.get(pk=self.conversation.pk)), 6)
+        self.assertEqual(self.messages(), messages)
+        self.assertEqual(self.counters(), counters)
+        self.assertFalse(ConversationArchive.objects.exists())
+        self.assertEqual(self.search(), {self.conversation.pk, self.recent.pk})
+    
+    def test_round_trip(self):
+        self.assertRoundTrip(ZLIB)
+    
+    @mock.patch.object(archive, 'zstandard', None)
+    def test_zstd_needs_zstandard(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.archive_old(ZSTD)
+    
+    def test_round_trip_zstd(self):
+        if archive.zstandard is None:
+            self.skipTest("zstandard is not installed")
+        self.assertRoundTrip(ZSTD)
+    
+    def test_message_added_during_archival_survives(self):
+        compress = archive.compress
+        added = []
+        
+        def compress_then_add(data, codec):
+            # A message saved after the archived rows were read, before they are deleted
+            added.append(Message.objects.create(conversation=self.conversation, content='late', is_from_user=True))
+            return compress(data, codec)
+        
+        with mock.patch.object(archive, 'compress', compress_then_add):
+            self.assertEqual(self.archive_old()[1], 6)
+        self.assertEqual([pk for pk, *_ in self.messages()], [added[0].pk])
+        
+        restore_conversation(Conversation.objects.get(pk=self.conversation.pk))
+        self.assertEqual(len(self.messages()), 7)
+        self.assertEqual(Conversation.objects.get(pk=self.conversation.pk).message_count, 7)
+    
+    def test_restore_is_idempotent(self):
+        self.archive_old()
+        stale = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(restore_conversation(Conversation.objects.get(pk=self.conversation.pk)), 6)
+        self.assertEqual(restore_conversation(stale), 0)
+        self.assertEqual(len(self.messages()), 6)
+    
+    def test_recompute_keeps_archived_counters(self):
+        counters = self.counters()
+        self.archive_old()
+        call_command('recompute_conversation_stats', stdout=StringIO())
+        self.assertEqual(self.counters(), dict(counters, is_archived=True))
+        # Still listed as having messages, and restored in full
+        self.assertEqual(restore_conversation(Conversation.objects.get(pk=self.conversation.pk)), 6)
+        self.assertEqual(self.counters(), counters)
+    
+    def test_restore_repairs_counters(self):
+        self.archive_old()
+        Conversation.objects.filter(pk=self.conversation.pk).update(message_count=0, last_message_preview='')
+        restore_conversation(Conversation.objects.get(pk=self.conversation.pk))
+        conversation = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.message_count, 6)
+        self.assertEqual(conversation.last_message_preview, 'zebra fact number 5')
+    
+    def test_restored_conversations_are_not_archived_again_right_away(self):
+        self.archive_old()
+        restore_conversation(Conversation.objects.get(pk=self.conversation.pk))
+        restored = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertIsNotNone(restored.restored_at)
+        # updated_at is untouched, so only restored_at keeps it out of the next run
+        self.assertEqual(self.archive_old(), (0, 0, 0, 0))
+        call_command('archive_conversations', inactive_days=30, sleep=0, stdout=StringIO())
+        self.assertFalse(Conversation.objects.get(pk=self.conversation.pk).is_archived)
+        
+        later = restored.restored_at + timedelta(seconds=1)
+        self.assertEqual(archive_conversations([self.conversation.pk], later)[:2], (1, 6))
+    
+    def test_recently_updated_conversations_are_skipped(self):
+        self.assertEqual(archive_conversations([self.recent.pk], timezone.now() - timedelta(days=30)), (0, 0, 0, 0))
+        self.assertFalse(ConversationArchive.objects.exists())
+    
+    def test_opening_restores(self):
+        self.client.force_login(self.user)
+        self.archive_old()
+        response = self.client.get(reverse('chat:api_older_messages', args=[self.conversation.pk]))
+        self.assertEqual([message['content'] for message in response.json()['messages']],
+                         [f'zebra fact number {i}' for i in range(6)])
+        self.assertFalse(Conversation.objects.get(pk=self.conversation.pk).is_archived)
+    
+    def test_api_retrieve_restores(self):
+        self.client.force_login(self.user)
+        self.archive_old()
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 6)
+        self.assertEqual(len(self.messages()), 6)
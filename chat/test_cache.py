@@ -0,0 +1,105 @@
+"""
+The opt-in cache of upstream AI responses (chat.cache).
+"""
+import asyncio
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from .cache import cache_lookups, make_request_key, response_cache
+from .services import AIService
+
+MESSAGES = [{'role': 'system', 'content': 'Be brief.'}, {'role': 'user', 'content': 'Hello'}]
+
+
+def completion(content):
+    return {'choices': [{'message': {'role': 'assistant', 'content': content}}]}
+
+
+def lookups():
+    """Cache lookups counted so far, by result"""
+    return {dict(labels)['result']: value for _, labels, value in cache_lookups.samples()}
+
+
+@override_settings(
+    EURON_API_KEY='test-key',
+    AI_RESPONSE_CACHE_ENABLED=True,
+    AI_RESPONSE_CACHE_ALIAS='ai_responses',
+    AI_RESPONSE_CACHE_MAX_ENTRY_BYTES=1024,
+    AI_SINGLEFLIGHT_ENABLED=False,
+)
+class ResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['ai_responses'].clear()
+        self.service = AIService()
+        self.model = self.service.router.primary('chat').model
+        patcher = mock.patch.object(self.service.router, 'call')
+        self.upstream = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def cached(self, messages=MESSAGES):
+        return response_cache.get(self.model, messages)
+    
+    def test_completion_is_cached_and_served(self):
+        self.upstream.return_value = completion('Hi there')
+        self.assertEqual(self.service._make_api_request(MESSAGES), completion('Hi there'))
+        self.assertEqual(self.service._make_api_request(MESSAGES), completion('Hi there'))
+        self.assertEqual(self.upstream.call_count, 1)
+    
+    def test_use_cache_false_bypasses_the_cache(self):
+        self.upstream.return_value = completion('Hi there')
+        self.service._make_api_request(MESSAGES)
+        before = lookups()
+        self.service._make_api_request(MESSAGES, use_cache=False)
+        self.assertEqual(self.upstream.call_count, 2)
+        self.assertEqual(lookups(), before)
+    
+    @override_settings(AI_RESPONSE_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.upstream.return_value = completion('Hi there')
+        self.service._make_api_request(MESSAGES)
+        self.service._make_api_request(MESSAGES)
+        self.assertEqual(self.upstream.call_count, 2)
+        self.assertIsNone(self.cached())
+    
+    def test_errors_are_not_cached(self):
+        self.upstream.side_effect = ConnectionError("upstream down")
+        with self.assertLogs('chat.services', 'ERROR'):
+            reply = self.service.generate_response('Hello')
+        self.assertIn("trouble responding", reply)
+        self.assertIsNone(self.cached())
+    
+    def test_fallback_and_empty_responses_are_not_cached(self):
+        for response_data in ({'error': {'message': 'Rate limited'}}, {'choices': []}, completion('   '), None):
+            response_cache.set(self.model, MESSAGES, response_data)
+            self.assertIsNone(self.cached())
+    
+    def test_oversized_entries_are_skipped(self):
+        response_cache.set(self.model, MESSAGES, completion('x' * 2000))
+        self.assertIsNone(self.cached())
+        response_cache.set(self.model, MESSAGES, completion('x' * 500))
+        self.assertEqual(self.cached(), completion('x' * 500))
+    
+    def test_key_depends_on_model_and_messages(self):
+        key = make_request_key('model-a', MESSAGES)
+        self.assertEqual(key, make_request_key('model-a', [dict(message) for message in MESSAGES]))
+        self.assertNotEqual(key, make_request_key('model-b', MESSAGES))
+        self.assertNotEqual(key, make_request_key('model-a', MESSAGES[:1]))
+        self.assertNotEqual(key, make_request_key('model-a', MESSAGES + [{'role': 'user', 'content': 'Hello'}]))
+        
+        response_cache.set(self.model, MESSAGES, completion('Hi there'))
+        self.assertIsNone(response_cache.get('another-model', MESSAGES))
+        self.assertIsNone(self.cached(MESSAGES[1:]))
+    
+    def test_hits_and_misses_are_counted(self):
+        before = lookups()
+        self.assertIsNone(self.cached())
+        response_cache.set(self.model, MESSAGES, completion('Hi there'))
+        self.cached()
+        self.cached()
+        asyncio.run(response_cache.aget(self.model, MESSAGES))
+        after = lookups()
+        self.assertEqual(after.get('miss', 0) - before.get('miss', 0), 1)
+        self.assertEqual(after.get('hit', 0) - before.get('hit', 0), 3)
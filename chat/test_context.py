@@ -0,0 +1,91 @@
+"""
+Token-budget prompt construction (chat.context.ContextBuilder).
+"""
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from .context import MESSAGE_OVERHEAD_TOKENS, TRUNCATION_MARKER, ContextBuilder, estimate_tokens
+from .models import Conversation, Message
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ContextBuilderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        user = User.objects.create_user(username='context', email='context@example.com', password='password')
+        cls.conversation = Conversation.objects.create(user=user, title='Context')
+        # 40 characters each: 10 tokens, 14 with the per-message overhead
+        for i in range(10):
+            Message.objects.create(conversation=cls.conversation, content=f'turn {i:02d} '.ljust(40, '.'),
+                                   is_from_user=i % 2 == 0)
+    
+    def history(self):
+        return self.conversation.messages.all()
+    
+    def fixed_cost(self, message, summary=''):
+        cost = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(message) + 2 * MESSAGE_OVERHEAD_TOKENS
+        if summary:
+            cost += estimate_tokens(f"Summary of the earlier conversation:\n{summary}") + MESSAGE_OVERHEAD_TOKENS
+        return cost
+    
+    def test_oldest_turns_dropped_first(self):
+        budget = self.fixed_cost('Next?') + 3 * 14 + 5
+        builder = ContextBuilder(token_budget=budget)
+        messages = builder.build(SYSTEM_PROMPT, 'Next?', self.history())
+        self.assertEqual(builder.prompt_tokens, self.fixed_cost('Next?') + 3 * 14)
+        self.assertEqual(messages[0], {'role': 'system', 'content': SYSTEM_PROMPT})
+        self.assertEqual(messages[-1], {'role': 'user', 'content': 'Next?'})
+        # The three newest turns, oldest first, with their roles
+        self.assertEqual([message['content'][:7] for message in messages[1:-1]], ['turn 07', 'turn 08', 'turn 09'])
+        self.assertEqual([message['role'] for message in messages[1:-1]], ['assistant', 'user', 'assistant'])
+    
+    def test_whole_history_when_it_fits(self):
+        messages = ContextBuilder(token_budget=10000).build(SYSTEM_PROMPT, 'Next?', self.history())
+        self.assertEqual(len(messages), 12)
+    
+    def test_system_summary_and_message_always_kept(self):
+        message = 'A long question ' * 50
+        messages = ContextBuilder(token_budget=10).build(SYSTEM_PROMPT, message, self.history(), summary='We met.')
+        self.assertEqual(messages, [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'system', 'content': "Summary of the earlier conversation:\nWe met."},
+            {'role': 'user', 'content': message},
+        ])
+    
+    def test_summary_takes_from_the_history_budget(self):
+        summary = 'x' * 40
+        budget = self.fixed_cost('Next?') + 3 * 14 + 5
+        messages = ContextBuilder(token_budget=budget).build(SYSTEM_PROMPT, 'Next?', self.history(), summary=summary)
+        self.assertEqual(messages[1]['content'], f"Summary of the earlier conversation:\n{summary}")
+        self.assertEqual([message['content'][:7] for message in messages[2:-1]], ['turn 09'])
+    
+    def test_long_messages_are_truncated(self):
+        Message.objects.create(conversation=self.conversation, content='y' * 400, is_from_user=False)
+        messages = ContextBuilder(token_budget=10000, max_message_tokens=20).build(
+            SYSTEM_PROMPT, 'Next?', self.history(),
+        )
+        self.assertTrue(messages[-2]['content'].endswith(TRUNCATION_MARKER))
+        self.assertLessEqual(estimate_tokens(messages[-2]['content']), 20)
+    
+    def test_cached_token_counts_are_used(self):
+        # A stored count is trusted as is: this short turn now looks too big to fit
+        newest = self.conversation.messages.order_by('-created_at', '-id').first()
+        Message.objects.filter(pk=newest.pk).update(token_count=20000)
+        with self.assertNumQueries(1):
+            messages = ContextBuilder(token_budget=10000, max_message_tokens=50000).build(
+                SYSTEM_PROMPT, 'Next?', self.history(),
+            )
+        self.assertEqual(messages[1:-1], [])
+    
+    def test_missing_token_counts_are_stored_once(self):
+        Message.objects.filter(conversation=self.conversation).update(token_count=None)
+        with self.assertNumQueries(2):
+            first = ContextBuilder(token_budget=10000).build(SYSTEM_PROMPT, 'Next?', self.history())
+        self.assertEqual(set(self.history().values_list('token_count', flat=True)), {10})
+        with self.assertNumQueries(1):
+            second = ContextBuilder(token_budget=10000).build(SYSTEM_PROMPT, 'Next?', self.history())
+        self.assertEqual(first, second)
@@ -0,0 +1,132 @@
+"""
+Round trip of the JSONL history export and import (chat.exports).
+"""
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import views
+from .archive import archive_conversations, restore_conversation
+from .exports import InvalidExportError, export_lines, import_lines
+from .models import Conversation, Message
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ExportImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password')
+        cls.other = User.objects.create_user(username='other', email='other@example.com', password='password')
+        cls.start = timezone.now() - timedelta(days=400)
+        
+        cls.live = cls._conversation('Live conversation', 3, days=10)
+        cls.archived = cls._conversation('Archived conversation', 4, days=0)
+        Conversation.objects.filter(pk=cls.archived.pk).update(summary='Earlier turns', summary_through_id=1)
+        Conversation.objects.create(user=cls.other, title='Not exported')
+        archive_conversations([cls.archived.pk], timezone.now())
+    
+    @classmethod
+    def _conversation(cls, title, messages, days):
+        created_at = cls.start + timedelta(days=days)
+        conversation = Conversation.objects.create(user=cls.owner, title=title)
+        for i in range(messages):
+            Message.objects.create(conversation=conversation, content=f'{title} message {i}', is_from_user=i % 2 == 0)
+        for i, message in enumerate(conversation.messages.order_by('pk')):
+            Message.objects.filter(pk=message.pk).update(created_at=created_at + timedelta(minutes=i))
+        Conversation.objects.filter(pk=conversation.pk).update(
+            created_at=created_at, updated_at=created_at + timedelta(minutes=messages),
+        )
+        Conversation.objects.filter(pk=conversation.pk).refresh_message_stats()
+        return conversation
+    
+    def history(self, user):
+        """Everything an export should preserve, without ids"""
+        return [
+            (
+                conversation.title,
+                conversation.created_at,
+                conversation.updated_at,
+                conversation.message_count,
+                conversation.last_message_at,
+                conversation.last_message_preview,
+                list(conversation.messages.order_by('created_at', 'pk').values_list(
+                    'content', 'is_from_user', 'created_at'
+                )),
+            )
+            for conversation in Conversation.objects.filter(user=user).order_by('created_at')
+        ]
+    
+    def test_round_trip(self):
+        self.assertTrue(Conversation.objects.get(pk=self.archived.pk).is_archived)
+        lines = list(export_lines(user=self.owner, chunk_size=2))
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(records[0]['type'], 'export')
+        self.assertEqual([record['type'] for record in records[1:]], ['conversation'] + ['message'] * 3
+                         + ['conversation'] + ['message'] * 4)
+        # Archived messages are exported from their archive
+        self.assertEqual(records[5]['title'], 'Archived conversation')
+        self.assertEqual(records[-1]['content'], 'Archived conversation message 3')
+        self.assertNotIn('summary', records[5])
+        
+        User = get_user_model()
+        target = User.objects.create_user(username='target', email='target@example.com', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(import_lines(lines, user=target, batch_size=2), (2, 7))
+        
+        # The archived conversation's messages came from the archive, so restore it before comparing
+        restore_conversation(Conversation.objects.get(pk=self.archived.pk))
+        self.assertEqual(self.history(target), self.history(self.owner))
+        self.assertEqual(set(Message.objects.filter(conversation__user=target).values_list('user_id', flat=True)),
+                         {target.pk})
+        imported = Conversation.objects.filter(user=target)
+        self.assertFalse(imported.filter(is_archived=True).exists())
+        self.assertEqual(set(imported.values_list('summary', 'summary_through_id')), {('', None)})
+    
+    def test_import_by_email(self):
+        lines = list(export_lines(user=self.owner))
+        Conversation.objects.filter(user=self.owner).delete()
+        self.assertEqual(import_lines(lines), (2, 7))
+        self.assertEqual(Conversation.objects.filter(user=self.owner).count(), 2)
+    
+    def test_export_everyone(self):
+        titles = [json.loads(line).get('title') for line in export_lines()]
+        self.assertIn('Not exported', titles)
+    
+    def test_bad_line_imports_nothing(self):
+        lines = list(export_lines(user=self.owner))
+        lines.insert(3, '{"type": "message", "conversation": 999999}\n')
+        with self.assertRaisesMessage(InvalidExportError, 'Line 4'):
+            import_lines(lines, user=self.other)
+        self.assertEqual(Conversation.objects.filter(user=self.other).count(), 1)
+    
+    async def test_asgi_download_is_streamed(self):
+        produced = []
+        
+        def export_lines(user):
+            for i in range(1000):
+                produced.append(i)
+                yield f'{{"line": {i}}}\n'
+        
+        await sync_to_async(self.async_client.force_login)(self.owner)
+        with mock.patch.object(views, 'export_lines', export_lines):
+            response = await self.async_client.get(reverse('chat:export_conversations'))
+            self.assertTrue(response.is_async)
+            chunks = aiter(response.streaming_content)
+            self.assertEqual(await anext(chunks), b'{"line": 0}\n')
+            # Only the first batch has been read from the database
+            self.assertEqual(len(produced), views.EXPORT_LINES_PER_FETCH)
+            self.assertEqual(len([chunk async for chunk in chunks]), 999)
+    
+    async def test_asgi_download(self):
+        await sync_to_async(self.async_client.force_login)(self.owner)
+        response = await self.async_client.get(reverse('chat:export_conversations'))
+        lines = [json.loads(chunk) async for chunk in response.streaming_content]
+        self.assertEqual([line['type'] for line in lines].count('message'), 7)
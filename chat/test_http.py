@@ -0,0 +1,109 @@
+"""
+Pooled upstream HTTP clients and the retry policy (chat.http).
+"""
+import asyncio
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from . import resilience, services
+from .http import get_async_http_client, get_retry_delay, httpx
+from .services import AsyncAIService
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+class AsyncHttpClientTests(SimpleTestCase):
+
+    @override_settings(EURON_HTTP_POOL_SIZE=7, EURON_HTTP_KEEPALIVE_EXPIRY=12, EURON_HTTP_MAX_RETRIES=3)
+    def test_pool_limits_reach_the_transport(self):
+        async def pool():
+            client = get_async_http_client()
+            try:
+                self.assertIs(get_async_http_client(), client)
+                return client._transport._pool
+            finally:
+                await client.aclose()
+        
+        pool = asyncio.run(pool())
+        self.assertEqual(pool._max_connections, 7)
+        self.assertEqual(pool._max_keepalive_connections, 7)
+        self.assertEqual(pool._keepalive_expiry, 12)
+        self.assertEqual(pool._retries, 3)
+
+
+@override_settings(EURON_HTTP_BACKOFF_FACTOR=0.5, EURON_HTTP_BACKOFF_JITTER=0, EURON_HTTP_BACKOFF_MAX=10)
+class RetryDelayTests(SimpleTestCase):
+
+    def test_exponential_backoff(self):
+        self.assertEqual([get_retry_delay(attempt) for attempt in (1, 2, 3)], [0.5, 1.0, 2.0])
+        self.assertEqual(get_retry_delay(10), 10)
+    
+    def test_retry_after_seconds(self):
+        self.assertEqual(get_retry_delay(1, '3'), 3)
+        self.assertEqual(get_retry_delay(1, ' 0 '), 0)
+        self.assertEqual(get_retry_delay(1, '3600'), 10)
+    
+    def test_retry_after_date(self):
+        retry_at = formatdate(time.time() + 5, usegmt=True)
+        self.assertAlmostEqual(get_retry_delay(1, retry_at), 5, delta=1.5)
+        self.assertEqual(get_retry_delay(1, formatdate(time.time() - 60, usegmt=True)), 0)
+        self.assertEqual(get_retry_delay(1, formatdate(time.time() + 3600, usegmt=True)), 10)
+    
+    def test_invalid_retry_after_falls_back_to_backoff(self):
+        for value in (None, '', 'soon', '-1', '1.5'):
+            self.assertEqual(get_retry_delay(2, value), 1.0)
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+@override_settings(
+    EURON_API_KEY='test-key',
+    EURON_HTTP_MAX_RETRIES=2,
+    EURON_HTTP_BACKOFF_JITTER=0,
+    EURON_HTTP_BACKOFF_MAX=10,
+    AI_RESPONSE_CACHE_ENABLED=False,
+    AI_SINGLEFLIGHT_ENABLED=False,
+)
+class AsyncRetryTests(SimpleTestCase):
+
+    def request(self, *responses):
+        """Send one completion through AsyncAIService against canned upstream responses; return the sleeps"""
+        responses = list(responses)
+        
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: responses.pop(0)))
+            try:
+                with mock.patch.object(services, 'get_async_http_client', return_value=client), \
+                        mock.patch.object(services.asyncio, 'sleep', new_callable=mock.AsyncMock) as sleep:
+                    reply = await AsyncAIService().generate_response('Hello', use_cache=False)
+            finally:
+                await client.aclose()
+            self.assertEqual(reply, 'Hi there')
+            return [call.args[0] for call in sleep.await_args_list]
+        
+        with mock.patch.object(resilience, 'logger'):
+            return asyncio.run(run())
+    
+    def ok(self):
+        return httpx.Response(200, json={'choices': [{'message': {'role': 'assistant', 'content': 'Hi there'}}]})
+    
+    def test_retry_after_is_honored(self):
+        sleeps = self.request(
+            httpx.Response(429, headers={'Retry-After': '3'}),
+            httpx.Response(503, headers={'Retry-After': '4'}),
+            self.ok(),
+        )
+        self.assertEqual(sleeps, [3, 4])
+    
+    def test_retry_after_is_capped(self):
+        self.assertEqual(self.request(httpx.Response(429, headers={'Retry-After': '120'}), self.ok()), [10])
+    
+    def test_backoff_without_retry_after(self):
+        sleeps = self.request(
+            httpx.Response(502, headers={'Retry-After': '7'}),
+            httpx.Response(429),
+            self.ok(),
+        )
+        self.assertEqual(sleeps, [0.5, 1.0])
@@ -0,0 +1,92 @@
+"""
+Denormalized conversation counters (message_count, last_message_*) kept by chat.models.
+"""
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from .models import Conversation, ConversationQuerySet, Message
+from .sidebar import get_sidebar, sidebar_version
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ConversationStatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='counter', email='counter@example.com', password='password')
+        cls.conversation = Conversation.objects.create(user=cls.user, title='Counted')
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_recompute_invalidates_sidebars(self):
+        Message.objects.create(conversation=self.conversation, content='Hello', is_from_user=True)
+        Conversation.objects.filter(pk=self.conversation.pk).update(message_count=0, last_message_preview='')
+        stale = get_sidebar(self.user, Conversation.objects.filter(user=self.user))
+        self.assertEqual(stale[0]['message_count'], 0)
+        version = sidebar_version(self.user.pk)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('recompute_conversation_stats', stdout=StringIO())
+        self.assertNotEqual(sidebar_version(self.user.pk), version)
+        sidebar = get_sidebar(self.user, Conversation.objects.filter(user=self.user))
+        self.assertEqual((sidebar[0]['message_count'], sidebar[0]['last_message_preview']), (1, 'Hello'))
+    
+    def add(self, content, is_from_user=True):
+        return Message.objects.create(conversation=self.conversation, content=content, is_from_user=is_from_user)
+    
+    def assertStats(self, message_count, latest):
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, message_count)
+        if latest is None:
+            self.assertIsNone(self.conversation.last_message_at)
+            self.assertEqual(self.conversation.last_message_preview, '')
+        else:
+            latest.refresh_from_db()
+            self.assertEqual(self.conversation.last_message_at, latest.created_at)
+            self.assertEqual(self.conversation.last_message_preview, latest.content)
+    
+    def test_create(self):
+        first = self.add('Hello')
+        self.assertStats(1, first)
+        second = self.add('Hi there', is_from_user=False)
+        self.assertStats(2, second)
+    
+    def test_edit_of_the_latest_message(self):
+        self.add('Hello')
+        reply = self.add('Hi there', is_from_user=False)
+        reply.content = 'Hi there, edited'
+        reply.save()
+        self.assertStats(2, reply)
+    
+    def test_edit_of_an_earlier_message(self):
+        first = self.add('Hello')
+        reply = self.add('Hi there', is_from_user=False)
+        first.content = 'Hello, edited'
+        with mock.patch.object(ConversationQuerySet, 'refresh_message_stats') as refresh:
+            first.save()
+        refresh.assert_not_called()
+        self.assertStats(2, reply)
+    
+    def test_delete(self):
+        first = self.add('Hello')
+        reply = self.add('Hi there', is_from_user=False)
+        reply.delete()
+        self.assertStats(1, first)
+        first.delete()
+        self.assertStats(0, None)
+    
+    def test_queryset_delete(self):
+        first = self.add('Hello')
+        self.add('Hi there', is_from_user=False)
+        self.add('Anything else?')
+        Message.objects.filter(conversation=self.conversation).exclude(pk=first.pk).delete()
+        self.assertStats(1, first)
+        Message.objects.filter(conversation=self.conversation).delete()
+        self.assertStats(0, None)
@@ -0,0 +1,148 @@
+"""
+Tests of the per-user rate limits and daily token quotas (chat.ratelimit).
+"""
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import ratelimit
+from .context import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+from .models import Conversation, Message
+from .ratelimit import RateLimitExceeded, check_rate_limit, get_user_tier, record_token_usage
+from .services import AIService
+
+TIERS = {
+    'default': {'requests_per_minute': 6, 'burst': 2, 'daily_tokens': 100},
+    'pro': {'requests_per_minute': 60, 'burst': 10, 'daily_tokens': 1000},
+}
+
+
+@override_settings(
+    CHAT_RATE_LIMIT_ENABLED=True,
+    CHAT_RATE_LIMIT_CACHE_ALIAS='default',
+    CHAT_RATE_LIMIT_TIERS=TIERS,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class RateLimitTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='limited', email='limited@example.com', password='password')
+        cls.conversation = Conversation.objects.create(user=cls.user, title='Limited')
+    
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000.0
+        patcher = mock.patch.object(ratelimit.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def exhaust_bucket(self):
+        for _ in range(TIERS['default']['burst']):
+            check_rate_limit(self.user)
+    
+    def test_burst_then_rejected_with_retry_after(self):
+        self.exhaust_bucket()
+        with self.assertRaises(RateLimitExceeded) as raised:
+            check_rate_limit(self.user)
+        self.assertEqual(raised.exception.reason, 'requests')
+        # 6 requests a minute: one every 10 seconds
+        self.assertEqual(raised.exception.retry_after, 10)
+    
+    def test_bucket_refills_at_the_tier_rate(self):
+        self.exhaust_bucket()
+        self.now += 9
+        with self.assertRaises(RateLimitExceeded) as raised:
+            check_rate_limit(self.user)
+        self.assertEqual(raised.exception.retry_after, 1)
+        self.now += 1
+        check_rate_limit(self.user)
+        with self.assertRaises(RateLimitExceeded):
+            check_rate_limit(self.user)
+    
+    def test_bucket_refills_up_to_burst_only(self):
+        self.exhaust_bucket()
+        self.now += 3600
+        self.exhaust_bucket()
+        with self.assertRaises(RateLimitExceeded):
+            check_rate_limit(self.user)
+    
+    def test_daily_token_quota(self):
+        record_token_usage(self.user, 60, Message(token_count=30))
+        check_rate_limit(self.user)
+        record_token_usage(self.user, 10)
+        with self.assertRaises(RateLimitExceeded) as raised:
+            check_rate_limit(self.user)
+        self.assertEqual(raised.exception.reason, 'daily_tokens')
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertLessEqual(raised.exception.retry_after, 24 * 3600)
+    
+    def test_group_tier(self):
+        self.user.groups.add(Group.objects.create(name='pro'))
+        self.assertEqual(get_user_tier(self.user), 'pro')
+        for _ in range(TIERS['pro']['burst']):
+            check_rate_limit(self.user)
+        with self.assertRaises(RateLimitExceeded):
+            check_rate_limit(self.user)
+    
+    @override_settings(CHAT_RATE_LIMIT_ENABLED=False)
+    def test_disabled(self):
+        record_token_usage(self.user, 1000)
+        for _ in range(10):
+            check_rate_limit(self.user)
+    
+    @override_settings(EURON_API_KEY='test-key', CHAT_RATE_LIMIT_TIERS={'default': {**TIERS['default'], 'burst': 10}})
+    def test_charges_the_prompt_and_the_reply(self):
+        self.client.force_login(self.user)
+        Message.objects.create(conversation=self.conversation, content='x' * 400, is_from_user=True)
+        reply = {'choices': [{'message': {'role': 'assistant', 'content': 'y' * 40}}]}
+        with mock.patch.object(AIService, '_make_api_request', return_value=reply) as upstream, \
+                mock.patch('chat.views.update_conversation_summary'):
+            response = self.client.post(
+                reverse('chat:send_message'),
+                json.dumps({'message': 'Hello', 'conversation_id': self.conversation.pk}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+        # The whole prompt, history and system prompt included, not just the two saved messages
+        prompt = upstream.call_args.args[0]
+        prompt_tokens = sum(estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in prompt)
+        self.assertGreater(prompt_tokens, 100)
+        self.assertEqual(cache.get(ratelimit._quota_key(self.user)), prompt_tokens + 10)
+    
+    def assertRateLimited(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+    
+    def test_json_view_answers_429(self):
+        self.client.force_login(self.user)
+        self.exhaust_bucket()
+        with mock.patch('chat.views.AIService') as service:
+            response = self.client.post(
+                reverse('chat:send_message'),
+                json.dumps({'message': 'Hello', 'conversation_id': self.conversation.pk}),
+                content_type='application/json',
+            )
+        self.assertRateLimited(response)
+        self.assertEqual(response.json()['retry_after'], 10)
+        service.assert_not_called()
+        self.assertEqual(self.conversation.messages.count(), 0)
+    
+    def test_api_answers_429(self):
+        self.client.force_login(self.user)
+        self.exhaust_bucket()
+        with mock.patch('chat.api_views.AIService') as service:
+            response = self.client.post(
+                f'/api/conversations/{self.conversation.pk}/send_message/',
+                {'message': 'Hello'},
+                content_type='application/json',
+            )
+        self.assertRateLimited(response)
+        service.assert_not_called()
+        self.assertEqual(self.conversation.messages.count(), 0)
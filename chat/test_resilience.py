@@ -0,0 +1,208 @@
+"""
+Unit tests for the upstream circuit breaker and bulkhead (chat.resilience).
+"""
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from . import resilience
+from .resilience import (
+    CLOSED, HALF_OPEN, OPEN, Bulkhead, BulkheadFullError, CircuitBreaker, CircuitOpenError, upstream_guard,
+)
+
+
+class UpstreamError(Exception):
+    """An upstream failure as raised by requests/httpx, with the response attached"""
+    
+    def __init__(self, status_code=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = mock.Mock(status_code=status_code) if status_code else None
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        for patcher in (
+            mock.patch.object(resilience.time, 'monotonic', self.clock),
+            mock.patch.object(resilience, 'logger'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=30, half_open_max_calls=1)
+    
+    def open_breaker(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+    
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.allow_request()
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.allow_request()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        resilience.logger.warning.assert_called_once_with("Circuit breaker 'test' closed -> open")
+    
+    def test_success_resets_failure_count(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.breaker.record_success()
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+    
+    def test_half_open_after_recovery_timeout_allows_one_probe(self):
+        self.open_breaker()
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow_request())
+        self.clock.now += 1
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+    
+    def test_successful_probe_closes(self):
+        self.open_breaker()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+    
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        # The recovery timeout starts over
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow_request())
+    
+    def test_release_frees_the_probe_slot(self):
+        self.open_breaker()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.release()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+
+
+class UpstreamGuardTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker('guarded', failure_threshold=2, recovery_timeout=30, half_open_max_calls=1)
+        self.bulkhead = Bulkhead('guarded', max_concurrent=1, max_wait=0)
+        for patcher in (
+            mock.patch.object(resilience.time, 'monotonic', self.clock),
+            mock.patch.dict(resilience._breakers, {'guarded': self.breaker}),
+            mock.patch.object(resilience, '_bulkhead', self.bulkhead),
+            mock.patch.object(resilience, 'logger'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def guard(self):
+        return upstream_guard(wait=0, name='guarded')
+    
+    def fail(self, exc):
+        with self.assertRaises(type(exc)):
+            with self.guard():
+                raise exc
+    
+    def half_open(self):
+        self.fail(UpstreamError(503))
+        self.fail(UpstreamError(503))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+    
+    def test_upstream_failures_open_the_circuit(self):
+        self.fail(UpstreamError(500))
+        self.fail(UpstreamError(429))
+        with self.assertRaises(CircuitOpenError):
+            with self.guard():
+                self.fail_if_reached()
+    
+    def fail_if_reached(self):
+        raise AssertionError("The guarded block ran while the circuit was open")
+    
+    def test_client_errors_do_not_count(self):
+        for _ in range(3):
+            self.fail(UpstreamError(400))
+        self.assertEqual(self.breaker.state, CLOSED)
+    
+    def test_success_closes_half_open_circuit(self):
+        self.half_open()
+        with self.guard():
+            pass
+        self.assertEqual(self.breaker.state, CLOSED)
+    
+    def test_abandoned_stream_releases_probe(self):
+        self.half_open()
+        
+        def stream():
+            with self.guard():
+                yield 'first'
+                yield 'second'
+        
+        chunks = stream()
+        self.assertEqual(next(chunks), 'first')
+        self.assertFalse(self.breaker.allow_request())
+        chunks.close()  # GeneratorExit inside the guard: no verdict
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+    
+    def test_cancelled_call_releases_probe(self):
+        self.half_open()
+        
+        async def call():
+            with self.guard():
+                await asyncio.sleep(10)
+        
+        async def run():
+            task = asyncio.ensure_future(call())
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        
+        asyncio.run(run())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+    
+    def test_full_bulkhead_rejects_and_releases_probe(self):
+        self.half_open()
+        self.assertTrue(self.bulkhead.acquire(0))
+        try:
+            with self.assertRaises(BulkheadFullError):
+                with self.guard():
+                    self.fail_if_reached()
+        finally:
+            self.bulkhead.release()
+        # The probe reserved before the bulkhead check was handed back
+        self.assertTrue(self.breaker.allow_request())
+    
+    def test_slot_released_after_each_call(self):
+        for _ in range(3):
+            with self.guard():
+                pass
+        self.fail(ValueError("not upstream"))
+        self.assertTrue(self.bulkhead.acquire(0))
+        self.bulkhead.release()
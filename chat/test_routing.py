@@ -0,0 +1,207 @@
+"""
+Failover and hedging of upstream calls across routes (chat.routing).
+"""
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from . import resilience, routing
+from .resilience import HALF_OPEN, OPEN, Bulkhead, CircuitBreaker, upstream_guard
+from .routing import CHAT, Router, hedged_requests
+from .test_resilience import UpstreamError
+
+P95 = 0.05
+
+
+def hedges(winner):
+    """Hedged calls won by winner so far"""
+    return sum(value for _, labels, value in hedged_requests.samples() if dict(labels)['winner'] == winner)
+
+
+@override_settings(
+    AI_ROUTES={'first': {'model': 'model-a'}, 'second': {'model': 'model-b'}},
+    AI_TASK_ROUTES={CHAT: ['first', 'second']},
+    AI_HEDGE_ENABLED=True,
+    AI_HEDGE_MIN_SAMPLES=20,
+    AI_HEDGE_MIN_DELAY=0.01,
+)
+class RouterTests(SimpleTestCase):
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.dict(resilience._breakers, clear=True),
+            mock.patch.object(resilience, '_bulkhead', Bulkhead('routes', max_concurrent=10, max_wait=0)),
+            mock.patch.object(resilience, 'logger'),
+            mock.patch.object(routing, 'logger'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.router = Router()
+        self.addCleanup(lambda: self.router._executor and self.router._executor.shutdown(wait=True))
+        self.calls = []
+        self.answers = {}
+    
+    def request(self, route):
+        """A blocking upstream call: answers[route.name] returns the reply or raises"""
+        self.calls.append(route.name)
+        with upstream_guard(wait=0, name=route.name):
+            return self.answers[route.name]()
+    
+    async def arequest(self, route):
+        self.calls.append(route.name)
+        with upstream_guard(wait=0, name=route.name):
+            return await self.answers[route.name]()
+    
+    def learn_latency(self, samples=20):
+        """Give the first route a p95 of P95, the second a slower one so the first stays ranked first"""
+        for _ in range(samples):
+            self.router.observe(routing.Route('first', 'model-a'), P95)
+            self.router.observe(routing.Route('second', 'model-b'), 2 * P95)
+    
+    def fail(self, status_code):
+        def answer():
+            raise UpstreamError(status_code)
+        return answer
+    
+    # Failover
+    
+    def test_upstream_error_fails_over(self):
+        self.answers = {'first': self.fail(503), 'second': lambda: 'from second'}
+        self.assertEqual(self.router.call(CHAT, self.request), 'from second')
+        self.assertEqual(self.calls, ['first', 'second'])
+        self.assertGreater(self.router.stats('first').error_rate, 0)
+    
+    def test_client_error_does_not_fail_over(self):
+        self.answers = {'first': self.fail(400), 'second': lambda: 'from second'}
+        with self.assertRaises(UpstreamError):
+            self.router.call(CHAT, self.request)
+        self.assertEqual(self.calls, ['first'])
+    
+    def test_open_breaker_ranks_the_route_last(self):
+        breaker = resilience.get_circuit_breaker('first')
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        self.answers = {'first': lambda: 'from first', 'second': lambda: 'from second'}
+        self.assertEqual([route.name for route in self.router.ranked(CHAT)], ['second', 'first'])
+        self.assertEqual(self.router.call(CHAT, self.request), 'from second')
+        self.assertEqual(self.calls, ['second'])
+    
+    def test_open_breaker_fails_over(self):
+        # The breaker opens between ranking and the call
+        self.answers = {'first': lambda: 'from first', 'second': lambda: 'from second'}
+        ranked = self.router.ranked(CHAT)
+        breaker = resilience.get_circuit_breaker('first')
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        with mock.patch.object(self.router, 'ranked', return_value=ranked):
+            self.assertEqual(self.router.call(CHAT, self.request), 'from second')
+        self.assertEqual(self.calls, ['first', 'second'])
+        # A local rejection is not an upstream error
+        self.assertEqual(self.router.stats('first').error_rate, 0)
+    
+    def test_last_error_raised_when_every_route_fails(self):
+        self.answers = {'first': self.fail(503), 'second': self.fail(502)}
+        with self.assertRaises(UpstreamError) as raised:
+            self.router.call(CHAT, self.request)
+        self.assertEqual(raised.exception.response.status_code, 502)
+    
+    def test_async_failover(self):
+        async def fail():
+            raise UpstreamError(503)
+        
+        async def answer():
+            return 'from second'
+        
+        self.answers = {'first': fail, 'second': answer}
+        self.assertEqual(asyncio.run(self.router.acall(CHAT, self.arequest)), 'from second')
+        self.assertEqual(self.calls, ['first', 'second'])
+    
+    # Hedging
+    
+    def test_no_hedge_when_the_route_answers_within_p95(self):
+        self.learn_latency()
+        self.answers = {'first': lambda: 'from first', 'second': lambda: 'from second'}
+        self.assertEqual(self.router.call(CHAT, self.request), 'from first')
+        self.assertEqual(self.calls, ['first'])
+    
+    def test_no_hedge_without_enough_samples(self):
+        self.learn_latency(samples=19)
+        self.answers = {'first': lambda: time.sleep(3 * P95) or 'from first', 'second': lambda: 'from second'}
+        self.assertEqual(self.router.call(CHAT, self.request), 'from first')
+        self.assertEqual(self.calls, ['first'])
+    
+    @override_settings(AI_HEDGE_ENABLED=False)
+    def test_no_hedge_when_disabled(self):
+        self.learn_latency()
+        self.answers = {'first': lambda: time.sleep(3 * P95) or 'from first', 'second': lambda: 'from second'}
+        self.assertEqual(self.router.call(CHAT, self.request), 'from first')
+        self.assertEqual(self.calls, ['first'])
+    
+    def test_hedge_after_p95_and_first_answer_wins(self):
+        self.learn_latency()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        hedged_at = []
+        
+        def hedge():
+            hedged_at.append(time.perf_counter())
+            return 'from second'
+        
+        self.answers = {'first': lambda: release.wait(10) and 'from first', 'second': hedge}
+        won = hedges('hedge')
+        start = time.perf_counter()
+        self.assertEqual(self.router.call(CHAT, self.request), 'from second')
+        self.assertEqual(self.calls, ['first', 'second'])
+        self.assertGreaterEqual(hedged_at[0] - start, P95)
+        self.assertEqual(hedges('hedge'), won + 1)
+    
+    def test_async_hedge_after_p95_and_first_answer_wins(self):
+        self.learn_latency()
+        
+        async def slow():
+            await asyncio.sleep(10)
+            return 'from first'
+        
+        async def fast():
+            return 'from second'
+        
+        self.answers = {'first': slow, 'second': fast}
+        won = hedges('hedge')
+        start = time.perf_counter()
+        self.assertEqual(asyncio.run(self.router.acall(CHAT, self.arequest)), 'from second')
+        self.assertGreaterEqual(time.perf_counter() - start, P95)
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(self.calls, ['first', 'second'])
+        self.assertEqual(hedges('hedge'), won + 1)
+    
+    def test_cancelled_loser_is_not_counted_against_its_breaker(self):
+        self.learn_latency()
+        # The hedge target is half-open with a single probe slot
+        breaker = resilience._breakers['second'] = CircuitBreaker(
+            'second', failure_threshold=1, recovery_timeout=0, half_open_max_calls=1,
+        )
+        breaker.record_failure()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        
+        async def primary():
+            await asyncio.sleep(3 * P95)
+            return 'from first'
+        
+        async def hedge():
+            await asyncio.sleep(10)
+            return 'from second'
+        
+        self.answers = {'first': primary, 'second': hedge}
+        won = hedges('primary')
+        self.assertEqual(asyncio.run(self.router.acall(CHAT, self.arequest)), 'from first')
+        self.assertEqual(self.calls, ['first', 'second'])
+        self.assertEqual(hedges('primary'), won + 1)
+        # The cancelled hedge handed its probe back and recorded nothing
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        stats = self.router.stats('second')
+        self.assertEqual((stats.error_rate, stats.latency), (0, None))
+        self.assertNotEqual(resilience.get_circuit_breaker('first').state, OPEN)
@@ -0,0 +1,99 @@
+"""
+Full-text search over messages and conversation titles (chat.search).
+"""
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from .models import Conversation, Message
+from .search import search_conversations, search_messages
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "No full-text index on this backend")
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='searcher', email='searcher@example.com', password='password')
+        cls.other = User.objects.create_user(username='other', email='other@example.com', password='password')
+        cls.conversation = Conversation.objects.create(user=cls.user, title='Gardening tips')
+    
+    def add(self, content, conversation=None):
+        return Message.objects.create(conversation=conversation or self.conversation, content=content)
+    
+    def found(self, query):
+        return [message.pk for message in search_messages(self.user, query)]
+    
+    def test_ranked_by_relevance(self):
+        passing = self.add(
+            "We talked about the weather, the news, a recipe for bread and, briefly, tomatoes in the garden."
+        )
+        focused = self.add("Tomatoes: water tomatoes daily, and stake tomatoes early.")
+        self.add("Nothing relevant here.")
+        results = search_messages(self.user, 'tomatoes')
+        self.assertEqual([message.pk for message in results], [focused.pk, passing.pk])
+        self.assertGreater(results[0].rank, results[1].rank)
+        self.assertEqual(results[0].conversation, self.conversation)
+    
+    def test_every_term_must_match_and_the_last_is_a_prefix(self):
+        both = self.add("Prune the roses in early spring.")
+        self.add("Prune the apple tree.")
+        self.assertEqual(self.found('prune ros'), [both.pk])
+        self.assertEqual(self.found('  ...  '), [])
+    
+    def test_snippets_highlight_the_matches(self):
+        self.add("Use <b>compost</b> & mulch around the roses.")
+        message, = search_messages(self.user, 'compost roses')
+        self.assertIn('&lt;b&gt;<mark>compost</mark>&lt;/b&gt;', message.snippet)
+        self.assertIn('<mark>roses</mark>', message.snippet)
+        self.assertNotIn('<b>', message.snippet)
+        
+        conversation, = search_conversations(self.user, 'garden')
+        self.assertEqual(conversation.snippet, '<mark>Gardening</mark> tips')
+    
+    def test_other_users_are_never_matched(self):
+        theirs = Conversation.objects.create(user=self.other, title='Gardening secrets')
+        self.add("Secret tomatoes recipe", conversation=theirs)
+        mine = self.add("My tomatoes recipe")
+        self.assertEqual(self.found('tomatoes recipe'), [mine.pk])
+        self.assertEqual(search_conversations(self.user, 'gardening'), [self.conversation])
+        self.assertEqual(search_messages(self.other, 'my'), [])
+    
+    def test_index_follows_message_writes(self):
+        message = self.add("How deep should I plant garlic?")
+        self.assertEqual(self.found('garlic'), [message.pk])
+        
+        message.content = "How deep should I plant onions?"
+        message.save()
+        self.assertEqual(self.found('garlic'), [])
+        self.assertEqual(self.found('onions'), [message.pk])
+        
+        message.delete()
+        self.assertEqual(self.found('onions'), [])
+    
+    def test_index_follows_bulk_writes(self):
+        Message.objects.bulk_create([Message(conversation=self.conversation, content="Basil likes sun")])
+        self.assertEqual(len(self.found('basil')), 1)
+        Message.objects.filter(conversation=self.conversation).update(content="Mint likes shade")
+        self.assertEqual(self.found('basil'), [])
+        self.assertEqual(len(self.found('mint')), 1)
+        Message.objects.filter(conversation=self.conversation).delete()
+        self.assertEqual(self.found('mint'), [])
+    
+    def test_index_follows_conversation_writes(self):
+        conversation = Conversation.objects.create(user=self.user, title='Beekeeping')
+        self.add("Hives need shade", conversation=conversation)
+        self.assertEqual(search_conversations(self.user, 'beekeeping'), [conversation])
+        
+        conversation.title = 'Honey harvest'
+        conversation.save()
+        self.assertEqual(search_conversations(self.user, 'beekeeping'), [])
+        self.assertEqual(search_conversations(self.user, 'honey'), [conversation])
+        
+        conversation.delete()
+        self.assertEqual(search_conversations(self.user, 'honey'), [])
+        self.assertEqual(self.found('hives'), [])
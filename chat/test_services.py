@@ -0,0 +1,89 @@
+"""
+Persisting a user message and its AI reply (chat.services.record_exchange).
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+
+from .models import PREVIEW_LENGTH, Conversation, Message
+from .services import record_exchange
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RecordExchangeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='exchange', email='exchange@example.com', password='password')
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(user=self.user)
+    
+    def test_writes_both_messages(self):
+        conversation, user_message, ai_message = record_exchange(self.user, self.conversation, 'Hello', 'Hi there')
+        self.assertEqual(
+            list(conversation.messages.order_by('created_at', 'id').values_list('content', 'is_from_user')),
+            [('Hello', True), ('Hi there', False)],
+        )
+        self.assertEqual({user_message.user, ai_message.user}, {self.user})
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertIsNotNone(self.conversation.last_message_at)
+        
+        record_exchange(self.user, self.conversation, 'Again', 'Sure')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 4)
+    
+    def test_in_memory_conversation_matches_the_row(self):
+        conversation, _, _ = record_exchange(self.user, self.conversation, 'Hello', 'Hi there', title='Greetings')
+        row = Conversation.objects.get(pk=self.conversation.pk)
+        for field in ('message_count', 'last_message_at', 'last_message_preview', 'title'):
+            self.assertEqual(getattr(conversation, field), getattr(row, field), field)
+    
+    def test_preview_is_the_ai_reply(self):
+        reply = 'A' * (PREVIEW_LENGTH + 10)
+        record_exchange(self.user, self.conversation, 'Hello', reply)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_preview, 'A' * PREVIEW_LENGTH + '...')
+    
+    def test_title_only_set_when_given(self):
+        record_exchange(self.user, self.conversation, 'Hello', 'Hi there')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, '')
+        
+        record_exchange(self.user, self.conversation, 'Hello', 'Hi there', title='Greetings')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'Greetings')
+        
+        # An existing title is never replaced
+        record_exchange(self.user, self.conversation, 'Hello', 'Hi there', title='Other')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'Greetings')
+    
+    def test_creates_the_conversation(self):
+        conversation, _, _ = record_exchange(self.user, None, 'Hello', 'Hi there', title='Greetings')
+        conversation.refresh_from_db()
+        self.assertEqual(
+            (conversation.user, conversation.title, conversation.message_count), (self.user, 'Greetings', 2)
+        )
+        self.assertEqual(conversation.last_message_preview, 'Hi there')
+        self.assertEqual(conversation.messages.count(), 2)
+    
+    def test_database_error_rolls_back_both_writes(self):
+        record_exchange(self.user, self.conversation, 'Hello', 'Hi there')
+        conversations = Conversation.objects.count()
+        
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=DatabaseError("disk full")):
+            with self.assertRaises(DatabaseError):
+                record_exchange(self.user, self.conversation, 'Again', 'Sure', title='Lost')
+            with self.assertRaises(DatabaseError):
+                record_exchange(self.user, None, 'Hello', 'Hi there')
+        
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.message_count, self.conversation.title), (2, ''))
+        self.assertEqual(self.conversation.last_message_preview, 'Hi there')
+        self.assertEqual(Message.objects.filter(conversation__user=self.user).count(), 2)
+        self.assertEqual(Conversation.objects.count(), conversations)
@@ -0,0 +1,186 @@
+"""
+Unit tests for single-flight request coalescing (chat.singleflight).
+"""
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from . import singleflight as singleflight_module
+from .singleflight import SingleFlight
+
+
+class RoleCounter:
+    """Replaces singleflight_requests.inc to let a test wait until followers have joined"""
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.roles = []
+    
+    def inc(self, amount=1, role=None):
+        with self.condition:
+            self.roles.append(role)
+            self.condition.notify_all()
+    
+    def wait_for(self, role, count, timeout=5):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.roles.count(role) >= count, timeout):
+                raise AssertionError(f"Expected {count} {role} calls, got {self.roles}")
+
+
+@override_settings(AI_SINGLEFLIGHT_SHARED=False, AI_SINGLEFLIGHT_WAIT_TIMEOUT=5)
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.group = SingleFlight()
+        self.counter = RoleCounter()
+        patcher = mock.patch.object(singleflight_module.singleflight_requests, 'inc', self.counter.inc)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+    
+    def run_leader(self, func, results):
+        def lead():
+            try:
+                results['leader'] = self.group.do('key', func)
+            except Exception as e:
+                results['leader'] = e
+        thread = threading.Thread(target=lead)
+        thread.start()
+        self.counter.wait_for('leader', 1)
+        return thread
+    
+    def run_followers(self, count, func, results):
+        def follow(index):
+            try:
+                results[index] = self.group.do('key', func)
+            except Exception as e:
+                results[index] = e
+        threads = [threading.Thread(target=follow, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        self.counter.wait_for('follower', count)
+        return threads
+    
+    def upstream(self):
+        self.release.wait(5)
+        return {'content': 'Hello', 'usage': {'total_tokens': 3}}
+    
+    def not_called(self):
+        raise AssertionError("A follower called upstream while its leader was in flight")
+    
+    def test_followers_get_a_copy_of_the_result(self):
+        results = {}
+        threads = [self.run_leader(self.upstream, results)]
+        threads += self.run_followers(3, self.not_called, results)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        
+        leader = results.pop('leader')
+        self.assertEqual(len(results), 3)
+        for result in results.values():
+            self.assertEqual(result, leader)
+            self.assertIsNot(result, leader)
+            self.assertIsNot(result['usage'], leader['usage'])
+    
+    def test_followers_get_the_leader_exception(self):
+        error = ValueError("upstream failed")
+        
+        def failing():
+            self.release.wait(5)
+            raise error
+        
+        results = {}
+        threads = [self.run_leader(failing, results)]
+        threads += self.run_followers(2, self.not_called, results)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        
+        self.assertEqual(list(results.values()), [error] * 3)
+    
+    def test_key_is_free_again_after_the_leader_returns(self):
+        self.release.set()
+        self.assertEqual(self.group.do('key', self.upstream)['content'], 'Hello')
+        self.assertEqual(self.group.do('key', lambda: 'second'), 'second')
+        self.assertEqual(self.counter.roles, ['leader', 'leader'])
+    
+    @override_settings(AI_SINGLEFLIGHT_WAIT_TIMEOUT=0.05)
+    def test_follower_calls_upstream_after_timeout(self):
+        results = {}
+        leader = self.run_leader(self.upstream, results)
+        try:
+            with self.assertLogs('chat.singleflight', 'WARNING'):
+                self.assertEqual(self.group.do('key', lambda: 'own call'), 'own call')
+        finally:
+            self.release.set()
+            leader.join(5)
+        self.assertEqual(results['leader']['content'], 'Hello')
+    
+    def test_async_followers_get_a_copy_of_the_result(self):
+        async def scenario():
+            release = asyncio.Event()
+            
+            async def upstream():
+                await release.wait()
+                return {'content': 'Hello'}
+            
+            async def not_called():
+                self.not_called()
+            
+            leader = asyncio.ensure_future(self.group.ado('key', upstream))
+            await asyncio.sleep(0)
+            followers = [asyncio.ensure_future(self.group.ado('key', not_called)) for _ in range(2)]
+            await asyncio.sleep(0)
+            release.set()
+            return await leader, await asyncio.gather(*followers)
+        
+        leader, followers = asyncio.run(scenario())
+        for result in followers:
+            self.assertEqual(result, leader)
+            self.assertIsNot(result, leader)
+    
+    def test_async_followers_fall_back_when_the_leader_is_cancelled(self):
+        async def scenario():
+            async def upstream():
+                await asyncio.sleep(10)
+            
+            async def own_call():
+                return 'own call'
+            
+            leader = asyncio.ensure_future(self.group.ado('key', upstream))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.group.ado('key', own_call))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+        
+        self.assertEqual(asyncio.run(scenario()), 'own call')
+
+
+@override_settings(AI_SINGLEFLIGHT_CACHE_ALIAS='default', AI_SINGLEFLIGHT_POLL_INTERVAL=0.01)
+class SharedLockTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.lock = SingleFlight().shared_lock
+    
+    def test_follower_reads_the_published_result(self):
+        cache.add(self.lock._lock_key('key'), 'token')
+        cache.set(self.lock._result_key('key', 'token'), '{"content": "Hello"}')
+        self.assertEqual(self.lock.call('key', lambda: 'own call'), {'content': 'Hello'})
+    
+    @override_settings(AI_SINGLEFLIGHT_WAIT_TIMEOUT=0.05)
+    def test_follower_calls_upstream_when_nothing_is_published(self):
+        cache.add(self.lock._lock_key('key'), 'token')
+        start = time.monotonic()
+        self.assertEqual(self.lock.call('key', lambda: 'own call'), 'own call')
+        self.assertLess(time.monotonic() - start, 1)
+    
+    def test_leader_publishes_and_releases(self):
+        self.assertEqual(self.lock.call('key', lambda: {'content': 'Hello'}), {'content': 'Hello'})
+        self.assertIsNone(cache.get(self.lock._lock_key('key')))
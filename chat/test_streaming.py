@@ -0,0 +1,130 @@
+"""
+Tests of the streamed upstream call (AIService._make_streaming_request) and
+of the server-sent events view built on it.
+"""
+import json
+import threading
+from unittest import mock
+
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from . import resilience
+from .models import Conversation
+from .services import AIService
+
+
+class StreamResponse:
+    """A requests.Response stand-in that streams server-sent events"""
+    
+    def __init__(self, deltas, status_code=200):
+        self.status_code = status_code
+        self.lines = [f'data: {json.dumps({"choices": [{"delta": {"content": delta}}]})}' for delta in deltas]
+        self.lines.append('data: [DONE]')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+    
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+    
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+
+@override_settings(EURON_API_KEY='test-key')
+class StreamingRequestTests(SimpleTestCase):
+
+    def setUp(self):
+        self.service = AIService()
+        self.observe = mock.Mock()
+        for patcher in (
+            mock.patch.object(self.service.router, 'observe', self.observe),
+            # Fresh circuit breakers, so failures here don't trip the shared ones
+            mock.patch.dict(resilience._breakers, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def stream(self, response):
+        session = mock.Mock()
+        session.post.return_value = response
+        with mock.patch('chat.services.get_http_session', return_value=session):
+            yield from self.service._make_streaming_request([{'role': 'user', 'content': 'Hi'}])
+    
+    def test_completed_stream_observes_latency(self):
+        self.assertEqual(list(self.stream(StreamResponse(['Hel', 'lo']))), ['Hel', 'lo'])
+        self.observe.assert_called_once()
+        route, latency = self.observe.call_args.args
+        self.assertGreaterEqual(latency, 0)
+        self.assertEqual(self.observe.call_args.kwargs, {})
+    
+    def test_abandoned_stream_observes_nothing(self):
+        chunks = self.stream(StreamResponse(['Hel', 'lo']))
+        self.assertEqual(next(chunks), 'Hel')
+        chunks.close()
+        self.observe.assert_not_called()
+    
+    def test_failed_stream_observes_an_error(self):
+        with self.assertRaises(requests.exceptions.HTTPError), self.assertLogs('chat.services', 'ERROR'):
+            list(self.stream(StreamResponse([], status_code=503)))
+        self.observe.assert_called_once()
+        self.assertEqual(self.observe.call_args.kwargs, {'error': True})
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+@mock.patch('chat.views.update_conversation_summary')
+@mock.patch('chat.views.generate_conversation_title')
+class StreamViewTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='streamer', email='streamer@example.com', password='password')
+    
+    async def test_asgi_flushes_each_delta(self, *tasks):
+        upstream_done = threading.Event()
+        resumed = []
+        
+        def stream_response(service, message, conversation_history=None, summary=''):
+            yield 'Hel'
+            # Upstream still generating: the client must already have the first delta
+            upstream_done.wait(5)
+            resumed.append(True)
+            yield 'lo'
+        
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with mock.patch.object(AIService, 'stream_response', stream_response):
+            response = await self.async_client.post(
+                reverse('chat:stream_message'), {'message': 'Hi'}, content_type='application/json',
+            )
+            self.assertTrue(response.is_async)
+            chunks = aiter(response.streaming_content)
+            self.assertIn(b'event: start', await anext(chunks))
+            self.assertIn(b'"content": "Hel"', await anext(chunks))
+            self.assertEqual(resumed, [])
+            upstream_done.set()
+            rest = b''.join([chunk async for chunk in chunks])
+        
+        self.assertIn(b'"content": "lo"', rest)
+        self.assertIn(b'event: done', rest)
+        conversation = await Conversation.objects.aget(user=self.user)
+        self.assertEqual(conversation.last_message_preview, 'Hello')
+    
+    def test_wsgi_streams_a_blocking_iterator(self, *tasks):
+        self.client.force_login(self.user)
+        with mock.patch.object(AIService, 'stream_response', lambda *args, **kwargs: iter(['Hello'])):
+            response = self.client.post(
+                reverse('chat:stream_message'), {'message': 'Hi'}, content_type='application/json',
+            )
+            self.assertFalse(response.is_async)
+            content = b''.join(response.streaming_content)
+        self.assertIn(b'"content": "Hello"', content)
+        self.assertIn(b'event: done', content)
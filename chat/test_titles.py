@@ -0,0 +1,92 @@
+"""
+Backfilling conversation titles (the backfill_conversation_titles command).
+"""
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .archive import archive_conversations
+from .models import Conversation, Message
+from .services import AIService
+
+
+def title_from(first_message, raise_errors=False):
+    return f"About {first_message}"
+
+
+class BackfillMixin:
+    """Fixtures and a runner shared by the test cases below"""
+    
+    def conversation(self, first_message, title='', archived=False):
+        conversation = Conversation.objects.create(user=self.user, title=title)
+        Message.objects.create(conversation=conversation, content=first_message, is_from_user=True)
+        Message.objects.create(conversation=conversation, content='A reply', is_from_user=False)
+        if archived:
+            archive_conversations([conversation.pk], timezone.now() + timedelta(seconds=1))
+        return conversation
+    
+    def backfill(self, *args, generate=title_from):
+        with mock.patch.object(AIService, 'generate_conversation_title', side_effect=generate) as upstream:
+            call_command('backfill_conversation_titles', '--workers', '1', '--rate', '0', *args, stdout=StringIO())
+        return upstream
+    
+    def titles(self):
+        return dict(Conversation.objects.values_list('pk', 'title'))
+
+
+@override_settings(EURON_API_KEY='test-key', PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BackfillTitlesTests(BackfillMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='titles', email='titles@example.com', password='password')
+    
+    def test_titles_live_and_archived_conversations(self):
+        live = self.conversation('gardening')
+        archived = self.conversation('beekeeping', archived=True)
+        titled = self.conversation('cooking', title='Recipes')
+        
+        self.backfill()
+        self.assertEqual(self.titles(), {
+            live.pk: 'About gardening', archived.pk: 'About beekeeping', titled.pk: 'Recipes',
+        })
+        # Titled from the archive, not restored
+        archived.refresh_from_db()
+        self.assertTrue(archived.is_archived)
+        self.assertFalse(Message.objects.filter(conversation=archived).exists())
+    
+    def test_include_truncated_covers_archived_conversations(self):
+        truncated = self.conversation('x' * 40, title='x' * 30 + '...', archived=True)
+        titled = self.conversation('y' * 40, title='Chosen by the user', archived=True)
+        
+        upstream = self.backfill('--include-truncated')
+        self.assertEqual(self.titles(), {truncated.pk: 'About ' + 'x' * 40, titled.pk: 'Chosen by the user'})
+        self.assertEqual(upstream.call_count, 1)
+
+
+@override_settings(EURON_API_KEY='test-key', PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BackfillTitlesRaceTests(BackfillMixin, TransactionTestCase):
+    """The racing write comes from the worker thread's own connection, so it has to be committed"""
+    
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='titles', email='titles@example.com', password='password')
+    
+    def test_concurrent_title_is_kept(self):
+        raced = self.conversation('gardening')
+        other = self.conversation('cooking')
+        
+        def generate(first_message, raise_errors=False):
+            if first_message == 'gardening':
+                # The title task gets there while the backfill is waiting on the upstream
+                Conversation.objects.filter(pk=raced.pk).update(title='Set meanwhile')
+            return title_from(first_message)
+        
+        self.backfill(generate=generate)
+        self.assertEqual(self.titles(), {raced.pk: 'Set meanwhile', other.pk: 'About cooking'})
@@ -0,0 +1,354 @@
+"""
+Query-count budget tests for the chat and API endpoints.
+
+Each endpoint is requested for a light user (a couple of short conversations)
+and a heavy user (many conversations with long histories). Both must stay
+within the endpoint's query budget and issue the same number of queries, so
+a view that starts scaling with the user's data (N+1) fails here with a
+report of every query it ran.
+"""
+import json
+import re
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .archive import archive_conversations
+from .models import Conversation, Message
+from .pagination import encode_cursor
+from .routing import CHAT
+from .services import AIService
+
+# Total SQL time allowed per request; generous so only pathological plans trip it
+SQL_TIME_BUDGET_MS = 250
+
+LIGHT_CONVERSATIONS, LIGHT_MESSAGES = 2, 4
+HEAVY_CONVERSATIONS, HEAVY_MESSAGES = 40, 120
+
+# The page templates live outside the app; these touch the same attributes
+# as templates/chat/*.html so lazy loads in templates still show up as queries
+TEST_TEMPLATES = {
+    'base.html': (
+        '{% if user.is_authenticated %}{{ user.get_full_name|default:user.username }}{% endif %}'
+        '{% block content %}{% endblock %}'
+    ),
+    'chat/home.html': (
+        '{% extends "base.html" %}{% block content %}'
+        '{% for conversation in conversations %}'
+        '{{ conversation.id }}{{ conversation.title|default:"New Conversation" }}'
+        '{{ conversation.updated_at|date:"M d, Y" }}{{ conversation.last_message_preview }}'
+        '{% endfor %}'
+        '{{ active_conversation.id|default:"" }}{{ active_conversation.title }}'
+        '{% for message in messages %}'
+        '{{ message.is_from_user|yesno:"user,ai" }}{{ message.content|linebreaks }}{{ message.created_at|date:"H:i" }}'
+        '{% endfor %}'
+        '{{ older_messages_cursor|default:"" }}{% csrf_token %}'
+        '{% endblock %}'
+    ),
+    'chat/conversation_list.html': (
+        '{% extends "base.html" %}{% block content %}'
+        '{% for conversation in conversations %}'
+        '{{ conversation.title }}{{ conversation.message_count }}{{ conversation.last_message_preview }}'
+        '{% endfor %}'
+        '{% if is_paginated %}{{ page_obj.number }}/{{ paginator.num_pages }}{% endif %}'
+        '{% endblock %}'
+    ),
+}
+
+
+def stub_completion(self, messages, use_cache=True, task=CHAT):
+    return {'choices': [{'message': {'content': f"Reply to {messages[-1]['content'][:20]}"}}]}
+
+
+@contextmanager
+def query_budget(testcase, label, max_queries, max_ms=SQL_TIME_BUDGET_MS):
+    """Fail testcase if the block runs more than max_queries queries or max_ms of SQL"""
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    total_ms = sum(float(query['time']) for query in context.captured_queries) * 1000
+    if len(context) > max_queries or total_ms > max_ms:
+        testcase.fail(
+            f"{label}: {len(context)} queries / {total_ms:.1f} ms "
+            f"(budget {max_queries} queries / {max_ms} ms)\n{format_queries(context.captured_queries)}"
+        )
+
+
+def format_queries(captured_queries):
+    """Numbered query list; statements repeated with different literals are flagged as N+1 suspects"""
+    shapes = Counter(re.sub(r"\b\d+\b|'[^']*'", '?', query['sql']) for query in captured_queries)
+    lines = []
+    for number, query in enumerate(captured_queries, 1):
+        shape = re.sub(r"\b\d+\b|'[^']*'", '?', query['sql'])
+        repeated = f"  [repeated x{shapes[shape]}]" if shapes[shape] > 1 else ''
+        lines.append(f"  {number:3}. {float(query['time']) * 1000:7.2f} ms  {query['sql'][:300]}{repeated}")
+    return '\n'.join(lines)
+
+
+@override_settings(
+    TEMPLATES=[{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.locmem.Loader', TEST_TEMPLATES),
+                'django.template.loaders.app_directories.Loader',
+            ],
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    }],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    CHAT_TASK_BACKEND='eager',
+    AI_RESPONSE_CACHE_ENABLED=False,
+)
+class QueryBudgetTestCase(TestCase):
+    """Seeds a light and a heavy user and compares query counts between them"""
+    
+    @classmethod
+    def _seed_user(cls, username, conversations, messages):
+        User = get_user_model()
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='password')
+        Conversation.objects.bulk_create([
+            Conversation(user=user, title=f'{username} python conversation {i}') for i in range(conversations)
+        ])
+        Message.objects.bulk_create(
+            [
+                Message(
+                    conversation=conversation,
+                    content=f'python question {i} ' + 'lorem ipsum ' * (i % 15),
+                    is_from_user=i % 2 == 0,
+                )
+                for conversation in Conversation.objects.filter(user=user)
+                for i in range(messages)
+            ],
+            batch_size=2000,
+        )
+        Conversation.objects.filter(user=user).refresh_message_stats()
+        return user
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.light = cls._seed_user('light', LIGHT_CONVERSATIONS, LIGHT_MESSAGES)
+        cls.heavy = cls._seed_user('heavy', HEAVY_CONVERSATIONS, HEAVY_MESSAGES)
+    
+    def setUp(self):
+        # Rate limit buckets and cached tiers would otherwise carry over between tests
+        cache.clear()
+    
+    def latest_conversation(self, user):
+        return Conversation.objects.filter(user=user).order_by('-updated_at', '-id').first()
+    
+    def assertConstantQueries(self, label, max_queries, request, method='get', warm=False, **kwargs):
+        """
+        Issue request(user) for the light and the heavy user: each must stay
+        within budget, and the heavy user may not need more queries. With
+        warm=True the request is issued once beforehand to fill the caches.
+        """
+        counts = {}
+        for user in (self.light, self.heavy):
+            self.client.force_login(user)
+            path = request(user)
+            if warm:
+                getattr(self.client, method)(path, **kwargs)
+            with query_budget(self, f"{label} [{user.username}]", max_queries) as context:
+                response = getattr(self.client, method)(path, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400, f"{label} [{user.username}]: HTTP {response.status_code}")
+            counts[user.username] = context
+        
+        light, heavy = counts['light'], counts['heavy']
+        if len(heavy) > len(light):
+            self.fail(
+                f"{label}: {len(heavy)} queries for the heavy user vs {len(light)} for the light user\n"
+                f"light:\n{format_queries(light.captured_queries)}\nheavy:\n{format_queries(heavy.captured_queries)}"
+            )
+
+
+class ChatViewQueryBudgetTests(QueryBudgetTestCase):
+    """Template and JSON views in chat.views"""
+    
+    # Navigation reads the sidebar from the per-user cache once it is warm: no sidebar query
+    
+    def test_home(self):
+        self.assertConstantQueries('home', 2, lambda user: reverse('chat:home'), warm=True)
+    
+    def test_home_cold_sidebar(self):
+        self.assertConstantQueries('home [cold]', 3, lambda user: reverse('chat:home'))
+    
+    def test_home_with_conversation(self):
+        self.assertConstantQueries(
+            'home ?conversation', 4,
+            lambda user: f"{reverse('chat:home')}?conversation={self.latest_conversation(user).id}",
+            warm=True,
+        )
+    
+    def test_home_force_chat(self):
+        # The most recent conversation's id comes from the cached sidebar, the conversation from the database
+        self.assertConstantQueries(
+            'home ?force_chat', 4, lambda user: f"{reverse('chat:home')}?force_chat=1", warm=True,
+        )
+    
+    def test_conversation_detail(self):
+        self.assertConstantQueries(
+            'conversation_detail', 4,
+            lambda user: reverse('chat:conversation_detail', args=[self.latest_conversation(user).id]),
+            warm=True,
+        )
+    
+    @mock.patch.object(AIService, '_make_api_request', stub_completion)
+    def test_sidebar_invalidated_by_send(self):
+        self.client.force_login(self.light)
+        self.client.get(reverse('chat:home'))
+        payload = json.dumps({'conversation_id': self.latest_conversation(self.light).id, 'message': 'zanzibar'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('chat:send_message'), payload, content_type='application/json')
+        
+        with query_budget(self, 'home after send', 3):
+            response = self.client.get(reverse('chat:home'))
+        self.assertContains(response, 'Reply to zanzibar')
+    
+    def test_force_chat_restores_archived_conversation(self):
+        # Archiving leaves the cached sidebar valid, so is_archived must not come from it
+        conversation = self.latest_conversation(self.light)
+        self.client.force_login(self.light)
+        self.client.get(f"{reverse('chat:home')}?force_chat=1")
+        archive_conversations([conversation.id], timezone.now() + timedelta(seconds=1))
+        self.assertFalse(conversation.messages.exists())
+        
+        response = self.client.get(f"{reverse('chat:home')}?force_chat=1")
+        self.assertEqual(response.context['active_conversation'].id, conversation.id)
+        self.assertEqual(len(response.context['messages']), LIGHT_MESSAGES)
+        self.assertFalse(Conversation.objects.get(pk=conversation.id).is_archived)
+    
+    def test_older_messages(self):
+        def path(user):
+            conversation = self.latest_conversation(user)
+            newest = conversation.messages.order_by('-created_at', '-id').first()
+            return f"{reverse('chat:api_older_messages', args=[conversation.id])}?cursor={encode_cursor(newest)}"
+        
+        self.assertConstantQueries('older_messages', 4, path)
+    
+    def test_conversation_title(self):
+        self.assertConstantQueries(
+            'conversation_title', 3,
+            lambda user: reverse('chat:api_conversation_title', args=[self.latest_conversation(user).id]),
+        )
+    
+    def test_conversation_list(self):
+        self.assertConstantQueries('conversation_list', 4, lambda user: reverse('chat:conversation_list'))
+    
+    @mock.patch.object(AIService, '_make_api_request', stub_completion)
+    def test_send_message(self):
+        # Not compared between users: the eager summary task only folds history once there is enough of it.
+        # Sends include the rate limit tier lookup, cached per user after the first one.
+        for user in (self.light, self.heavy):
+            self.client.force_login(user)
+            payload = json.dumps({'conversation_id': self.latest_conversation(user).id, 'message': 'hi'})
+            with query_budget(self, f"send_message [{user.username}]", 14):
+                response = self.client.post(reverse('chat:send_message'), payload, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+    
+    @mock.patch.object(AIService, '_make_api_request', stub_completion)
+    def test_new_conversation_with_message(self):
+        payload = json.dumps({'initial_message': 'hello there'})
+        self.assertConstantQueries(
+            'new_conversation', 7, lambda user: reverse('chat:new_conversation'),
+            method='post', data=payload, content_type='application/json',
+        )
+    
+    def test_export(self):
+        # Streamed: one query for the conversations and one for all of their messages
+        self.assertConstantQueries('export_conversations', 4, lambda user: reverse('chat:export_conversations'))
+    
+    def test_delete_conversation(self):
+        self.assertConstantQueries(
+            'api_delete_conversation', 6,
+            lambda user: reverse('chat:api_delete_conversation', args=[self.latest_conversation(user).id]),
+            method='delete',
+        )
+
+
+class ApiQueryBudgetTests(QueryBudgetTestCase):
+    """REST API viewsets"""
+    
+    def test_conversation_list(self):
+        self.assertConstantQueries('api conversations list', 3, lambda user: '/api/conversations/')
+    
+    def test_conversation_retrieve(self):
+        # Nested messages are prefetched: one query for the conversation, one for all its messages
+        self.assertConstantQueries(
+            'api conversation retrieve', 4,
+            lambda user: f'/api/conversations/{self.latest_conversation(user).id}/',
+        )
+    
+    def test_conversation_messages(self):
+        self.assertConstantQueries(
+            'api conversation messages', 4,
+            lambda user: f'/api/conversations/{self.latest_conversation(user).id}/messages/',
+        )
+    
+    def test_message_list(self):
+        self.assertConstantQueries('api messages list', 3, lambda user: '/api/messages/')
+    
+    def test_search(self):
+        self.assertConstantQueries('api search', 5, lambda user: '/api/search/?q=python+question')
+    
+    @mock.patch.object(AIService, '_make_api_request', stub_completion)
+    def test_send_message(self):
+        for user in (self.light, self.heavy):
+            self.client.force_login(user)
+            conversation = self.latest_conversation(user)
+            with query_budget(self, f"api send_message [{user.username}]", 14):
+                response = self.client.post(
+                    f'/api/conversations/{conversation.id}/send_message/', {'message': 'hi'}, format='json'
+                )
+            self.assertEqual(response.status_code, 200)
+
+
+class AdminQueryBudgetTests(QueryBudgetTestCase):
+    """Admin changelists and change form"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+    
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+    
+    def assertAdminBudget(self, label, path, max_queries):
+        with query_budget(self, label, max_queries):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+    
+    def test_conversation_changelist(self):
+        self.assertAdminBudget('admin conversation changelist', reverse('admin:chat_conversation_changelist'), 5)
+    
+    def test_message_changelist(self):
+        self.assertAdminBudget('admin message changelist', reverse('admin:chat_message_changelist'), 5)
+    
+    def test_message_changelist_search(self):
+        self.assertAdminBudget(
+            'admin message search', f"{reverse('admin:chat_message_changelist')}?q=python", 5,
+        )
+    
+    def test_conversation_change(self):
+        # Message inlines for a long conversation
+        conversation = self.latest_conversation(self.heavy)
+        self.assertAdminBudget(
+            'admin conversation change', reverse('admin:chat_conversation_change', args=[conversation.id]), 9,
+        )
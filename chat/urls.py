@@ -8,10 +8,17 @@ urlpatterns = [
     path('conversation/<int:conversation_id>/', views.conversation_detail, name='conversation_detail'),
     path('new/', views.new_conversation, name='new_conversation'),
     path('send/', views.send_message, name='send_message'),
+    path('send/stream/', views.stream_message, name='stream_message'),
+    # Async variants for deployments served through genai_project.asgi
+    path('async/new/', views.async_new_conversation, name='async_new_conversation'),
+    path('async/send/', views.async_send_message, name='async_send_message'),
     path('delete/<int:conversation_id>/', views.delete_conversation, name='delete_conversation'),
     path('conversations/', views.ConversationListView.as_view(), name='conversation_list'),
+    path('export/', views.export_conversations, name='export_conversations'),
     # API endpoints for AJAX calls
     path('api/conversations/', views.new_conversation, name='api_new_conversation'),
     path('api/conversations/<int:conversation_id>/messages/', views.send_message, name='api_send_message'),
     path('api/conversations/<int:conversation_id>/', views.api_delete_conversation, name='api_delete_conversation'),
+    path('api/conversations/<int:conversation_id>/title/', views.conversation_title, name='api_conversation_title'),
+    path('api/conversations/<int:conversation_id>/messages/older/', views.older_messages, name='api_older_messages'),
 ]
\ No newline at end of file
@@ -1,19 +1,56 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views.generic import ListView
+from asgiref.sync import sync_to_async
 from django.contrib import messages
-from .models import Conversation, Message
-from .services import AIService
+from .archive import restore_conversation
+from .decorators import async_csrf_exempt, async_login_required
+from .exports import export_lines
+from .metrics import REGISTRY
+from .models import Conversation
+from .pagination import keyset_page
+from .ratelimit import RateLimitExceeded, check_rate_limit, record_token_usage
+from .services import AIService, AsyncAIService, record_exchange
+from .sidebar import SIDEBAR_SIZE, get_sidebar, sidebar_version
+from .tasks import generate_conversation_title, update_conversation_summary
+from itertools import islice
 import json
 
 
+def _message_page(conversation, cursor=None):
+    """Latest page of a conversation's messages in chronological order, plus the cursor for older ones"""
+    page_size = getattr(settings, 'CHAT_MESSAGES_PAGE_SIZE', 50)
+    # Opening an archived conversation brings its messages back (chat/archive.py)
+    restore_conversation(conversation)
+    page, older_cursor = keyset_page(conversation.messages.all(), cursor, page_size)
+    page.reverse()
+    return page, older_cursor
+
+
+def _sidebar(user):
+    """The user's recent conversations, from the per-user sidebar cache (chat/sidebar.py)"""
+    return get_sidebar(user, Conversation.objects.filter(user=user).order_by('-updated_at')[:SIDEBAR_SIZE])
+
+
+def _rate_limited(exc):
+    """429 response telling the client when it may send again"""
+    response = JsonResponse({'success': False, 'error': str(exc), 'retry_after': exc.retry_after}, status=429)
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
 @login_required
 def home(request):
     """Main chat interface"""
-    conversations = Conversation.objects.filter(user=request.user).order_by('-updated_at')[:10]
+    conversations = _sidebar(request.user)
     
     # Check if a specific conversation is requested
     conversation_id = request.GET.get('conversation')
@@ -30,32 +67,67 @@ def home(request):
     
     # If forcing chat interface but no specific conversation, use the most recent one or create new one
     if force_chat and not active_conversation:
-        if conversations.exists():
-            active_conversation = conversations.first()
+        if conversations:
+            # The cached sidebar only holds display fields; is_archived etc. come from the database
+            active_conversation = Conversation.objects.filter(id=conversations[0]['id'], user=request.user).first()
         # For new users with no conversations, force_chat=1 will still show chat interface
         # but with no active_conversation, which will show the welcome message in chat layout
     
+    chat_messages, older_cursor = _message_page(active_conversation) if active_conversation else ([], None)
+    
     context = {
         'conversations': conversations,
+        # Key for caching the rendered sidebar: {% cache 300 sidebar user.pk sidebar_version %}
+        'sidebar_version': sidebar_version(request.user.pk),
         'active_conversation': active_conversation,
-        'messages': active_conversation.messages.all() if active_conversation else [],
+        'messages': chat_messages,
+        'older_messages_cursor': older_cursor,  # Set when older messages can be loaded
         'force_chat': force_chat,  # Pass this to template for logic
     }
-    return render(request, 'chat/home.html', context)
+    # Rendered by the middleware so template time shows up in Server-Timing
+    return TemplateResponse(request, 'chat/home.html', context)
 
 
 @login_required
 def conversation_detail(request, conversation_id):
     """View specific conversation"""
     conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
-    conversations = Conversation.objects.filter(user=request.user)[:10]
+    conversations = _sidebar(request.user)
+    
+    chat_messages, older_cursor = _message_page(conversation)
     
     context = {
         'conversations': conversations,
+        'sidebar_version': sidebar_version(request.user.pk),
         'active_conversation': conversation,
-        'messages': conversation.messages.all(),
+        'messages': chat_messages,
+        'older_messages_cursor': older_cursor,  # Set when older messages can be loaded
     }
-    return render(request, 'chat/home.html', context)
+    return TemplateResponse(request, 'chat/home.html', context)
+
+
+@login_required
+def older_messages(request, conversation_id):
+    """API endpoint for the "load older" mode of the chat view"""
+    conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+    
+    try:
+        chat_messages, older_cursor = _message_page(conversation, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    return JsonResponse({
+        'messages': [
+            {
+                'id': message.id,
+                'content': message.content,
+                'is_from_user': message.is_from_user,
+                'created_at': message.created_at.isoformat(),
+            }
+            for message in chat_messages
+        ],
+        'older_messages_cursor': older_cursor,
+    })
 
 
 @login_required
@@ -65,40 +137,33 @@ def new_conversation(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            conversation = Conversation.objects.create(user=request.user)
             
             # If initial message is provided, process it
             initial_message = data.get('initial_message')
             if initial_message:
-                # Create user message
-                user_message = Message.objects.create(
-                    conversation=conversation,
-                    content=initial_message,
-                    is_from_user=True
-                )
+                check_rate_limit(request.user)
                 
-                # Generate AI response
+                # Generate AI response before opening the write transaction
                 ai_service = AIService()
                 try:
                     ai_response = ai_service.generate_response(initial_message)
-                    Message.objects.create(
-                        conversation=conversation,
-                        content=ai_response,
-                        is_from_user=False
-                    )
                 except Exception as e:
                     print(f"AI service error: {e}")
                     ai_response = "I'm sorry, I'm having trouble responding right now. Please try again later."
-                    Message.objects.create(
-                        conversation=conversation,
-                        content=ai_response,
-                        is_from_user=False
-                    )
+                
+                conversation, _, ai_message = record_exchange(
+                    request.user, None, initial_message, ai_response
+                )
+                record_token_usage(request.user, ai_service.prompt_tokens, ai_message)
+            else:
+                conversation = Conversation.objects.create(user=request.user)
             
             return JsonResponse({
                 'success': True,
                 'conversation_id': conversation.id
             })
+        except RateLimitExceeded as e:
+            return _rate_limited(e)
         except Exception as e:
             return JsonResponse({
                 'success': False,
@@ -125,35 +190,146 @@ def send_message(request):
         if not message_content:
             return JsonResponse({'error': 'Message cannot be empty'}, status=400)
         
-        # Get or create conversation
+        # Reject before any upstream work when the user is over their limits
+        check_rate_limit(request.user)
+        
+        # Existing conversation, or a new one created together with the messages
+        conversation = None
         if conversation_id:
             conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+            restore_conversation(conversation)
+        
+        # Generate AI response
+        ai_service = AIService()
+        conversation_history = conversation.recent_history() if conversation else None
+        ai_response = ai_service.generate_response(
+            message_content, conversation_history, summary=conversation.summary if conversation else ''
+        )
+        
+        # Save both messages in one short transaction, after the upstream call
+        conversation, user_message, ai_message = record_exchange(
+            request.user, conversation, message_content, ai_response
+        )
+        record_token_usage(request.user, ai_service.prompt_tokens, ai_message)
+        
+        # Title the conversation off the request path; clients poll conversation_title
+        title_pending = not conversation.title
+        # Only the exchange that starts the conversation queues one; sends made while it is
+        # being generated would queue more upstream calls titled from later messages
+        if title_pending and conversation.message_count == 2:
+            generate_conversation_title.enqueue(conversation.id, message_content)
+        update_conversation_summary.enqueue(conversation.id)
+        
+        return JsonResponse({
+            'success': True,
+            'conversation_id': conversation.id,
+            'user_message': {
+                'id': user_message.id,
+                'content': user_message.content,
+                'created_at': user_message.created_at.isoformat(),
+            },
+            'ai_message': {
+                'id': ai_message.id,
+                'content': ai_message.content,
+                'created_at': ai_message.created_at.isoformat(),
+            },
+            'conversation_title': conversation.title,
+            'title_pending': title_pending,
+        })
+        
+    except RateLimitExceeded as e:
+        return _rate_limited(e)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+async def _aget_user_conversation(conversation_id, user):
+    """Async get_object_or_404 for a conversation owned by user"""
+    try:
+        return await Conversation.objects.aget(id=conversation_id, user=user)
+    except (Conversation.DoesNotExist, ValueError):
+        raise Http404("No Conversation matches the given query.")
+
+
+@async_login_required
+@async_csrf_exempt
+async def async_new_conversation(request):
+    """Create a new conversation (async variant of new_conversation)"""
+    if request.method != 'POST':
+        return redirect('chat:home')
+    
+    try:
+        data = json.loads(request.body)
+        
+        # If initial message is provided, process it
+        initial_message = data.get('initial_message')
+        if initial_message:
+            await sync_to_async(check_rate_limit)(request.user)
+            ai_service = AsyncAIService()
+            ai_response = await ai_service.generate_response(initial_message)
+            conversation, _, ai_message = await sync_to_async(record_exchange)(
+                request.user, None, initial_message, ai_response
+            )
+            await sync_to_async(record_token_usage)(request.user, ai_service.prompt_tokens, ai_message)
         else:
-            conversation = Conversation.objects.create(user=request.user)
+            conversation = await Conversation.objects.acreate(user=request.user)
         
-        # Save user message
-        user_message = Message.objects.create(
-            conversation=conversation,
-            content=message_content,
-            is_from_user=True
+        return JsonResponse({
+            'success': True,
+            'conversation_id': conversation.id
+        })
+    except RateLimitExceeded as e:
+        return _rate_limited(e)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+
+@async_login_required
+@async_csrf_exempt
+async def async_send_message(request):
+    """Send a message and get AI response (async variant of send_message)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        message_content = data.get('message', '').strip()
+        conversation_id = data.get('conversation_id')
+        
+        if not message_content:
+            return JsonResponse({'error': 'Message cannot be empty'}, status=400)
+        
+        await sync_to_async(check_rate_limit)(request.user)
+        
+        # Existing conversation, or a new one created together with the messages
+        conversation = None
+        if conversation_id:
+            conversation = await _aget_user_conversation(conversation_id, request.user)
+            await sync_to_async(restore_conversation)(conversation)
+        
+        # Generate AI response without holding a thread during the upstream call
+        ai_service = AsyncAIService()
+        conversation_history = conversation.recent_history() if conversation else None
+        ai_response = await ai_service.generate_response(
+            message_content, conversation_history, summary=conversation.summary if conversation else ''
         )
         
-        # Generate AI response
-        ai_service = AIService()
-        conversation_history = conversation.messages.order_by('created_at')
-        ai_response = ai_service.generate_response(message_content, conversation_history)
-        
-        # Save AI response
-        ai_message = Message.objects.create(
-            conversation=conversation,
-            content=ai_response,
-            is_from_user=False
+        # Save both messages in one short transaction, after the upstream call
+        conversation, user_message, ai_message = await sync_to_async(record_exchange)(
+            request.user, conversation, message_content, ai_response
         )
+        await sync_to_async(record_token_usage)(request.user, ai_service.prompt_tokens, ai_message)
         
-        # Update conversation title if it's the first message
-        if not conversation.title:
-            conversation.title = ai_service.generate_conversation_title(message_content)
-            conversation.save()
+        # Title the conversation off the request path; clients poll conversation_title
+        title_pending = not conversation.title
+        # Only the exchange that starts the conversation queues one; sends made while it is
+        # being generated would queue more upstream calls titled from later messages
+        if title_pending and conversation.message_count == 2:
+            await sync_to_async(generate_conversation_title.enqueue)(conversation.id, message_content)
+        await sync_to_async(update_conversation_summary.enqueue)(conversation.id)
         
         return JsonResponse({
             'success': True,
@@ -169,10 +345,151 @@ def send_message(request):
                 'created_at': ai_message.created_at.isoformat(),
             },
             'conversation_title': conversation.title,
+            'title_pending': title_pending,
         })
+    
+    except RateLimitExceeded as e:
+        return _rate_limited(e)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+async def _iterate_in_thread(iterator, batch_size):
+    """Async generator over a blocking iterator, fetching batch_size items per trip to the sync thread"""
+    fetch = sync_to_async(lambda: list(islice(iterator, batch_size)))
+    try:
+        while True:
+            items = await fetch()
+            if not items:
+                return
+            for item in items:
+                yield item
+    finally:
+        # Runs the iterator's own cleanup (e.g. saving a stream the client abandoned)
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def _streaming_content(request, iterator, batch_size=1):
+    """
+    Content for a StreamingHttpResponse that is sent as it is produced.
+    
+    Under ASGI, Django reads a blocking iterator to the end before sending a
+    byte, so there the iterator is driven from an async generator instead.
+    """
+    if isinstance(request, ASGIRequest):
+        return _iterate_in_thread(iterator, batch_size)
+    return iterator
+
+
+# Export lines taken per trip to the sync thread under ASGI
+EXPORT_LINES_PER_FETCH = 200
+
+
+def _sse_event(event, data):
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@login_required
+@csrf_exempt
+def stream_message(request):
+    """Send a message and stream the AI response as server-sent events"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        message_content = data.get('message', '').strip()
+        conversation_id = data.get('conversation_id')
+        
+        if not message_content:
+            return JsonResponse({'error': 'Message cannot be empty'}, status=400)
         
+        check_rate_limit(request.user)
+        
+        # Existing conversation, or a new one created together with the messages
+        conversation = None
+        if conversation_id:
+            conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+            restore_conversation(conversation)
+    except RateLimitExceeded as e:
+        return _rate_limited(e)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+    
+    ai_service = AIService()
+    conversation_history = conversation.recent_history() if conversation else None
+    
+    def event_stream():
+        nonlocal conversation
+        chunks = []
+        save_attempted = False
+        try:
+            # A new conversation's id only exists once the exchange is saved; it comes with 'done'
+            yield _sse_event('start', {'conversation_id': conversation.id if conversation else None})
+            
+            for delta in ai_service.stream_response(
+                message_content, conversation_history, summary=conversation.summary if conversation else ''
+            ):
+                chunks.append(delta)
+                yield _sse_event('delta', {'content': delta})
+            
+            # Persist both messages once the stream is complete
+            save_attempted = True
+            conversation, user_message, ai_message = record_exchange(
+                request.user, conversation, message_content, ''.join(chunks).strip()
+            )
+            record_token_usage(request.user, ai_service.prompt_tokens, ai_message)
+            
+            # Title the conversation off the request path; clients poll conversation_title
+            title_pending = not conversation.title
+            # Only the exchange that starts the conversation queues one; sends made while it is
+            # being generated would queue more upstream calls titled from later messages
+            if title_pending and conversation.message_count == 2:
+                generate_conversation_title.enqueue(conversation.id, message_content)
+            update_conversation_summary.enqueue(conversation.id)
+            
+            yield _sse_event('done', {
+                'conversation_id': conversation.id,
+                'user_message': {
+                    'id': user_message.id,
+                    'content': user_message.content,
+                    'created_at': user_message.created_at.isoformat(),
+                },
+                'ai_message': {
+                    'id': ai_message.id,
+                    'content': ai_message.content,
+                    'created_at': ai_message.created_at.isoformat(),
+                },
+                'conversation_title': conversation.title,
+                'title_pending': title_pending,
+            })
+        finally:
+            # Keep whatever was generated if the client went away mid-stream; a save that
+            # failed above is not retried (and nothing is saved before the first delta)
+            if not save_attempted and chunks:
+                _, _, ai_message = record_exchange(
+                    request.user, conversation, message_content, ''.join(chunks).strip()
+                )
+                record_token_usage(request.user, ai_service.prompt_tokens, ai_message)
+    
+    # One delta per trip, so each is flushed as soon as it arrives
+    response = StreamingHttpResponse(_streaming_content(request, event_stream()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering so deltas flush immediately
+    return response
+
+
+@login_required
+def export_conversations(request):
+    """Download all of the user's conversations and messages as JSON Lines (see chat/exports.py)"""
+    # Streamed from chunked queries, so memory stays flat however long the history is
+    lines = _streaming_content(request, export_lines(request.user), batch_size=EXPORT_LINES_PER_FETCH)
+    response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="chat-export-{timezone.now():%Y%m%d}.jsonl"'
+    return response
 
 
 @login_required
@@ -199,6 +516,17 @@ def api_delete_conversation(request, conversation_id):
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+@login_required
+def conversation_title(request, conversation_id):
+    """API endpoint to poll for a conversation title generated in the background"""
+    conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+    return JsonResponse({
+        'conversation_id': conversation.id,
+        'title': conversation.title,
+        'title_pending': not conversation.title,
+    })
+
+
 class ConversationListView(ListView):
     """List all conversations for the user"""
     model = Conversation
@@ -207,4 +535,16 @@ class ConversationListView(ListView):
     paginate_by = 20
     
     def get_queryset(self):
-        return Conversation.objects.filter(user=self.request.user)
\ No newline at end of file
+        return Conversation.objects.filter(user=self.request.user)
+
+
+def prometheus_metrics(request):
+    """Prometheus scrape endpoint for the metrics in chat.metrics"""
+    # Denied by default: REMOTE_ADDR is loopback for every client behind a local reverse proxy
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    allowed = request.user.is_staff or bool(token) and constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    )
+    if not allowed:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
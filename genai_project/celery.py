@@ -0,0 +1,17 @@
+"""
+Celery application for genai_project.
+
+Only used when CHAT_TASK_BACKEND = 'celery'. Start workers with:
+
+    celery -A genai_project worker -l info
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genai_project.settings')
+
+app = Celery('genai_project')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,28 @@
+"""
+Per-connection database tuning.
+
+Connected to django.db.backends.signals.connection_created in
+chat.apps.ChatConfig.ready().
+"""
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to a freshly opened SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        
+        if 'journal_mode' in pragmas:
+            # In-memory databases (tests) silently keep journal_mode=memory
+            mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            if mode.lower() not in (str(pragmas['journal_mode']).lower(), 'memory'):
+                logger.warning(f"SQLite journal_mode is {mode}, expected {pragmas['journal_mode']}")
@@ -58,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total and Server-Timing header cover everything below
+    'chat.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,17 +90,83 @@ TEMPLATES = [
 WSGI_APPLICATION = 'genai_project.wsgi.application'
 
 
-# Database - Development SQLite configuration
+# Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# DATABASE_PROFILE selects the backend:
+# - 'sqlite' (default): file database tuned for concurrent chat writers; the
+#   SQLITE_PRAGMAS below are applied to every new connection (see genai_project/db.py)
+# - 'postgresql': psycopg2 with persistent, health-checked connections
+
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+# Seconds a connection is kept open across requests (0 closes it after each request)
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DATABASE_PROFILE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'genai'),
+            'USER': os.environ.get('POSTGRES_USER', 'genai'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('POSTGRES_CONNECT_TIMEOUT', 5)),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+            },
+        }
     }
+
+# Applied in order on every new SQLite connection. WAL lets readers proceed while
+# one writer commits; synchronous=NORMAL is durable across application crashes in WAL mode.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)) * 1000,
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -32000)),  # Negative: KiB, i.e. ~32 MB
+    'temp_store': 'MEMORY',
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+AI_RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('AI_RESPONSE_CACHE_MAX_ENTRIES', 1000))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Euron API response cache (chat/cache.py). LocMemCache evicts least-recently-used
+    # entries; CULL_FREQUENCY == MAX_ENTRIES drops a single entry per cull.
+    'ai_responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ai-responses',
+        'TIMEOUT': int(os.environ.get('AI_RESPONSE_CACHE_TTL', 3600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': AI_RESPONSE_CACHE_MAX_ENTRIES,
+            'CULL_FREQUENCY': AI_RESPONSE_CACHE_MAX_ENTRIES,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -155,6 +223,128 @@ AUTH_USER_MODEL = 'accounts.CustomUser'
 
 # Euron API Configuration
 EURON_API_KEY = 'euri-94dee66c5f9b41981308651c7985cbf1db0ed7307f498e8e70ccc1da7c84c343'
+EURON_API_URL = os.environ.get('EURON_API_URL', 'https://api.euron.one/api/v1/euri/chat/completions')
+
+# Opt-in cache of identical Euron API requests (see chat/cache.py)
+AI_RESPONSE_CACHE_ENABLED = os.environ.get('AI_RESPONSE_CACHE_ENABLED', 'False') == 'True'
+AI_RESPONSE_CACHE_ALIAS = 'ai_responses'
+AI_RESPONSE_CACHE_MAX_ENTRY_BYTES = 64 * 1024
+
+# Conversation context sent with each message (see chat/context.py)
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 3000))
+CHAT_CONTEXT_MAX_MESSAGE_TOKENS = int(os.environ.get('CHAT_CONTEXT_MAX_MESSAGE_TOKENS', 800))
+CHAT_CONTEXT_MAX_MESSAGES = 50
+
+# Messages rendered per page of the chat view ("load older" fetches the next page)
+CHAT_MESSAGES_PAGE_SIZE = 50
+
+# Rolling conversation summary: turns older than the newest CHAT_SUMMARY_KEEP_RECENT
+# messages are folded into Conversation.summary once CHAT_SUMMARY_MIN_BATCH accumulate
+CHAT_SUMMARY_KEEP_RECENT = 10
+CHAT_SUMMARY_MIN_BATCH = 10
+CHAT_SUMMARY_MAX_BATCH = 40
+CHAT_SUMMARY_MAX_TOKENS = 400
+
+# Shared HTTP connection pool for Euron API calls (see chat/http.py)
+EURON_HTTP_POOL_SIZE = int(os.environ.get('EURON_HTTP_POOL_SIZE', 20))
+EURON_HTTP_CONNECT_TIMEOUT = float(os.environ.get('EURON_HTTP_CONNECT_TIMEOUT', 5))
+EURON_HTTP_READ_TIMEOUT = float(os.environ.get('EURON_HTTP_READ_TIMEOUT', 30))
+EURON_HTTP_MAX_RETRIES = int(os.environ.get('EURON_HTTP_MAX_RETRIES', 2))
+EURON_HTTP_BACKOFF_FACTOR = 0.5
+EURON_HTTP_BACKOFF_JITTER = 0.25
+# Longest wait before a retry, including waits asked for by a Retry-After header
+EURON_HTTP_BACKOFF_MAX = float(os.environ.get('EURON_HTTP_BACKOFF_MAX', 30))
+
+# Circuit breaker and concurrency limit for Euron API calls (see chat/resilience.py);
+# rejected calls get AIService's fallback reply immediately
+EURON_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('EURON_CIRCUIT_FAILURE_THRESHOLD', 5))
+EURON_CIRCUIT_RECOVERY_TIMEOUT = float(os.environ.get('EURON_CIRCUIT_RECOVERY_TIMEOUT', 30))
+EURON_CIRCUIT_HALF_OPEN_MAX_CALLS = 1
+EURON_MAX_CONCURRENT_REQUESTS = int(os.environ.get('EURON_MAX_CONCURRENT_REQUESTS', 8))
+EURON_BULKHEAD_MAX_WAIT = float(os.environ.get('EURON_BULKHEAD_MAX_WAIT', 1.0))
+
+# Identical concurrent Euron requests share one upstream call (see chat/singleflight.py).
+# AI_SINGLEFLIGHT_SHARED also coalesces across processes through a lock in the
+# AI_SINGLEFLIGHT_CACHE_ALIAS cache, which must then be shared (e.g. Redis)
+AI_SINGLEFLIGHT_ENABLED = os.environ.get('AI_SINGLEFLIGHT_ENABLED', 'True') == 'True'
+AI_SINGLEFLIGHT_SHARED = os.environ.get('AI_SINGLEFLIGHT_SHARED', 'False') == 'True'
+AI_SINGLEFLIGHT_CACHE_ALIAS = 'default'
+AI_SINGLEFLIGHT_WAIT_TIMEOUT = 60
+AI_SINGLEFLIGHT_LOCK_TIMEOUT = 60
+AI_SINGLEFLIGHT_RESULT_TTL = 10
+AI_SINGLEFLIGHT_POLL_INTERVAL = 0.05
+
+# Upstream routes per task type (see chat/routing.py). A route is a model on an
+# endpoint (url defaults to EURON_API_URL); each task tries its routes fastest
+# healthy first and fails over down the list, e.g. 'chat': ['euron', 'euron-mini']
+# with 'euron-mini': {'model': 'gpt-4.1-mini'}
+AI_ROUTES = {
+    'euron': {'model': 'gpt-4.1-nano'},
+}
+AI_TASK_ROUTES = {
+    'chat': ['euron'],
+    'title': ['euron'],
+    'summary': ['euron'],
+}
+AI_ROUTE_EWMA_ALPHA = 0.2
+AI_ROUTE_LATENCY_WINDOW = 200
+AI_ROUTE_MAX_ERROR_RATE = 0.5
+AI_ROUTE_RECOVERY_TIMEOUT = 30
+# Hedged requests: a call slower than its route's p95 latency gets a second request
+# on the next route (or the same one) and the first answer wins
+AI_HEDGE_ENABLED = os.environ.get('AI_HEDGE_ENABLED', 'False') == 'True'
+AI_HEDGE_MIN_SAMPLES = 20
+AI_HEDGE_MIN_DELAY = 0.1
+AI_HEDGE_WORKERS = 16
+
+# Per-user limits on upstream AI calls (see chat/ratelimit.py). Users get the first
+# tier named after one of their groups, else 'default'; over-limit sends get a 429.
+# Use a cache shared by all processes (e.g. Redis) when running several workers.
+CHAT_RATE_LIMIT_ENABLED = os.environ.get('CHAT_RATE_LIMIT_ENABLED', 'True') == 'True'
+CHAT_RATE_LIMIT_CACHE_ALIAS = 'default'
+CHAT_RATE_LIMIT_TIER_CACHE_TTL = 300
+CHAT_RATE_LIMIT_TIERS = {
+    'default': {
+        'requests_per_minute': int(os.environ.get('CHAT_RATE_LIMIT_PER_MINUTE', 10)),
+        'burst': int(os.environ.get('CHAT_RATE_LIMIT_BURST', 5)),
+        'daily_tokens': int(os.environ.get('CHAT_DAILY_TOKEN_QUOTA', 100000)),
+    },
+    'premium': {'requests_per_minute': 30, 'burst': 10, 'daily_tokens': 1000000},
+    # None disables a limit
+    'unlimited': {'requests_per_minute': None, 'burst': None, 'daily_tokens': None},
+}
+
+# Archival of inactive conversations (see chat/archive.py and the
+# archive_conversations command): their messages move into one compressed row
+# each and come back when the conversation is opened. 'zstd' needs zstandard.
+CHAT_ARCHIVE_INACTIVE_DAYS = int(os.environ.get('CHAT_ARCHIVE_INACTIVE_DAYS', 180))
+CHAT_ARCHIVE_CODEC = os.environ.get('CHAT_ARCHIVE_CODEC', 'zlib')
+# None uses the codec's default (zlib 6, zstd 10)
+CHAT_ARCHIVE_COMPRESSION_LEVEL = None
+
+# Per-user cache of the chat sidebar (see chat/sidebar.py), dropped whenever the
+# user's conversations change. Use a cache shared by all processes when running
+# several workers, or other workers show a stale sidebar until the timeout.
+CHAT_SIDEBAR_CACHE_ENABLED = os.environ.get('CHAT_SIDEBAR_CACHE_ENABLED', 'True') == 'True'
+CHAT_SIDEBAR_CACHE_ALIAS = 'default'
+CHAT_SIDEBAR_CACHE_TIMEOUT = 300
+
+# Background tasks (see chat/tasks.py): 'thread', 'celery' or 'eager'
+CHAT_TASK_BACKEND = os.environ.get('CHAT_TASK_BACKEND', 'thread')
+CHAT_TASK_WORKERS = int(os.environ.get('CHAT_TASK_WORKERS', 4))
+CHAT_TASK_QUEUE_SIZE = int(os.environ.get('CHAT_TASK_QUEUE_SIZE', 1000))
+
+# Celery broker, only used when CHAT_TASK_BACKEND = 'celery'
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_TASK_IGNORE_RESULT = True
+
+# Request metrics (chat.middleware.RequestMetricsMiddleware)
+# Adds a Server-Timing header with the db/upstream/render breakdown to every response.
+# Off unless DEBUG: it tells any client how many queries and how much time a request took.
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', str(DEBUG)) == 'True'
+# Bearer token for the Prometheus endpoint at /metrics; without one only staff
+# users may scrape it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
 
 # Django REST Framework
 REST_FRAMEWORK = {
@@ -19,6 +19,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import RedirectView
 from accounts.views import CustomLoginView
+from chat.views import prometheus_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -27,6 +28,7 @@ urlpatterns = [
     path('auth/', include('accounts.urls')),
     path('chat/', include('chat.urls')),
     path('api/', include('chat.api_urls')),
+    path('metrics', prometheus_metrics, name='metrics'),
     path('', RedirectView.as_view(url='/chat/', permanent=False)),
 ]
 
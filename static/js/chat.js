@@ -94,6 +94,13 @@ function initializeChat() {
     // Scroll to bottom of messages
     if (messagesContainer) {
         scrollToBottom();
+        
+        // Load older messages when scrolled to the top
+        messagesContainer.addEventListener('scroll', function() {
+            if (this.scrollTop < 50) {
+                loadOlderMessages();
+            }
+        });
     }
 
     // Get current conversation ID
@@ -155,14 +162,11 @@ function handleSubmit(e) {
 }
 
 function sendMessage(message) {
-    const url = currentConversationId ? 
-        '/chat/send/' : 
-        '/chat/send/';
-    
-    fetch(url, {
+    fetch('/chat/send/stream/', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
             'X-CSRFToken': getCsrfToken()
         },
         body: JSON.stringify({
@@ -170,29 +174,45 @@ function sendMessage(message) {
             conversation_id: currentConversationId
         })
     })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            // Update conversation ID if this was a new conversation
-            if (data.conversation_id && !currentConversationId) {
-                currentConversationId = data.conversation_id;
-                const conversationIdInput = document.getElementById('conversationId');
-                if (conversationIdInput) {
-                    conversationIdInput.value = currentConversationId;
+    .then(response => {
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!response.ok || !response.body || !contentType.startsWith('text/event-stream')) {
+            return response.json().then(data => {
+                throw new Error(data.error || 'Unknown error');
+            });
+        }
+        
+        let aiTextDiv = null;
+        let aiContent = '';
+        
+        return readEventStream(response, (event, data) => {
+            if (event === 'start') {
+                setCurrentConversation(data.conversation_id);
+            } else if (event === 'delta') {
+                if (!aiContent) {
+                    aiTextDiv = addMessage('', false);
+                    // Hide the spinner as soon as the first token arrives
+                    const loadingOverlay = document.getElementById('loadingOverlay');
+                    if (loadingOverlay) {
+                        loadingOverlay.classList.remove('show');
+                    }
+                }
+                aiContent += data.content;
+                if (aiTextDiv) {
+                    setMessageText(aiTextDiv, aiContent);
+                    scrollToBottom();
+                }
+            } else if (event === 'done') {
+                // New conversations are only created with the reply
+                setCurrentConversation(data.conversation_id);
+                if (aiTextDiv && data.ai_message) {
+                    setMessageText(aiTextDiv, data.ai_message.content);
+                }
+                if (data.title_pending) {
+                    pollConversationTitle(data.conversation_id);
                 }
-                // Update URL to include conversation parameter
-                const newUrl = new URL(window.location);
-                newUrl.searchParams.set('conversation', currentConversationId);
-                window.history.pushState({}, '', newUrl);
-            }
-            
-            // Add AI response to chat
-            if (data.ai_message && data.ai_message.content) {
-                addMessage(data.ai_message.content, false);
             }
-        } else {
-            showError('Failed to send message: ' + (data.error || 'Unknown error'));
-        }
+        });
     })
     .catch(error => {
         console.error('Error:', error);
@@ -203,10 +223,98 @@ function sendMessage(message) {
     });
 }
 
-function addMessage(content, isUser) {
-    const messagesContainer = document.getElementById('messagesContainer');
-    if (!messagesContainer) return;
+function readEventStream(response, onEvent) {
+    // Minimal server-sent events parser over a fetch() body stream
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
     
+    function dispatch(block) {
+        let event = 'message';
+        const dataLines = [];
+        block.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (dataLines.length) {
+            onEvent(event, JSON.parse(dataLines.join('\n')));
+        }
+    }
+    
+    function pump() {
+        return reader.read().then(({ done, value }) => {
+            if (done) {
+                if (buffer.trim()) {
+                    dispatch(buffer);
+                }
+                return;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                dispatch(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+            }
+            return pump();
+        });
+    }
+    
+    return pump();
+}
+
+function pollConversationTitle(conversationId, attempt = 0) {
+    // Titles are generated in the background after the first reply
+    if (attempt >= 5) return;
+    
+    setTimeout(() => {
+        fetch(`/chat/api/conversations/${conversationId}/title/`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.title_pending) {
+                pollConversationTitle(conversationId, attempt + 1);
+                return;
+            }
+            const titleDiv = document.querySelector(
+                `.conversation-item[data-conversation-id="${conversationId}"] .conversation-title`
+            );
+            if (titleDiv) {
+                titleDiv.textContent = data.title;
+            }
+        })
+        .catch(error => console.error('Error fetching conversation title:', error));
+    }, 1000 * Math.pow(2, attempt));
+}
+
+function setCurrentConversation(conversationId) {
+    // Update conversation ID if this was a new conversation
+    if (conversationId && !currentConversationId) {
+        currentConversationId = conversationId;
+        const conversationIdInput = document.getElementById('conversationId');
+        if (conversationIdInput) {
+            conversationIdInput.value = currentConversationId;
+        }
+        // Update URL to include conversation parameter
+        const newUrl = new URL(window.location);
+        newUrl.searchParams.set('conversation', currentConversationId);
+        window.history.pushState({}, '', newUrl);
+    }
+}
+
+function setMessageText(element, content) {
+    // Message content is untrusted: add it as text nodes, with <br> for line breaks
+    element.textContent = '';
+    content.split('\n').forEach((line, index) => {
+        if (index > 0) {
+            element.appendChild(document.createElement('br'));
+        }
+        element.appendChild(document.createTextNode(line));
+    });
+}
+
+function createMessageElement(content, isUser, timestamp) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${isUser ? 'user' : 'ai'}`;
     
@@ -221,11 +329,11 @@ function addMessage(content, isUser) {
     
     const textDiv = document.createElement('div');
     textDiv.className = 'message-text';
-    textDiv.innerHTML = content.replace(/\n/g, '<br>');
+    setMessageText(textDiv, content);
     
     const timeDiv = document.createElement('div');
     timeDiv.className = 'message-time';
-    timeDiv.textContent = new Date().toLocaleTimeString('en-US', { 
+    timeDiv.textContent = (timestamp ? new Date(timestamp) : new Date()).toLocaleTimeString('en-US', { 
         hour: '2-digit', 
         minute: '2-digit' 
     });
@@ -235,9 +343,51 @@ function addMessage(content, isUser) {
     
     messageDiv.appendChild(avatarDiv);
     messageDiv.appendChild(contentDiv);
+    return messageDiv;
+}
+
+function addMessage(content, isUser) {
+    const messagesContainer = document.getElementById('messagesContainer');
+    if (!messagesContainer) return null;
     
+    const messageDiv = createMessageElement(content, isUser);
     messagesContainer.appendChild(messageDiv);
     scrollToBottom();
+    return messageDiv.querySelector('.message-text');
+}
+
+let isLoadingOlder = false;
+
+function loadOlderMessages() {
+    // The chat view renders only the newest page; the template exposes the
+    // cursor for the next (older) page as data-older-cursor on the container
+    const messagesContainer = document.getElementById('messagesContainer');
+    if (!messagesContainer || isLoadingOlder || !currentConversationId) return;
+    
+    const cursor = messagesContainer.dataset.olderCursor;
+    if (!cursor) return;
+    
+    isLoadingOlder = true;
+    fetch(`/chat/api/conversations/${currentConversationId}/messages/older/?cursor=${encodeURIComponent(cursor)}`)
+    .then(response => response.json())
+    .then(data => {
+        if (!data.messages) return;
+        
+        // Prepend without making the visible messages jump
+        const previousHeight = messagesContainer.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        data.messages.forEach(message => {
+            fragment.appendChild(createMessageElement(message.content, message.is_from_user, message.created_at));
+        });
+        messagesContainer.insertBefore(fragment, messagesContainer.firstChild);
+        messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+        
+        messagesContainer.dataset.olderCursor = data.older_messages_cursor || '';
+    })
+    .catch(error => console.error('Error loading older messages:', error))
+    .finally(() => {
+        isLoadingOlder = false;
+    });
 }
 
 function setLoading(loading) {